@@ -1,102 +1,951 @@
 from pydantic import BaseModel, ConfigDict
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set, Tuple
 from uuid import UUID, uuid4
 import asyncio
+import os
+from collections import Counter
+import numpy as np
 from datetime import datetime, timedelta
 from geopy.distance import geodesic
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import update
-from db.database import get_db
-from db.models import AgencyModel, DonationModel, RequirementModel, VolunteerModel
+from sqlalchemy import update, delete, values, column, cast, func, exists
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db.database import AsyncSessionLocal, DATABASE_URL, pool_stats
+from db.geo import GeoSearch, detect_geo_backend
+from db.models import AgencyModel, DonationModel, RequirementModel, VolunteerModel, AllocationQueueStateModel
 from schemas.Agency import Agency
 from schemas.FoodType import FoodType
 from schemas.Requirement import Requirement
 from schemas.Donation import Donation
 from schemas.Volunteer import Volunteer
 from schemas.DonationStatus import DonationStatus
-from fastapi import Depends
+from utils.ranking import RankingEngine
+from utils.spatial_index import SpatialIndex
+from utils.scheduler import AllocationScheduler
+from utils.allocation_queue import AllocationQueue
+from utils.write_behind import WriteBehindBuffer
+from utils.change_bus import create_change_bus, asyncpg_dsn
+from utils.sharding import ShardLeases, shard_of
+from utils.requirement_cache import RequirementCache
+from utils.connection_manager import ConnectionManager, new_event_id
+from utils.event_bus import DonationEventBus
+from utils.identity_cache import identity_cache
+
+REQUIREMENTS_CHANNEL = "requirements"
+AGENCIES_CHANNEL = "agencies"
+VOLUNTEERS_CHANNEL = "volunteers"
+COMMANDS_CHANNEL = "allocation_commands"
+REPLIES_CHANNEL = "allocation_replies"
+AGENCY_EVENTS_CHANNEL = "agency_events"
+DONATION_EVENTS_CHANNEL = "donation_events"
+IDENTITIES_CHANNEL = "identities"
+# Donations per routed allocate command, keeping each NOTIFY payload under Postgres' 8000 byte limit
+ROUTE_CHUNK = 20
+# Agency and donation events per NOTIFY, for the same reason
+EVENT_CHUNK = 20
+# Sends of a routed command or its reply before giving up on it; a failed send is retried after 0.1s, 0.2s, ...
+ROUTE_SEND_ATTEMPTS = 3
+# Delay before retrying a donation whose expired deadline could not be handled
+ADVANCE_RETRY_SECONDS = 30
+
+def donation_status_event(donation) -> Dict:
+    """Status event for a Donation or DonationModel."""
+    return {
+        "donation_id": str(donation.id),
+        "donor_id": str(donation.donor_id),
+        "agency_id": str(donation.agency_id) if donation.agency_id is not None else None,
+        "status": DonationStatus(donation.status).value,
+    }
+
 
 class AllocationSystem():
     
-    def __init__(self, db):
-        self.db = db
-        self.queue_move_interval= int = 600
-        self.allocation_queues= {}
+    def __init__(self, session_factory=AsyncSessionLocal):
+        # Each unit of work borrows its own session from the pool instead of sharing one connection
+        self.session_factory = session_factory
+        self.queue_move_interval: int = 600
+        self.allocation_queues: Dict[UUID, AllocationQueue] = {}
         self.allocation_timers= {}
-        self.agency_requirements= {}
+        # Number of ranked agencies a pending donation holds at a time; the next window is ranked on demand
+        self.queue_window = int(os.getenv("ALLOCATION_QUEUE_WINDOW", "16"))
+        # Lazy ranking only selects and sorts the top queue_window agencies instead of sorting every agency
+        self.lazy_ranking = os.getenv("ALLOCATION_LAZY_RANKING", "true").lower() == "true"
+        self.queue_metrics = {"queues_created": 0, "extensions": 0, "exhausted": 0}
+        self.accept_depths: Counter = Counter()
+        self.requirements = RequirementCache()
+        self.ranking = RankingEngine(refine_top_k=int(os.getenv("ALLOCATION_GEODESIC_REFINE_K", "0")))
+        # Agencies further than this from a donation never enter its queue; unset means no limit
+        max_radius = os.getenv("ALLOCATION_MAX_RADIUS_KM")
+        self.max_allocation_radius_km = float(max_radius) if max_radius else None
+        # Snapshot of every agency; donations are ranked against it without querying agencies
+        self.agencies: Dict[UUID, Agency] = {}
+        self.agency_index = SpatialIndex()
+        self.volunteer_index = SpatialIndex()
+        # SPATIAL_SEARCH=database runs volunteer matching and agency candidate selection as KNN queries on the
+        # geo columns instead of the in-memory indexes; a new donation then considers its nearest
+        # ALLOCATION_KNN_CANDIDATES agencies (within the radius limit, if any)
+        self.spatial_search = os.getenv("SPATIAL_SEARCH", "memory")
+        self.knn_candidates = int(os.getenv("ALLOCATION_KNN_CANDIDATES", "200"))
+        self.geo: Optional[GeoSearch] = None
+        self.volunteers: Dict[UUID, Volunteer] = {}
+        # One task drives every allocation deadline instead of a polling task per donation
+        self.scheduler = AllocationScheduler(self.advance_expired)
+        # With shared timers, workers claim due queues from allocation_queue_state with SKIP LOCKED instead
+        self.shared_timers = os.getenv("ALLOCATION_SHARED_TIMERS", "false").lower() == "true"
+        self.timer_poll_interval = float(os.getenv("ALLOCATION_TIMER_POLL_SECONDS", "1"))
+        self.timer_claim_batch = int(os.getenv("ALLOCATION_TIMER_CLAIM_BATCH", "500"))
+        self.timer_task: Optional[asyncio.Task] = None
+        self.timer_metrics = {"claims": 0, "claimed": 0}
+        # Allocation-owned donation fields are written behind, coalesced per donation and batched
+        self.donation_writes = WriteBehindBuffer(
+            self._flush_donation_updates,
+            max_batch=int(os.getenv("DONATION_WRITE_BATCH", "500")),
+            max_delay=int(os.getenv("DONATION_WRITE_DELAY_MS", "200")) / 1000,
+            max_attempts=int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5")),
+            max_backoff=float(os.getenv("WRITE_BEHIND_MAX_BACKOFF_SECONDS", "30"))
+        )
+        # Queue positions and deadlines are persisted the same way so a restart resumes them
+        self.queue_writes = WriteBehindBuffer(
+            self._flush_queue_states,
+            max_batch=int(os.getenv("QUEUE_STATE_WRITE_BATCH", "500")),
+            max_delay=int(os.getenv("QUEUE_STATE_WRITE_DELAY_MS", "200")) / 1000,
+            max_attempts=int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5")),
+            max_backoff=float(os.getenv("WRITE_BEHIND_MAX_BACKOFF_SECONDS", "30"))
+        )
+        # Requirement changes reach every worker's cache through the bus once their transaction commits
+        self.change_bus = create_change_bus(DATABASE_URL)
+        self.change_bus.subscribe(REQUIREMENTS_CHANNEL, self.apply_requirement_change, resync=self.load_requirements)
+        self.change_bus.subscribe(AGENCIES_CHANNEL, self.apply_agency_change, resync=self.load_agencies)
+        self.change_bus.subscribe(VOLUNTEERS_CHANNEL, self.apply_volunteer_change, resync=self.load_volunteers)
+        # Renamed or deleted agencies and donors drop out of every worker's identity cache
+        self.change_bus.subscribe(IDENTITIES_CHANNEL, self.apply_identity_change, resync=self.resync_identities)
+        # Pending donations are recovered in the background, streamed and ranked this many at a time
+        self.recovery_batch_size = int(os.getenv("RECOVERY_BATCH_SIZE", "1000"))
+        self.recovery_task: Optional[asyncio.Task] = None
+        # Donations settled while recovery runs; the recovery snapshot may still list them as pending
+        self._settled_during_recovery = set()
+        self.recovery = self._new_recovery_progress()
+        # Sharded mode: recovery progress of every shard this worker took, by shard
+        self.shard_recovery: Dict[int, Dict] = {}
+        # Sharded mode: each donation belongs to shard hash(id) % ALLOCATION_SHARDS, and only the worker holding
+        # that shard's advisory lock keeps its queue and timer; other workers route requests to it over the bus
+        self.shards = int(os.getenv("ALLOCATION_SHARDS", "0"))
+        self.leases: Optional[ShardLeases] = None
+        if self.shards:
+            self.leases = ShardLeases(
+                asyncpg_dsn(DATABASE_URL),
+                self.shards,
+                on_acquired=self._on_shards_acquired,
+                on_lost=self._on_shards_lost,
+                on_released=self._on_shards_released,
+                interval=float(os.getenv("ALLOCATION_SHARD_SWEEP_SECONDS", "5"))
+            )
+            self.shared_timers = False
+        self.route_timeout = float(os.getenv("ALLOCATION_ROUTE_TIMEOUT", "5"))
+        self.worker_id = uuid4().hex
+        self._pending_replies: Dict[str, asyncio.Future] = {}
+        self.route_metrics = {"routed": 0, "served": 0, "timeouts": 0, "send_failures": 0}
+        self.change_bus.subscribe(COMMANDS_CHANNEL, self._on_command)
+        self.change_bus.subscribe(REPLIES_CHANNEL, self._on_reply)
+        # Offers are pushed to agencies over WebSockets; events go through the bus because the agency's socket
+        # may be held by another worker than the one owning the donation
+        self.connections = ConnectionManager(
+            send_buffer=int(os.getenv("WS_SEND_BUFFER", "64")),
+            history=int(os.getenv("WS_EVENT_HISTORY", "100")),
+            heartbeat=float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+        )
+        self.change_bus.subscribe(AGENCY_EVENTS_CHANNEL, self._on_agency_events)
+        # Status changes feed the donation event streams of every worker
+        self.donation_events = DonationEventBus()
+        self.change_bus.subscribe(DONATION_EVENTS_CHANNEL, self._on_donation_events)
         
     _instance = None
 
+    @staticmethod
+    def _new_recovery_progress() -> Dict:
+        return {"state": "pending", "total": None, "recovered": 0, "restored": 0, "started_at": None, "finished_at": None, "error": None}
+
     @classmethod
-    async def get_instance(cls, db: AsyncSession = None):
+    async def get_instance(cls):
         if cls._instance is None:
-            if db is None:
-                raise ValueError("Database session is required for initialization")
-            cls._instance = cls(db=db)
+            cls._instance = cls()
             await cls._instance.initialize()
         return cls._instance
 
     async def initialize(self):
+        # Listen before loading so no change committed after the load is missed
+        await self.change_bus.start()
+        if self.spatial_search == "database":
+            async with self.session_factory() as db:
+                backend = await detect_geo_backend(db)
+            if backend is None:
+                print("SPATIAL_SEARCH=database but the geo columns are missing; using in-memory search")
+            else:
+                self.geo = GeoSearch(backend)
         await self.load_requirements()
-        await self.recover_pending_donations()
+        await self.load_agencies()
+        await self.load_volunteers()
+        if self.shared_timers:
+            self.timer_task = asyncio.create_task(self._claim_expired_loop())
+        else:
+            self.scheduler.start()
+        if self.leases is None:
+            self.recovery_task = asyncio.create_task(self.recover_pending_donations())
+            return
+        # Taking shards starts their recovery; a worker that gets none has nothing to recover
+        await self.leases.start()
+        if self.recovery_task is None:
+            self.recovery.update(state="done", total=0, finished_at=datetime.now().isoformat())
+
+    def owns(self, donation_id: UUID) -> bool:
+        return self.leases is None or self.leases.owns(donation_id)
+
+    def new_donation_id(self) -> UUID:
+        """Id for a donation created here; in sharded mode it falls in a shard this worker owns."""
+        return uuid4() if self.leases is None else self.leases.new_donation_id()
+
+    async def _on_shards_acquired(self, shards: Set[int]):
+        """
+        Recover the new shards' pending donations. The shards taken at startup report through self.recovery and
+        gate readiness; shards taken later, on failover or rebalancing, report per shard in shard_recovery only,
+        so readiness does not flip back while they recover.
+        """
+        previous = self.recovery_task
+        progress = self.recovery if self.recovery["state"] == "pending" else self._new_recovery_progress()
+        for shard in shards:
+            self.shard_recovery[shard] = progress
+
+        async def recover():
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            await self.recover_pending_donations(shards, progress)
+
+        self.recovery_task = asyncio.create_task(recover())
+
+    def _on_shards_lost(self, shards: Set[int]):
+        """Forget queues of shards another worker may now own; their state stays in allocation_queue_state."""
+        for donation_id in [donation_id for donation_id in self.allocation_queues if shard_of(donation_id, self.shards) in shards]:
+            del self.allocation_queues[donation_id]
+            self.allocation_timers.pop(donation_id, None)
+            self.scheduler.cancel(donation_id)
+        for shard in shards:
+            self.shard_recovery.pop(shard, None)
+        print(f"Lost allocation shards {sorted(shards)}")
+
+    async def _on_shards_released(self, shards: Set[int]):
+        """Hand shards over on rebalancing: forget their queues and write out their buffered state first."""
+        self._on_shards_lost(shards)
+        try:
+            await self.queue_writes.flush()
+            await self.donation_writes.flush()
+        except Exception as e:
+            print(f"Error writing state of released shards {sorted(shards)}: {str(e)}")
+
+    async def _route(self, op: str, donation_id: UUID, payload: Dict):
+        """Run op on the worker owning donation_id's shard and return its result, or None if no owner answered."""
+        request_id = uuid4().hex
+        reply = asyncio.get_running_loop().create_future()
+        self._pending_replies[request_id] = reply
+        self.route_metrics["routed"] += 1
+        command = {"request_id": request_id, "shard": shard_of(donation_id, self.shards), "op": op, **payload}
+        try:
+            try:
+                await self._send_retrying(COMMANDS_CHANNEL, command)
+            except Exception as e:
+                print(f"Could not send {op} for Donation {donation_id} after {ROUTE_SEND_ATTEMPTS} attempts: {str(e)}")
+                return None
+            return await asyncio.wait_for(reply, self.route_timeout)
+        except asyncio.TimeoutError:
+            self.route_metrics["timeouts"] += 1
+            print(f"No owner answered {op} for Donation {donation_id} within {self.route_timeout}s")
+            return None
+        finally:
+            self._pending_replies.pop(request_id, None)
+
+    async def _send_retrying(self, channel: str, message: Dict):
+        """Send on the change bus, retrying a failed send; raises the last error once every attempt failed."""
+        for attempt in range(ROUTE_SEND_ATTEMPTS):
+            try:
+                await self.change_bus.send(channel, message)
+                return
+            except Exception:
+                self.route_metrics["send_failures"] += 1
+                if attempt + 1 == ROUTE_SEND_ATTEMPTS:
+                    raise
+                await asyncio.sleep(0.1 * 2 ** attempt)
+
+    def _on_command(self, message: Dict):
+        if self.leases is not None and message["shard"] in self.leases.owned:
+            asyncio.create_task(self._serve_command(message))
+
+    async def _serve_command(self, message: Dict):
+        op = message["op"]
+        try:
+            if op == "allocate":
+                donations = [Donation.model_validate(donation) for donation in message["donations"]]
+                await self.allocate_donations(donations)
+                result = True
+            elif op == "accept":
+                result = await self.accept_donation(UUID(message["donation_id"]), UUID(message["agency_id"]))
+            elif op == "reject":
+                result = await self.reject_donation(UUID(message["donation_id"]), UUID(message["agency_id"]))
+            else:
+                raise ValueError(f"Unknown allocation command {op}")
+        except Exception as e:
+            print(f"Error serving routed {op}: {str(e)}")
+            result = None
+        self.route_metrics["served"] += 1
+        try:
+            await self._send_retrying(REPLIES_CHANNEL, {"request_id": message["request_id"], "result": result})
+        except Exception as e:
+            # The requesting worker gives up once its route timeout passes
+            print(f"Could not reply to routed {op} {message['request_id']} after {ROUTE_SEND_ATTEMPTS} attempts: {str(e)}")
+
+    def _on_reply(self, message: Dict):
+        reply = self._pending_replies.get(message["request_id"])
+        if reply is not None and not reply.done():
+            reply.set_result(message["result"])
+
+    @property
+    def ready(self) -> bool:
+        return self.recovery["state"] == "done"
+
+    @property
+    def recovering(self) -> bool:
+        """Whether a recovery, at startup or of shards taken later, is running or waiting to run."""
+        return self.recovery_task is not None and not self.recovery_task.done()
 
     async def load_requirements(self):
         """Load all existing requirements from the database."""
         requirements = await self.get_all_requirements_from_db()
-        for req in requirements:
-            self.update_agency_requirement(req)
+        self.requirements.replace(requirements)
+        for agency_id in self.ranking.row_of:
+            self.ranking.set_requirements(agency_id, self.requirements.get(agency_id))
 
-    async def recover_pending_donations(self):
-        """Recover and reinitialize allocation for pending donations."""
-        pending_donations = await self.get_pending_donations_from_db()
+    async def load_agencies(self):
+        """Load every agency into the registry, replacing whatever it held."""
         agencies = await self.get_all_agencies_from_db()
-        
-        for donation in pending_donations:
-            print(f"Recovering allocation for Donation {donation.id}")
-            await self.allocate_donation(donation, agencies)
+        loaded = {agency.id for agency in agencies}
+        for agency_id in [agency_id for agency_id in self.agencies if agency_id not in loaded]:
+            self.remove_agency(agency_id)
+        for agency in agencies:
+            self.update_agency(agency)
+
+    async def load_volunteers(self):
+        """Load every volunteer into the snapshot and spatial index, replacing whatever they held."""
+        volunteers = await self.get_all_volunteers_from_db()
+        loaded = {volunteer.id for volunteer in volunteers}
+        for volunteer_id in [volunteer_id for volunteer_id in self.volunteers if volunteer_id not in loaded]:
+            self.remove_volunteer(volunteer_id)
+        for volunteer in volunteers:
+            self.update_volunteer(volunteer)
+
+    def update_agency(self, agency: Agency):
+        """Keep the agency registry, spatial index and ranking rows current on create, move or priority change."""
+        self.agencies[agency.id] = agency
+        self.agency_index.insert(agency.id, agency.location)
+        self.ranking.upsert_agency(agency, self.requirements.get(agency.id))
+
+    def remove_agency(self, agency_id: UUID):
+        self.agencies.pop(agency_id, None)
+        self.agency_index.remove(agency_id)
+        self.ranking.remove_agency(agency_id)
+
+    async def publish_agency(self, db: AsyncSession, agency_id: UUID, agency: Optional[Agency]):
+        """Announce an agency change made in db's transaction; agency None means it was deleted."""
+        await self.change_bus.publish(db, AGENCIES_CHANNEL, {
+            "agency_id": agency_id,
+            "agency": agency.model_dump(mode="json") if agency is not None else None,
+        })
+
+    def apply_agency_change(self, message: Dict):
+        """Change bus handler for agency changes committed by any worker."""
+        if message["agency"] is None:
+            self.remove_agency(UUID(message["agency_id"]))
+        else:
+            self.update_agency(Agency.model_validate(message["agency"]))
+
+    async def publish_identity_change(self, db: AsyncSession, entity_id: UUID):
+        """Announce that the agency or donor entity_id was renamed or deleted in db's transaction."""
+        await self.change_bus.publish(db, IDENTITIES_CHANNEL, {"entity_id": entity_id})
+
+    def apply_identity_change(self, message: Dict):
+        """Change bus handler for identity changes committed by any worker."""
+        identity_cache.invalidate_id(UUID(message["entity_id"]))
+
+    async def resync_identities(self):
+        # Invalidations may have been missed while the bus was down
+        identity_cache.clear()
+
+    def update_volunteer(self, volunteer: Volunteer):
+        """Keep the volunteer snapshot and spatial index current on create, move or capacity change."""
+        self.volunteers[volunteer.id] = volunteer
+        self.volunteer_index.insert(volunteer.id, volunteer.location)
+
+    def remove_volunteer(self, volunteer_id: UUID):
+        self.volunteers.pop(volunteer_id, None)
+        self.volunteer_index.remove(volunteer_id)
+
+    async def publish_volunteer(self, db: AsyncSession, volunteer_id: UUID, volunteer: Optional[Volunteer]):
+        """Announce a volunteer change made in db's transaction; volunteer None means it was deleted."""
+        await self.change_bus.publish(db, VOLUNTEERS_CHANNEL, {
+            "volunteer_id": volunteer_id,
+            "volunteer": volunteer.model_dump(mode="json") if volunteer is not None else None,
+        })
+
+    def apply_volunteer_change(self, message: Dict):
+        """Change bus handler for volunteer changes committed by any worker."""
+        if message["volunteer"] is None:
+            self.remove_volunteer(UUID(message["volunteer_id"]))
+        else:
+            self.update_volunteer(Volunteer.model_validate(message["volunteer"]))
+
+    async def recover_pending_donations(self, shards: Optional[Set[int]] = None, progress: Optional[Dict] = None):
+        """
+        Recover allocation for every pending donation, or only those in the given shards, in batches streamed
+        from a server-side cursor.
+
+        Allocated donations with saved queue state are restored first, in one scan of allocation_queue_state
+        by deadline, keeping their position and deadline. The remaining pending donations are ranked together
+        with rank_batch. Progress is kept in `progress`, by default self.recovery for the readiness endpoint.
+        """
+        progress = self.recovery if progress is None else progress
+        progress.update(state="running", started_at=datetime.now().isoformat())
+        try:
+            total = await self.count_pending_donations_in_db()
+            # Ids hash evenly over shards, so a subset of shards holds about its share of the backlog
+            progress["total"] = total if shards is None else round(total * len(shards) / self.shards)
+            await self.delete_stale_queue_states_in_db()
+            async for saved in self.stream_saved_queues_from_db(self.recovery_batch_size):
+                for donation, state in saved:
+                    if self._recovers(donation.id, shards):
+                        if self.shared_timers:
+                            # The saved row stays the only copy; it only has to be kept out of re-ranking below
+                            self._settled_during_recovery.add(donation.id)
+                        else:
+                            self.restore_queue(donation, state)
+                        progress["restored"] += 1
+                        progress["recovered"] += 1
+            async for donations in self.stream_pending_donations_from_db(self.recovery_batch_size):
+                donations = [donation for donation in donations if self._recovers(donation.id, shards)]
+                if donations:
+                    await self.allocate_donations(donations)
+                progress["recovered"] += len(donations)
+        except Exception as e:
+            progress.update(state="failed", error=str(e), finished_at=datetime.now().isoformat())
+            print(f"Recovering pending donations failed: {str(e)}")
+            return
+        progress.update(state="done", finished_at=datetime.now().isoformat())
+        self._settled_during_recovery.clear()
+        print(f"Recovered {progress['recovered']} pending donations ({progress['restored']} restored in place)")
+
+    def _recovers(self, donation_id: UUID, shards: Optional[Set[int]]) -> bool:
+        """Whether recovery should take a donation: in a recovered shard, and not allocated or settled since it started."""
+        if shards is not None and shard_of(donation_id, self.shards) not in shards:
+            return False
+        return donation_id not in self.allocation_queues and donation_id not in self._settled_during_recovery
+
+    def restore_queue(self, donation: Donation, state: AllocationQueueStateModel):
+        """
+        Reopen a queue from its saved state, at the same position and with the same deadline.
+
+        Agencies are saved by id because rows are local to each worker's RankingEngine; agencies deleted
+        since are dropped, and the part of the window already offered counts as offered.
+        """
+        queue = AllocationQueue(
+            donation.location,
+            donation.food_type,
+            donation.quantity,
+            self.ranking.rows_for(state.window[state.cursor:]),
+            exhausted=state.exhausted,
+            donor_id=donation.donor_id
+        )
+        queue.offered = self.ranking.rows_for([*state.offered, *state.window[:state.cursor]]).astype(np.int32)
+        self.allocation_queues[donation.id] = queue
+        self.allocation_timers[donation.id] = state.deadline
+        if not self.shared_timers:
+            self.scheduler.schedule(donation.id, state.deadline)
 
     def update_agency_requirement(self, requirement: Requirement):
         """Update a single requirement for an agency."""
-        if requirement.agency_id not in self.agency_requirements:
-            self.agency_requirements[requirement.agency_id] = {}
-        self.agency_requirements[requirement.agency_id][requirement.food_type] = requirement.quantity
-
-    async def allocate_donation(self, donation: Donation, agencies: List[Agency]) -> None:
-        """Allocate a donation to the most suitable agencies."""
-        sorted_agencies = sorted(
-            agencies,
-            key=lambda agency: (
-                -agency.priority_flag,
-                self.compute_distance(agency.location, donation.location),
-                -self.compute_needs_score(self.agency_requirements.get(agency.id, {}), donation.food_type, donation.quantity)
-            )
-        )
-        
-        self.allocation_queues[donation.id] = [agency.id for agency in sorted_agencies]
-        self.allocation_timers[donation.id] = datetime.now() + timedelta(seconds=self.queue_move_interval)
+        self.requirements.set(requirement.agency_id, requirement.food_type, requirement.quantity)
+        self.ranking.set_requirement(requirement.agency_id, requirement.food_type, requirement.quantity)
+
+    def remove_agency_requirement(self, agency_id: UUID, food_type):
+        self.requirements.discard(agency_id, food_type)
+        self.ranking.set_requirement(agency_id, food_type, 0)
+
+    async def publish_requirement(self, db: AsyncSession, agency_id: UUID, food_type, quantity: Optional[int]):
+        """Announce a requirement change made in db's transaction; quantity None means it was deleted."""
+        await self.change_bus.publish(db, REQUIREMENTS_CHANNEL, {
+            "agency_id": agency_id,
+            "food_type": FoodType(food_type).value,
+            "quantity": quantity,
+        })
+
+    def apply_requirement_change(self, message: Dict):
+        """Change bus handler for requirement changes committed by any worker."""
+        agency_id = UUID(message["agency_id"])
+        if message["quantity"] is None:
+            self.remove_agency_requirement(agency_id, message["food_type"])
+        else:
+            self.update_agency_requirement(Requirement(agency_id=agency_id, food_type=message["food_type"], quantity=message["quantity"]))
+
+    async def allocate_donation(self, donation: Donation, agencies: Optional[List[Agency]] = None) -> None:
+        """Allocate a donation to the most suitable agencies, by default every agency in the registry."""
+        if not self.owns(donation.id):
+            await self._route_allocations([donation])
+            return
+        if agencies is None and self.geo is not None:
+            async with self.session_factory() as db:
+                nearby = await self.geo.nearest(db, AgencyModel, donation.location, self.knn_candidates, self.max_allocation_radius_km)
+            rows = self.ranking.rows_for(agency.id for agency in nearby)
+        elif agencies is None:
+            rows = self._candidate_rows(donation.location)
+        else:
+            if self.max_allocation_radius_km is not None:
+                nearby = self.agency_index.within_radius(donation.location, self.max_allocation_radius_km)
+                agencies = [agency for agency in agencies if agency.id in nearby]
+            rows = self._upsert_agencies(agencies)
+        window, exhausted = self._rank_window(donation.location, donation.food_type, donation.quantity, rows)
+        await self._open_queue(donation, window, exhausted)
+        previous = DonationStatus(donation.status)
         donation.status = DonationStatus.ALLOCATED
-        await self.update_donation_in_db(donation)
-        
-        # Start the allocation management task for this donation
-        asyncio.create_task(self.manage_allocation(donation))
-
-    async def manage_allocation(self, donation: Donation):
-        while donation.id in self.allocation_queues and self.allocation_queues[donation.id]:
-            now = datetime.now()
-            if now >= self.allocation_timers[donation.id]:
-                # Move to the next agency in the queue
-                self.allocation_queues[donation.id].pop(0)
-                if self.allocation_queues[donation.id]:
-                    self.allocation_timers[donation.id] = now + timedelta(seconds=self.queue_move_interval)
-                    print(f"Moved Donation {donation.id} to next agency {self.allocation_queues[donation.id][0]}")
+        await self.update_donation_in_db(donation, ["status"], expected_status=previous)
+        statuses = [self._allocated_event(donation.id)]
+        offers = [self._offer_event(donation.id)]
+        if self.shared_timers:
+            self._forget_queue(donation.id)
+        await self.announce_offers(offers)
+        await self._send_events(DONATION_EVENTS_CHANNEL, statuses)
+
+    async def allocate_donations(self, donations: List[Donation], agencies: Optional[List[Agency]] = None) -> List[Donation]:
+        """Allocate many donations against one agency set, by default the registry, ranking them all in a single batched pass."""
+        remote = [donation for donation in donations if not self.owns(donation.id)]
+        if remote:
+            await self._route_allocations(remote)
+            local = [donation for donation in donations if self.owns(donation.id)]
+            if local:
+                await self.allocate_donations(local, agencies)
+            return donations
+        rows = self.ranking.live_rows() if agencies is None else self._upsert_agencies(agencies)
+        ranked = self.ranking.rank_batch(
+            [donation.location for donation in donations],
+            [donation.food_type for donation in donations],
+            [donation.quantity for donation in donations],
+            rows,
+            k=self.queue_window if self.lazy_ranking else None,
+            max_distance_km=self.max_allocation_radius_km
+        )
+        previous = {}
+        for donation, window in zip(donations, ranked):
+            await self._open_queue(donation, window[:self.queue_window], exhausted=len(window) < self.queue_window if self.lazy_ranking else len(window) <= self.queue_window)
+            previous[donation.id] = DonationStatus(donation.status)
+            donation.status = DonationStatus.ALLOCATED
+        await self.write_donation_statuses_in_db(previous, DonationStatus.ALLOCATED)
+        statuses = [self._allocated_event(donation.id) for donation in donations]
+        offers = [self._offer_event(donation.id) for donation in donations]
+        if self.shared_timers:
+            for donation in donations:
+                self._forget_queue(donation.id)
+        await self.announce_offers(offers)
+        await self._send_events(DONATION_EVENTS_CHANNEL, statuses)
+        return donations
+
+    async def _route_allocations(self, donations: List[Donation]):
+        """Hand donations to their shard owners; ones no owner took stay READY until their shard is recovered."""
+        by_shard: Dict[int, List[Donation]] = {}
+        for donation in donations:
+            by_shard.setdefault(shard_of(donation.id, self.shards), []).append(donation)
+        chunks = [group[start:start + ROUTE_CHUNK] for group in by_shard.values() for start in range(0, len(group), ROUTE_CHUNK)]
+        results = await asyncio.gather(*(
+            self._route("allocate", chunk[0].id, {"donations": [donation.model_dump(mode="json") for donation in chunk]})
+            for chunk in chunks
+        ))
+        for chunk, allocated in zip(chunks, results):
+            if allocated:
+                for donation in chunk:
+                    donation.status = DonationStatus.ALLOCATED
+
+    def _upsert_agencies(self, agencies: List[Agency]) -> np.ndarray:
+        return np.fromiter(
+            (self.ranking.upsert_agency(agency, self.requirements.get(agency.id)) for agency in agencies),
+            dtype=np.int64,
+            count=len(agencies)
+        )
+
+    async def _open_queue(self, donation: Donation, window: np.ndarray, exhausted: bool):
+        self.allocation_queues[donation.id] = AllocationQueue(
+            donation.location,
+            donation.food_type,
+            donation.quantity,
+            window,
+            exhausted=exhausted,
+            donor_id=donation.donor_id
+        )
+        self.queue_metrics["queues_created"] += 1
+        await self._set_deadline(donation.id)
+
+    async def _set_deadline(self, donation_id: UUID):
+        """Give the agency at the head of the queue queue_move_interval seconds to respond, and save the queue."""
+        deadline = datetime.now() + timedelta(seconds=self.queue_move_interval)
+        self.allocation_timers[donation_id] = deadline
+        if not self.shared_timers:
+            self.scheduler.schedule(donation_id, deadline)
+        await self.queue_writes.put(donation_id, {"state": self._queue_state(donation_id)})
+
+    def _queue_state(self, donation_id: UUID) -> Dict:
+        queue = self.allocation_queues[donation_id]
+        return {
+            "window": self.ranking.agency_ids(queue.window),
+            "offered": self.ranking.agency_ids(queue.offered),
+            "cursor": queue.cursor,
+            "exhausted": queue.exhausted,
+            "deadline": self.allocation_timers[donation_id],
+        }
+
+    def _candidate_rows(self, location: Tuple[float, float]) -> np.ndarray:
+        if self.max_allocation_radius_km is None:
+            return self.ranking.live_rows()
+        return self.ranking.rows_for(self.agency_index.within_radius(location, self.max_allocation_radius_km))
+
+    def _rank_window(self, location: Tuple[float, float], food_type: str, quantity: int, rows: np.ndarray) -> Tuple[np.ndarray, bool]:
+        """Rank the next queue_window agencies among rows, in (-priority_flag, distance, -needs_score) order."""
+        exhausted = len(rows) <= self.queue_window
+        if self.lazy_ranking:
+            return self.ranking.rank(location, food_type, quantity, rows, k=self.queue_window), exhausted
+        return self.ranking.rank(location, food_type, quantity, rows)[:self.queue_window], exhausted
+
+    def _extend_queue(self, queue: AllocationQueue):
+        """Rank the next window of agencies for a queue whose current window has been used up."""
+        rows = self._candidate_rows(queue.location)
+        rows = rows[~np.isin(rows, queue.seen())]
+        window, exhausted = self._rank_window(queue.location, queue.food_type, queue.quantity, rows)
+        queue.extend(window, exhausted=exhausted)
+        self.queue_metrics["extensions"] += 1
+        if exhausted:
+            self.queue_metrics["exhausted"] += 1
+
+    def _queue_head(self, donation_id: UUID) -> Optional[UUID]:
+        """Agency currently offered the donation, skipping agencies removed since the queue was ranked."""
+        queue = self.allocation_queues.get(donation_id)
+        if queue is None:
+            return None
+        while True:
+            row = queue.head()
+            if row is None:
+                if not queue.needs_extension():
+                    return None
+                self._extend_queue(queue)
+            elif not self.ranking.is_alive(row):
+                queue.advance()
+            else:
+                return self.ranking.ids[row]
+
+    def _offer_event(self, donation_id: UUID, event_type: str = "offer") -> Optional[Dict]:
+        """Event for the agency at the head of a donation's queue, None when the queue has no head."""
+        agency_id = self._queue_head(donation_id)
+        if agency_id is None:
+            return None
+        queue = self.allocation_queues[donation_id]
+        return {
+            "id": new_event_id(),
+            "type": event_type,
+            "agency_id": str(agency_id),
+            "donation_id": str(donation_id),
+            "food_type": queue.food_type,
+            "quantity": queue.quantity,
+            "location": list(queue.location),
+            "deadline": self.allocation_timers[donation_id].isoformat(),
+        }
+
+    async def announce_offers(self, events: List[Optional[Dict]]):
+        """Push events to the agencies' sockets on whichever worker holds them. Agencies that miss one catch up on reconnect."""
+        await self._send_events(AGENCY_EVENTS_CHANNEL, [event for event in events if event is not None])
+
+    def _on_agency_events(self, message: Dict):
+        for event in message["events"]:
+            self.connections.dispatch(event)
+
+    async def announce_statuses(self, donations: List[Donation]):
+        """
+        Tell the donation event streams of every worker about the donations' new statuses. Sent once the
+        change is made rather than published in its transaction, so the publishing worker gets it only once.
+        """
+        await self._send_events(DONATION_EVENTS_CHANNEL, [
+            self._allocated_event(donation.id)
+            if DonationStatus(donation.status) == DonationStatus.ALLOCATED and donation.id in self.allocation_queues
+            else donation_status_event(donation)
+            for donation in donations
+        ])
+
+    def _allocated_event(self, donation_id: UUID) -> Dict:
+        """ALLOCATED status event naming the agency now offered the donation, so that agency's streams get it too."""
+        queue = self.allocation_queues[donation_id]
+        agency_id = self._queue_head(donation_id)
+        return {
+            "donation_id": str(donation_id),
+            "donor_id": str(queue.donor_id),
+            "agency_id": str(agency_id) if agency_id is not None else None,
+            "status": DonationStatus.ALLOCATED.value,
+        }
+
+    def _on_donation_events(self, message: Dict):
+        for event in message["events"]:
+            self.donation_events.publish(event)
+
+    async def _send_events(self, channel: str, events: List[Dict]):
+        for start in range(0, len(events), EVENT_CHUNK):
+            try:
+                await self.change_bus.send(channel, {"events": events[start:start + EVENT_CHUNK]})
+            except Exception as e:
+                print(f"Error sending events on {channel}: {str(e)}")
+
+    async def _clear_allocation(self, donation_id: UUID):
+        del self.allocation_queues[donation_id]
+        del self.allocation_timers[donation_id]
+        self.scheduler.cancel(donation_id)
+        if self.recovering:
+            self._settled_during_recovery.add(donation_id)
+        await self.queue_writes.put(donation_id, {"state": None})
+
+    async def _advance_queue(self, donation_id: UUID, expired: bool = False) -> bool:
+        """Move a donation to its next agency, or back to READY when none are left. Returns whether one was left."""
+        events = [self._offer_event(donation_id, "offer_expired")] if expired else []
+        self.allocation_queues[donation_id].advance()
+        if self._queue_head(donation_id) is not None:
+            await self._set_deadline(donation_id)
+            await self.announce_offers(events + [self._offer_event(donation_id)])
+            await self._send_events(DONATION_EVENTS_CHANNEL, [self._allocated_event(donation_id)])
+            return True
+        await self.announce_offers(events)
+        try:
+            donation = await self.get_donation_from_db(donation_id)
+        except ValueError:
+            # Deleted while allocated: there is nothing left to release
+            print(f"Donation {donation_id} no longer exists, dropping its allocation")
+            await self._clear_allocation(donation_id)
+            return False
+        donation.status = DonationStatus.READY
+        await self.update_donation_in_db(donation, ["status"], expected_status=DonationStatus.ALLOCATED)
+        await self.announce_statuses([donation])
+        await self._clear_allocation(donation_id)
+        return False
+
+    async def advance_expired(self, donation_ids: List[UUID]):
+        """
+        Scheduler callback: move every donation whose deadline passed to its next agency. The scheduler has
+        already dropped these timers, so a donation that fails is rescheduled ADVANCE_RETRY_SECONDS later
+        instead of failing the rest of the batch.
+        """
+        now = datetime.now()
+        for donation_id in donation_ids:
+            deadline = self.allocation_timers.get(donation_id)
+            if deadline is None or deadline > now:
+                continue
+            try:
+                if await self._advance_queue(donation_id, expired=True):
+                    print(f"Moved Donation {donation_id} to next agency {self._queue_head(donation_id)}")
+                else:
+                    print(f"No more agencies available for Donation {donation_id}")
+            except Exception as e:
+                print(f"Error advancing Donation {donation_id}, retrying in {ADVANCE_RETRY_SECONDS}s: {str(e)}")
+                if donation_id in self.allocation_queues:
+                    retry_at = datetime.now() + timedelta(seconds=ADVANCE_RETRY_SECONDS)
+                    self.allocation_timers[donation_id] = retry_at
+                    self.scheduler.schedule(donation_id, retry_at)
+
+    async def _claim_expired_loop(self):
+        while True:
+            try:
+                claimed = await self.claim_expired()
+            except Exception as e:
+                print(f"Error claiming expired allocations: {str(e)}")
+                claimed = 0
+            if claimed < self.timer_claim_batch:
+                await asyncio.sleep(self.timer_poll_interval)
+
+    async def claim_expired(self) -> int:
+        """
+        Shared-timer mode: advance due queues claimed from allocation_queue_state with FOR UPDATE SKIP LOCKED.
+
+        Rows locked by another worker are skipped, so concurrent workers split the due queues between them.
+        Each claimed queue is rebuilt from its saved state, advanced, and written back before the row lock
+        is released. Returns the number of queues claimed.
+        """
+        # Local changes must be visible before reading shared state
+        await self.queue_writes.flush()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(DonationModel, AllocationQueueStateModel)
+                .join(AllocationQueueStateModel, AllocationQueueStateModel.donation_id == DonationModel.id)
+                .filter(AllocationQueueStateModel.deadline <= datetime.now())
+                .order_by(AllocationQueueStateModel.deadline)
+                .limit(self.timer_claim_batch)
+                .with_for_update(of=AllocationQueueStateModel, skip_locked=True)
+            )
+            claimed = result.all()
+            changes, events, statuses, released = {}, [], [], []
+            for donation_model, state in claimed:
+                donation = Donation.model_validate(donation_model)
+                self.restore_queue(donation, state)
+                events.append(self._offer_event(donation.id, "offer_expired"))
+                self.allocation_queues[donation.id].advance()
+                if self._queue_head(donation.id) is not None:
+                    self.allocation_timers[donation.id] = datetime.now() + timedelta(seconds=self.queue_move_interval)
+                    changes[donation.id] = {"state": self._queue_state(donation.id)}
+                    events.append(self._offer_event(donation.id))
+                    statuses.append(self._allocated_event(donation.id))
+                    print(f"Moved Donation {donation.id} to next agency {self._queue_head(donation.id)}")
+                    self._forget_queue(donation.id)
                 else:
+                    self._forget_queue(donation.id)
+                    changes[donation.id] = {"state": None}
+                    await self.update_donation_statuses_in_db([donation.id], DonationStatus.READY, expected_status=DonationStatus.ALLOCATED)
+                    donation.status = DonationStatus.READY
+                    released.append(donation)
                     print(f"No more agencies available for Donation {donation.id}")
+            await self._write_queue_states(db, changes)
+            await db.commit()
+        await self.announce_offers(events)
+        await self._send_events(DONATION_EVENTS_CHANNEL, statuses)
+        await self.announce_statuses(released)
+        self.timer_metrics["claims"] += 1
+        self.timer_metrics["claimed"] += len(claimed)
+        return len(claimed)
+
+    def _forget_queue(self, donation_id: UUID):
+        """
+        Shared-timer mode: drop the local copy of a queue once an operation on it is done. The saved row in
+        allocation_queue_state is the only copy, so no worker acts on a position another has moved past.
+        """
+        self.allocation_queues.pop(donation_id, None)
+        self.allocation_timers.pop(donation_id, None)
+        if self.recovering:
+            self._settled_during_recovery.add(donation_id)
+
+    async def _respond_shared(self, donation_id: UUID, agency_id: UUID, accepted: bool) -> bool:
+        """
+        Shared-timer mode: answer an offer against the saved queue, locked with FOR UPDATE so a worker claiming
+        its deadline or handling another answer waits. The head is checked on the saved state, and the advanced
+        or cleared state is written before the lock is released.
+        """
+        # The donation may have been allocated here moments ago; its state must be in the row we lock
+        await self.queue_writes.flush()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(DonationModel, AllocationQueueStateModel)
+                .join(AllocationQueueStateModel, AllocationQueueStateModel.donation_id == DonationModel.id)
+                .filter(AllocationQueueStateModel.donation_id == donation_id)
+                .with_for_update(of=AllocationQueueStateModel)
+            )
+            row = result.first()
+            if row is None:
+                return False
+            donation = Donation.model_validate(row[0]).model_copy(update=self.donation_writes.changes_for(donation_id))
+            self.restore_queue(donation, row[1])
+            if self._queue_head(donation_id) != agency_id:
+                self._forget_queue(donation_id)
+                return False
+            queue = self.allocation_queues[donation_id]
+            events = []
+            if accepted:
+                self.accept_depths[len(queue.offered) + queue.cursor + 1] += 1
+                donation.status = DonationStatus.ACCEPTED
+                donation.agency_id = agency_id
+                changes = {"state": None}
+            else:
+                queue.advance()
+                if self._queue_head(donation_id) is not None:
+                    self.allocation_timers[donation_id] = datetime.now() + timedelta(seconds=self.queue_move_interval)
+                    changes = {"state": self._queue_state(donation_id)}
+                    events.append(self._offer_event(donation_id))
+                    statuses = [self._allocated_event(donation_id)]
+                else:
                     donation.status = DonationStatus.READY
-                    await self.update_donation_in_db(donation)
-                    del self.allocation_queues[donation.id]
-                    del self.allocation_timers[donation.id]
-            await asyncio.sleep(10)  # Check every 10s for demo
+                    changes = {"state": None}
+            self._forget_queue(donation_id)
+            await self._write_queue_states(db, {donation_id: changes})
+            if changes["state"] is None:
+                # Written under the lock rather than behind: the allocating worker's status write may still be
+                # buffered, and expecting READY it cannot then overwrite an acceptance
+                await db.execute(
+                    update(DonationModel)
+                    .where(DonationModel.id == donation_id, DonationModel.status.in_([DonationStatus.READY, DonationStatus.ALLOCATED]))
+                    .values(status=donation.status, agency_id=donation.agency_id)
+                )
+            await db.commit()
+        if accepted:
+            await self.announce_statuses([donation])
+            print(f"Donation {donation_id} accepted by Agency {agency_id}")
+            await self.assign_volunteer_to_donation(donation)
+        elif events:
+            await self.announce_offers(events)
+            await self._send_events(DONATION_EVENTS_CHANNEL, statuses)
+            print(f"Donation {donation_id} rejected by Agency {agency_id}. Moved to next agency.")
+        else:
+            await self.announce_statuses([donation])
+            print(f"Donation {donation_id} rejected by last agency. Marked as READY.")
+        return True
+
+    def stats(self) -> Dict:
+        created = self.queue_metrics["queues_created"]
+        return {
+            "pending_donations": len(self.allocation_queues),
+            "recovery": self.recovery,
+            "shard_recovery": {shard: progress["state"] for shard, progress in sorted(self.shard_recovery.items())},
+            "scheduler": self.scheduler.stats(),
+            "donation_writes": self.donation_writes.stats(),
+            "queue_writes": self.queue_writes.stats(),
+            "shared_timers": {"enabled": self.shared_timers, **self.timer_metrics},
+            "sharding": {**(self.leases.stats() if self.leases is not None else {"shards": 0}), **self.route_metrics},
+            "db_pool": pool_stats(),
+            "agencies": len(self.agencies),
+            "requirements": self.requirements.stats(),
+            "change_bus": self.change_bus.stats(),
+            "spatial_search": self.geo.backend if self.geo is not None else "memory",
+            "websockets": self.connections.stats(),
+            "donation_events": self.donation_events.stats(),
+            "queues": {
+                **self.queue_metrics,
+                "window": self.queue_window,
+                "lazy_ranking": self.lazy_ranking,
+                "extensions_per_queue": self.queue_metrics["extensions"] / created if created else 0.0,
+                # How many agencies had been offered a donation before one accepted it
+                "accept_depths": dict(sorted(self.accept_depths.items())),
+            },
+        }
+
+    async def shutdown(self):
+        if self.recovery_task is not None and not self.recovery_task.done():
+            self.recovery_task.cancel()
+            try:
+                await self.recovery_task
+            except asyncio.CancelledError:
+                pass
+        if self.timer_task is not None:
+            self.timer_task.cancel()
+            try:
+                await self.timer_task
+            except asyncio.CancelledError:
+                pass
+        # Release shards only once their queue state is written, so the next owner restores it intact. Each
+        # step runs even if an earlier one failed, so leases and the LISTEN connection are never left open.
+        steps = [
+            ("scheduler", self.scheduler.stop),
+            ("donation writes", self.donation_writes.close),
+            ("queue state writes", self.queue_writes.close),
+        ]
+        if self.leases is not None:
+            steps.append(("shard leases", self.leases.stop))
+        steps.append(("change bus", self.change_bus.stop))
+        for name, stop in steps:
+            try:
+                await stop()
+            except Exception as e:
+                print(f"Error stopping {name} on shutdown: {str(e)}")
 
     def compute_distance(self, agency_location: List[float], donation_location: List[float]) -> float:
         """Compute distance in km between 2 points of lat/long."""
@@ -109,107 +958,248 @@ class AllocationSystem():
         return 0
 
     async def accept_donation(self, donation_id: UUID, agency_id: UUID):
-        if donation_id in self.allocation_queues and self.allocation_queues[donation_id][0] == agency_id:
+        if not self.owns(donation_id):
+            return bool(await self._route("accept", donation_id, {"donation_id": donation_id, "agency_id": agency_id}))
+        if self.shared_timers:
+            return await self._respond_shared(donation_id, agency_id, accepted=True)
+        if self._queue_head(donation_id) == agency_id:
+            queue = self.allocation_queues[donation_id]
+            self.accept_depths[len(queue.offered) + queue.cursor + 1] += 1
             donation = await self.get_donation_from_db(donation_id)
             donation.status = DonationStatus.ACCEPTED
             donation.agency_id = agency_id
-            await self.update_donation_in_db(donation)
-            del self.allocation_queues[donation_id]
-            del self.allocation_timers[donation_id]
+            await self.update_donation_in_db(donation, ["status", "agency_id"], expected_status=DonationStatus.ALLOCATED)
+            await self._clear_allocation(donation_id)
+            await self.announce_statuses([donation])
             print(f"Donation {donation_id} accepted by Agency {agency_id}")
+            await self.assign_volunteer_to_donation(donation)
             return True
         return False
 
     async def reject_donation(self, donation_id: UUID, agency_id: UUID):
-        if donation_id in self.allocation_queues and self.allocation_queues[donation_id][0] == agency_id:
-            self.allocation_queues[donation_id].pop(0)
-            if self.allocation_queues[donation_id]:
-                self.allocation_timers[donation_id] = datetime.now() + timedelta(seconds=self.queue_move_interval)
+        if not self.owns(donation_id):
+            return bool(await self._route("reject", donation_id, {"donation_id": donation_id, "agency_id": agency_id}))
+        if self.shared_timers:
+            return await self._respond_shared(donation_id, agency_id, accepted=False)
+        if self._queue_head(donation_id) == agency_id:
+            if await self._advance_queue(donation_id):
                 print(f"Donation {donation_id} rejected by Agency {agency_id}. Moved to next agency.")
             else:
-                donation = await self.get_donation_from_db(donation_id)
-                donation.status = DonationStatus.READY
-                await self.update_donation_in_db(donation)
-                del self.allocation_queues[donation_id]
-                del self.allocation_timers[donation_id]
                 print(f"Donation {donation_id} rejected by last agency. Marked as READY.")
             return True
         return False
 
     async def get_all_requirements_from_db(self) -> List[Requirement]:
-        result = await self.db.execute(select(RequirementModel))
-        requirements = result.scalars().all()
+        async with self.session_factory() as db:
+            result = await db.execute(select(RequirementModel))
+            requirements = result.scalars().all()
         return [Requirement.model_validate(req) for req in requirements]
 
-    async def get_pending_donations_from_db(self) -> List[Donation]:
-        result = await self.db.execute(
-            select(DonationModel).filter(
-                DonationModel.status.in_([DonationStatus.READY, DonationStatus.ALLOCATED])
+    async def count_pending_donations_in_db(self) -> int:
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(func.count()).select_from(DonationModel).filter(
+                    DonationModel.status.in_([DonationStatus.READY, DonationStatus.ALLOCATED])
+                )
             )
-        )
-        donations = result.scalars().all()
-        return [Donation.model_validate(donation) for donation in donations]
+            return result.scalar_one()
+
+    async def stream_pending_donations_from_db(self, batch_size: int):
+        """Yield pending donations in lists of up to batch_size without loading them all at once."""
+        async with self.session_factory() as db:
+            result = await db.stream(
+                select(DonationModel).filter(
+                    DonationModel.status.in_([DonationStatus.READY, DonationStatus.ALLOCATED])
+                ).execution_options(yield_per=batch_size)
+            )
+            async for partition in result.scalars().partitions():
+                yield [Donation.model_validate(donation) for donation in partition]
+
+    async def stream_saved_queues_from_db(self, batch_size: int):
+        """Yield (donation, saved queue state) for allocated donations in deadline order, batch_size at a time."""
+        async with self.session_factory() as db:
+            result = await db.stream(
+                select(DonationModel, AllocationQueueStateModel)
+                .join(AllocationQueueStateModel, AllocationQueueStateModel.donation_id == DonationModel.id)
+                .filter(DonationModel.status == DonationStatus.ALLOCATED)
+                .order_by(AllocationQueueStateModel.deadline)
+                .execution_options(yield_per=batch_size)
+            )
+            async for partition in result.partitions():
+                yield [(Donation.model_validate(donation), state) for donation, state in partition]
+
+    async def delete_stale_queue_states_in_db(self):
+        """Drop saved queues of donations that are gone or no longer allocated."""
+        async with self.session_factory() as db:
+            await db.execute(
+                delete(AllocationQueueStateModel).where(~exists().where(
+                    DonationModel.id == AllocationQueueStateModel.donation_id,
+                    DonationModel.status == DonationStatus.ALLOCATED
+                ))
+            )
+            await db.commit()
+
+    async def _flush_queue_states(self, batch: Dict[UUID, Dict], expected: Dict[UUID, Dict]):
+        async with self.session_factory() as db:
+            await self._write_queue_states(db, batch)
+            await db.commit()
+
+    async def _write_queue_states(self, db: AsyncSession, batch: Dict[UUID, Dict]):
+        """Upsert saved queues in one INSERT ... ON CONFLICT and delete cleared ones in one DELETE."""
+        rows = [{"donation_id": donation_id, **changes["state"]} for donation_id, changes in batch.items() if changes["state"] is not None]
+        cleared = [donation_id for donation_id, changes in batch.items() if changes["state"] is None]
+        if rows:
+            stmt = pg_insert(AllocationQueueStateModel).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[AllocationQueueStateModel.donation_id],
+                set_={field: stmt.excluded[field] for field in ("window", "offered", "cursor", "exhausted", "deadline")}
+            )
+            await db.execute(stmt)
+        if cleared:
+            await db.execute(delete(AllocationQueueStateModel).where(AllocationQueueStateModel.donation_id.in_(cleared)))
 
     async def get_all_agencies_from_db(self) -> List[Agency]:
-        result = await self.db.execute(select(AgencyModel))
-        agencies = result.scalars().all()
+        async with self.session_factory() as db:
+            result = await db.execute(select(AgencyModel))
+            agencies = result.scalars().all()
         return [Agency.model_validate(agency) for agency in agencies]
 
     async def get_donation_from_db(self, donation_id: UUID) -> Donation:
-        result = await self.db.execute(
-            select(DonationModel).filter(DonationModel.id == donation_id)
-        )
-        donation = result.scalar_one_or_none()
+        async with self.session_factory() as db:
+            result = await db.execute(
+                select(DonationModel).filter(DonationModel.id == donation_id)
+            )
+            donation = result.scalar_one_or_none()
         if donation is None:
             raise ValueError(f"Donation with id {donation_id} not found")
-        return Donation.model_validate(donation)
+        donation = Donation.model_validate(donation)
+        # Overlay writes that are still buffered so callers read their own updates
+        return donation.model_copy(update=self.donation_writes.changes_for(donation_id))
+
+    async def update_donation_in_db(self, donation: Donation, fields: List[str], expected_status: Optional[DonationStatus] = None):
+        """
+        Queue the given allocation-owned fields of a donation for the next batched write. With expected_status
+        the write only applies while the row still has that status, so it cannot undo a change made elsewhere.
+        """
+        changes = {field: getattr(donation, field) for field in fields}
+        if "status" in changes:
+            changes["status"] = DonationStatus(changes["status"])
+        await self.donation_writes.put(donation.id, changes, expected=None if expected_status is None else {"status": expected_status})
+
+    async def update_donation_statuses_in_db(self, donation_ids: List[UUID], status: DonationStatus, expected_status: Optional[DonationStatus] = None):
+        """Queue the same status for many donations; they are written together in one batch."""
+        expected = None if expected_status is None else {"status": expected_status}
+        for donation_id in donation_ids:
+            await self.donation_writes.put(donation_id, {"status": status}, expected=expected)
 
-    async def update_donation_in_db(self, donation: Donation):
-        stmt = (
-            update(DonationModel)
-            .where(DonationModel.id == donation.id)
-            .values(**donation.model_dump(exclude={"id"}))
+    async def write_donation_statuses_in_db(self, previous: Dict[UUID, DonationStatus], status: DonationStatus):
+        """
+        Write the same status for many donations right away, in one UPDATE guarded by each row's previous
+        status, rather than splitting them across write-behind batches.
+        """
+        await self.donation_writes.write_through(
+            {donation_id: {"status": status} for donation_id in previous},
+            {donation_id: {"status": expected} for donation_id, expected in previous.items()}
         )
-        await self.db.execute(stmt)
-        await self.db.commit()
-        
+
+    async def _flush_donation_updates(self, batch: Dict[UUID, Dict], expected: Dict[UUID, Dict]) -> List[UUID]:
+        """
+        Write a batch in one transaction, returning the donations given up on.
+
+        A row the database refuses, such as one naming a volunteer or agency deleted since it was queued, would
+        roll back the whole batch: on an IntegrityError the batch is split in halves written separately, until
+        only the refused rows are left out.
+        """
+        try:
+            async with self.session_factory() as db:
+                skipped = await self._write_donation_updates(db, batch, expected)
+                await db.commit()
+        except IntegrityError as e:
+            if len(batch) == 1:
+                donation_id = next(iter(batch))
+                print(f"Error: dropping write {batch[donation_id]} to Donation {donation_id}: {str(e.orig)}")
+                return [donation_id]
+            keys = list(batch)
+            dropped = []
+            for half in (keys[:len(keys) // 2], keys[len(keys) // 2:]):
+                dropped += await self._flush_donation_updates(
+                    {key: batch[key] for key in half}, {key: expected[key] for key in half if key in expected}
+                )
+            return dropped
+        if skipped:
+            print(f"Skipped {skipped} donation writes whose rows changed or were deleted since they were queued")
+        return []
+
+    async def _write_donation_updates(self, db: AsyncSession, batch: Dict[UUID, Dict], expected: Dict[UUID, Dict]) -> int:
+        """
+        Write a batch as one UPDATE ... FROM (VALUES ...) per distinct set of changed and expected fields.
+        Rows no longer holding their expected values are left alone; returns how many were.
+        """
+        groups: Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], List] = {}
+        for donation_id, changes in batch.items():
+            fields = tuple(sorted(changes))
+            conditions = expected.get(donation_id, {})
+            guarded = tuple(sorted(conditions))
+            groups.setdefault((fields, guarded), []).append(
+                (donation_id, *(changes[field] for field in fields), *(conditions[field] for field in guarded))
+            )
+
+        table = DonationModel.__table__
+        skipped = 0
+        for (fields, guarded), rows in groups.items():
+            changed = values(
+                column("id", table.c.id.type),
+                *(column(field, table.c[field].type) for field in fields),
+                *(column(f"expected_{field}", table.c[field].type) for field in guarded),
+                name="changed"
+            ).data(rows)
+            stmt = (
+                update(DonationModel)
+                .where(DonationModel.id == changed.c.id)
+                .where(*(table.c[field] == cast(changed.c[f"expected_{field}"], table.c[field].type) for field in guarded))
+                .values({field: cast(changed.c[field], table.c[field].type) for field in fields})
+                .execution_options(synchronize_session=False)
+            )
+            result = await db.execute(stmt)
+            skipped += len(rows) - result.rowcount
+        return skipped
+
     async def assign_volunteer_to_donation(self, donation: Donation):
-        volunteers = await self.get_all_volunteers_from_db()
-        nearest_volunteer = await self.find_nearest_suitable_volunteer(donation, volunteers)
+        """Give an accepted donation to the nearest volunteer able to carry it, if there is one."""
+        try:
+            nearest_volunteer = await self.find_nearest_suitable_volunteer(donation)
+        except Exception as e:
+            # The acceptance already stands; the donation is left without a volunteer
+            print(f"Error finding a volunteer for Donation {donation.id}: {str(e)}")
+            return
         
         if nearest_volunteer is None:
             print(f"No suitable volunteer found for Donation {donation.id}")
             return
 
         donation.volunteer_id = nearest_volunteer.id
-        await self.update_donation_in_db(donation)
+        await self.update_donation_in_db(donation, ["volunteer_id"])
         print(f"Volunteer {nearest_volunteer.id} assigned to Donation {donation.id}")
 
-    async def find_nearest_suitable_volunteer(self, donation: Donation, volunteers: List[Volunteer]) -> Optional[Volunteer]:
-        donation_location = tuple(donation.location)
-        suitable_volunteers = [
-            (volunteer, geodesic(donation_location, tuple(volunteer.location)).km)
-            for volunteer in volunteers
-            if volunteer.capacity >= donation.quantity
-        ]
-
-        if not suitable_volunteers:
+    async def find_nearest_suitable_volunteer(self, donation: Donation) -> Optional[Volunteer]:
+        if self.geo is not None:
+            async with self.session_factory() as db:
+                nearest = await self.geo.nearest(db, VolunteerModel, donation.location, 1, filters=[VolunteerModel.capacity >= donation.quantity])
+            return Volunteer.model_validate(nearest[0]) if nearest else None
+        nearest_id = self.volunteer_index.nearest(
+            donation.location,
+            predicate=lambda volunteer_id: self.volunteers[volunteer_id].capacity >= donation.quantity
+        )
+        if nearest_id is None:
             return None
-
-        # Sort by distance and return the nearest
-        return min(suitable_volunteers, key=lambda x: x[1])[0]
+        return self.volunteers[nearest_id]
 
     async def get_all_volunteers_from_db(self) -> List[Volunteer]:
-        result = await self.db.execute(select(VolunteerModel))
-        volunteers = result.scalars().all()
+        async with self.session_factory() as db:
+            result = await db.execute(select(VolunteerModel))
+            volunteers = result.scalars().all()
         return [Volunteer.model_validate(volunteer) for volunteer in volunteers]
 
 
-async def get_allocation_system(db: AsyncSession = Depends(get_db))->AllocationSystem:
-    return await AllocationSystem.get_instance(db)
-
-
-# This function should be called when a new requirement is added or updated
-def update_requirement(requirement: Requirement):
-    allocation_system = get_allocation_system()
-    allocation_system.update_agency_requirement(requirement)
+async def get_allocation_system()->AllocationSystem:
+    return await AllocationSystem.get_instance()
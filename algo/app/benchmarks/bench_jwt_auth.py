@@ -0,0 +1,79 @@
+"""
+Requests/sec of one worker on an authenticated endpoint, with and without the verified-token cache.
+
+Serves a route that only depends on get_current_user, driven in-process over ASGI so the numbers are the
+per-request cost of the app and authentication alone. USERS distinct tokens are sent round-robin, as a
+worker sees repeat requests from its logged-in users. A throwaway RSA key pair is generated, so no
+JWT_PUBLIC_KEY is needed.
+
+Run from algo/app: python -m benchmarks.bench_jwt_auth [--requests 5000] [--users 100]
+"""
+import argparse
+import asyncio
+import base64
+import datetime
+import os
+import time
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+
+def generate_keys():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo)
+    os.environ["JWT_PUBLIC_KEY"] = base64.b64encode(public_pem).decode()
+    return private_key
+
+
+def make_tokens(private_key, users: int):
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    return [
+        jwt.encode({"sub": str(i), "role": "Donor", "company_name": f"bench-{i}", "exp": expires}, private_key, algorithm="RS256")
+        for i in range(users)
+    ]
+
+
+async def requests_per_second(app, tokens, count: int) -> float:
+    import httpx
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        headers = [{"Authorization": f"Bearer {token}"} for token in tokens]
+        started = time.perf_counter()
+        for i in range(count):
+            response = await client.get("/whoami", headers=headers[i % len(headers)])
+            if response.status_code != 200:
+                raise RuntimeError(f"request refused with {response.status_code}")
+        return count / (time.perf_counter() - started)
+
+
+async def run(count: int, users: int):
+    private_key = generate_keys()
+    from fastapi import Depends, FastAPI
+    from utils.jwt_auth import get_current_user, token_cache
+
+    app = FastAPI()
+
+    @app.get("/whoami")
+    async def whoami(current_user=Depends(get_current_user)):
+        return {"company_name": current_user["company_name"]}
+
+    tokens = make_tokens(private_key, users)
+    cache_size = token_cache.max_size
+    for label, size in [("without cache", 0), ("with cache", cache_size)]:
+        token_cache.max_size = size
+        token_cache.clear()
+        rate = await requests_per_second(app, tokens, count)
+        print(f"{label:<14} {rate:>8,.0f} requests/s ({users} users, {count} requests)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.users))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Memory held by pending allocation queues: a list of every agency id per donation versus an AllocationQueue window.
+
+Run from algo/app: python -m benchmarks.bench_queue_memory
+"""
+import random
+import tracemalloc
+from uuid import uuid4
+from schemas.Agency import Agency
+from utils.allocation_queue import AllocationQueue
+from utils.ranking import RankingEngine
+
+AGENCIES = 10_000
+PENDING_DONATIONS = 50_000
+# Full lists are measured on a sample and extrapolated; 50k of them would need several GB.
+LEGACY_SAMPLE = 1_000
+WINDOW = 16
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    held = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return held, size
+
+
+def main():
+    random.seed(7)
+    engine = RankingEngine()
+    for _ in range(AGENCIES):
+        engine.upsert_agency(Agency(
+            name="bench",
+            id=uuid4(),
+            priority_flag=random.random() < 0.1,
+            location=(random.uniform(1.2, 1.5), random.uniform(103.6, 104.0))
+        ), {"halal": random.randint(0, 50)})
+    donations = [((random.uniform(1.2, 1.5), random.uniform(103.6, 104.0)), "halal", 20) for _ in range(PENDING_DONATIONS)]
+    ranked = engine.rank(*donations[0])
+
+    _, legacy = measure(lambda: {uuid4(): engine.agency_ids(ranked) for _ in range(LEGACY_SAMPLE)})
+    legacy_total = legacy * PENDING_DONATIONS / LEGACY_SAMPLE
+
+    _, compact = measure(lambda: {
+        uuid4(): AllocationQueue(location, food_type, quantity, ranked[:WINDOW], exhausted=False)
+        for location, food_type, quantity in donations
+    })
+
+    print(f"{PENDING_DONATIONS} pending donations, {AGENCIES} agencies")
+    print(f"  list of agency ids : {legacy_total / 2**20:10.1f} MiB  ({legacy / LEGACY_SAMPLE:9.0f} B/donation, extrapolated)")
+    print(f"  AllocationQueue({WINDOW}): {compact / 2**20:10.1f} MiB  ({compact / PENDING_DONATIONS:9.0f} B/donation)")
+
+
+if __name__ == "__main__":
+    main()
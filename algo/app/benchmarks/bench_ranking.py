@@ -0,0 +1,69 @@
+"""
+Compare the per-agency sorted/geodesic ranking with the batched RankingEngine.
+
+Run from algo/app: python -m benchmarks.bench_ranking
+"""
+import random
+import time
+from uuid import uuid4
+from geopy.distance import geodesic
+from schemas.Agency import Agency
+from schemas.FoodType import FoodType
+from utils.ranking import RankingEngine
+
+SIZES = [1_000, 10_000, 100_000]
+FOOD_TYPES = [food_type.value for food_type in FoodType]
+
+
+def make_agencies(n: int):
+    agencies, requirements = [], {}
+    for _ in range(n):
+        agency = Agency(
+            name="bench",
+            id=uuid4(),
+            priority_flag=random.random() < 0.1,
+            location=(random.uniform(1.2, 1.5), random.uniform(103.6, 104.0))
+        )
+        agencies.append(agency)
+        requirements[agency.id] = {food_type: random.randint(0, 50) for food_type in random.sample(FOOD_TYPES, 2)}
+    return agencies, requirements
+
+
+def legacy_rank(agencies, requirements, location, food_type, quantity):
+    def needs_score(agency_requirements):
+        return min(agency_requirements[food_type], quantity) if food_type in agency_requirements else 0
+
+    return [agency.id for agency in sorted(
+        agencies,
+        key=lambda agency: (
+            -agency.priority_flag,
+            geodesic(tuple(agency.location), tuple(location)).km,
+            -needs_score(requirements.get(agency.id, {}))
+        )
+    )]
+
+
+def main():
+    random.seed(7)
+    for n in SIZES:
+        agencies, requirements = make_agencies(n)
+        location, food_type, quantity = (1.35, 103.8), "halal", 20
+
+        start = time.perf_counter()
+        legacy = legacy_rank(agencies, requirements, location, food_type, quantity)
+        legacy_s = time.perf_counter() - start
+
+        engine = RankingEngine(refine_top_k=16)
+        for agency in agencies:
+            engine.upsert_agency(agency, requirements[agency.id])
+        start = time.perf_counter()
+        ranked = engine.agency_ids(engine.rank(location, food_type, quantity))
+        engine_s = time.perf_counter() - start
+
+        same_head = ranked[:16] == legacy[:16]
+        print(f"{n:>7} agencies  legacy {legacy_s * 1000:9.1f} ms  engine {engine_s * 1000:7.2f} ms  "
+              f"speedup {legacy_s / engine_s:7.1f}x  top-16 identical: {same_head}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Query-plan regression check: fails when a router or recovery query sequentially scans a large table.
+
+Seeds a large dataset (DONATIONS donations spread over donors, agencies and volunteers, only a small share
+of them still open), runs ANALYZE, then calls the hot endpoints in-process and records every SELECT they
+send to Postgres. Each recorded statement is EXPLAINed with its real parameters; a Seq Scan on donations,
+agencies, donors, volunteers or requirements is reported and makes the script exit with status 1. NDJSON
+exports are left out because they read whole tables by design.
+
+Needs DATABASE_URL pointing at a scratch Postgres database: it applies the schema and migrations, and
+deletes everything it seeded at the end. Authentication is bypassed with a dependency override.
+
+Run from algo/app: python -m benchmarks.explain_check [--donations 200000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from uuid import uuid4
+
+CHECKED_TABLES = {"donations", "agencies", "donors", "volunteers", "requirements"}
+DONORS = 20_000
+AGENCIES = 20_000
+VOLUNTEERS = 5_000
+# Rows per multi-row INSERT, under asyncpg's 32767 bind parameter limit
+INSERT_BATCH = 2_000
+# Status mix of the seeded donations: most are long settled, a few are still open
+STATUS_WEIGHTS = {"COLLECTED": 90, "ACCEPTED": 8, "READY": 1, "ALLOCATED": 1}
+
+
+def seq_scans(plan):
+    """Tables read by Seq Scan anywhere in an EXPLAIN (FORMAT JSON) plan."""
+    found = []
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in CHECKED_TABLES:
+        found.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        found += seq_scans(child)
+    return found
+
+
+def indexes_used(plan):
+    used = [plan["Index Name"]] if "Index Name" in plan else []
+    for child in plan.get("Plans", []):
+        used += indexes_used(child)
+    return used
+
+
+async def seed(tag: str, donations: int):
+    from sqlalchemy import insert, text
+    from db.database import Base, engine, AsyncSessionLocal
+    from db.migrations import run_migrations
+    from db.models import AgencyModel, DonationModel, DonorModel, RequirementModel, VolunteerModel, FoodType, DonationStatus
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
+
+    def location():
+        return [random.uniform(1.2, 1.5), random.uniform(103.6, 104.0)]
+
+    donor_ids = [uuid4() for _ in range(DONORS)]
+    agency_ids = [uuid4() for _ in range(AGENCIES)]
+    volunteer_ids = [uuid4() for _ in range(VOLUNTEERS)]
+    statuses = random.choices([DonationStatus[name] for name in STATUS_WEIGHTS], weights=STATUS_WEIGHTS.values(), k=donations)
+    tables = [
+        (DonorModel, [{"id": id, "name": f"{tag}-donor-{i}", "location": location(), "donations": 0.0} for i, id in enumerate(donor_ids)]),
+        (AgencyModel, [{"id": id, "name": f"{tag}-agency-{i}", "priority_flag": random.random() < 0.1, "location": location()} for i, id in enumerate(agency_ids)]),
+        (VolunteerModel, [{"id": id, "name": f"{tag}-volunteer-{i}", "location": location(), "capacity": 50} for i, id in enumerate(volunteer_ids)]),
+        (RequirementModel, [{"id": uuid4(), "agency_id": id, "food_type": random.choice(list(FoodType)), "quantity": 10} for id in agency_ids]),
+        (DonationModel, [
+            {
+                "id": uuid4(),
+                "donor_id": random.choice(donor_ids),
+                "food_type": random.choice(list(FoodType)),
+                "quantity": random.randint(1, 50),
+                "location": location(),
+                "status": status,
+                "agency_id": random.choice(agency_ids) if status != DonationStatus.READY else None,
+                "volunteer_id": random.choice(volunteer_ids) if status == DonationStatus.COLLECTED else None,
+            }
+            for status in statuses
+        ]),
+    ]
+    async with AsyncSessionLocal() as db:
+        for model, rows in tables:
+            for start in range(0, len(rows), INSERT_BATCH):
+                await db.execute(insert(model).values(rows[start:start + INSERT_BATCH]))
+        await db.commit()
+    async with engine.begin() as conn:
+        await conn.execute(text("ANALYZE"))
+    return donor_ids, agency_ids, volunteer_ids
+
+
+async def cleanup(tag: str):
+    from sqlalchemy import delete, select
+    from db.database import AsyncSessionLocal
+    from db.models import AgencyModel, DonationModel, DonorModel, RequirementModel, VolunteerModel
+
+    async with AsyncSessionLocal() as db:
+        donors = select(DonorModel.id).where(DonorModel.name.like(f"{tag}-%"))
+        agencies = select(AgencyModel.id).where(AgencyModel.name.like(f"{tag}-%"))
+        await db.execute(delete(DonationModel).where(DonationModel.donor_id.in_(donors)))
+        await db.execute(delete(RequirementModel).where(RequirementModel.agency_id.in_(agencies)))
+        await db.execute(delete(AgencyModel).where(AgencyModel.name.like(f"{tag}-%")))
+        await db.execute(delete(VolunteerModel).where(VolunteerModel.name.like(f"{tag}-%")))
+        await db.execute(delete(DonorModel).where(DonorModel.name.like(f"{tag}-%")))
+        await db.commit()
+
+
+async def capture_queries(tag, donor_ids, agency_ids, volunteer_ids):
+    """Call the hot endpoints and recovery queries, returning (label, statement, parameters) of each SELECT sent."""
+    import httpx
+    from sqlalchemy import event
+    from db.database import engine
+    from utils.jwt_auth import get_current_user
+    from AllocationSystem import AllocationSystem
+    import main
+
+    user = {}
+    main.app.dependency_overrides[get_current_user] = lambda: user
+    captured, current = [], {"label": None}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if current["label"] is not None and statement.lstrip().upper().startswith("SELECT"):
+            captured.append((current["label"], statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://explain") as client:
+            async def call(label, path, params=None, as_user=None):
+                user.clear()
+                user.update(as_user or {})
+                current["label"] = label
+                response = await client.get(path, params=params)
+                current["label"] = None
+                if response.status_code != 200:
+                    raise RuntimeError(f"{label}: {path} returned {response.status_code}")
+                return response
+
+            donor_name, agency_name = f"{tag}-donor-0", f"{tag}-agency-0"
+            page = await call("GET /donations?donor_id", "/api/donations", {"donor_id": str(donor_ids[0])})
+            donation_id = page.json()[0]["id"]
+            await call("GET /donations/me (donor)", "/api/donations/me", as_user={"role": "Donor", "company_name": donor_name})
+            await call("GET /donations/me (agency)", "/api/donations/me", as_user={"role": "Beneficiary", "company_name": agency_name})
+            await call("GET /donors/me", "/api/donors/me", as_user={"role": "Donor", "company_name": donor_name})
+            await call("GET /agencies/me", "/api/agencies/me", as_user={"role": "Beneficiary", "company_name": agency_name})
+            await call("GET /donations/{id}", f"/api/donations/{donation_id}")
+            await call("GET /donations?status=Ready", "/api/donations", {"status": "Ready"})
+            await call("GET /donations?status=Allocated", "/api/donations", {"status": "Allocated"})
+            await call("GET /donations?agency_id", "/api/donations", {"agency_id": str(agency_ids[0])})
+            await call("GET /donations?volunteer_id", "/api/donations", {"volunteer_id": str(volunteer_ids[0])})
+            await call("GET /donations?food_type&after", "/api/donations", {"food_type": "halal", "after": donation_id})
+            await call("GET /volunteers/{id}/donations", f"/api/volunteers/{volunteer_ids[0]}/donations")
+            await call("GET /requirements?agency_id", "/api/requirements", {"agency_id": str(agency_ids[0])})
+            await call("GET /agencies/{id}/requirements", f"/api/agencies/{agency_ids[0]}/requirements")
+            await call("GET /agencies?priority_flag", "/api/agencies", {"priority_flag": "true"})
+            await call("GET /donors?after", "/api/donors", {"after": str(donor_ids[0])})
+
+        system = AllocationSystem()
+        current["label"] = "recovery: count pending"
+        await system.count_pending_donations_in_db()
+        current["label"] = "recovery: stream pending"
+        async for _ in system.stream_pending_donations_from_db(system.recovery_batch_size):
+            pass
+        current["label"] = None
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", capture)
+        main.app.dependency_overrides.clear()
+
+    return captured
+
+
+async def run(donations: int) -> int:
+    from db.database import engine
+
+    tag = f"explain-{uuid4().hex[:8]}"
+    print(f"Seeding {donations} donations, {DONORS} donors, {AGENCIES} agencies, {VOLUNTEERS} volunteers...")
+    donor_ids, agency_ids, volunteer_ids = await seed(tag, donations)
+
+    try:
+        captured = await capture_queries(tag, donor_ids, agency_ids, volunteer_ids)
+        failures = 0
+        async with engine.connect() as conn:
+            for label, statement, parameters in captured:
+                result = await conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters)
+                plan = result.scalar_one()
+                plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+                scans = seq_scans(plan)
+                failures += bool(scans)
+                verdict = f"FAIL seq scan on {', '.join(scans)}" if scans else "ok   " + ", ".join(indexes_used(plan))
+                print(f"  {label:<36} {verdict}")
+    finally:
+        await cleanup(tag)
+        await engine.dispose()
+    print(f"{len(captured)} queries checked, {failures} with sequential scans")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--donations", type=int, default=200_000)
+    args = parser.parse_args()
+    os.environ["DB_ECHO"] = "false"
+    sys.exit(asyncio.run(run(args.donations)))
+
+
+if __name__ == "__main__":
+    main()
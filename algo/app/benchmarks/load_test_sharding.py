@@ -0,0 +1,137 @@
+"""
+Allocation throughput of sharded AllocationSystem workers, for 1, 2, 4... worker processes.
+
+Each worker is a separate process with its own AllocationSystem in sharded mode (ALLOCATION_SHARDS), as
+uvicorn --workers would run it. Once shard ownership has settled, every worker inserts and allocates
+donations for DURATION seconds; the total allocated per second is reported per worker count. With --routed,
+donation ids are random, so most allocations are routed to another worker's shard over LISTEN/NOTIFY
+instead of landing on a shard the worker owns.
+
+Sharding does not scale throughput yet. On the single-CPU machine these figures come from, where the
+workers and Postgres share one core, throughput falls as workers are added (about 325, 290 and 242
+donations/s for 1, 2 and 4 workers). Gains on a multi-core host have not been measured.
+
+Needs DATABASE_URL pointing at a scratch Postgres database: it creates the tables if missing, seeds
+agencies and a donor, and deletes everything it created at the end.
+
+Run from algo/app: python -m benchmarks.load_test_sharding [--workers 1,2,4] [--duration 10] [--routed]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from uuid import uuid4
+
+SHARDS = 16
+AGENCIES = 2_000
+
+
+def worker(duration: float, routed: bool, donor_id, start_barrier, results):
+    os.environ.update(ALLOCATION_SHARDS=str(SHARDS), ALLOCATION_SHARD_SWEEP_SECONDS="0.5", DB_ECHO="false")
+    from AllocationSystem import AllocationSystem
+    from db.models import DonationModel, FoodType
+    from schemas.Donation import Donation
+
+    async def run():
+        system = AllocationSystem()
+        await system.initialize()
+        # Let shard ownership settle before measuring
+        owned, stable_since = set(system.leases.owned), time.perf_counter()
+        while time.perf_counter() - stable_since < 4 * system.leases.interval:
+            await asyncio.sleep(0.1)
+            if system.leases.owned != owned:
+                owned, stable_since = set(system.leases.owned), time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(None, start_barrier.wait)
+
+        allocated = 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            donation = Donation(
+                id=uuid4() if routed else system.new_donation_id(),
+                donor_id=donor_id,
+                food_type=FoodType.HALAL.value,
+                quantity=random.randint(1, 50),
+                location=(random.uniform(1.2, 1.5), random.uniform(103.6, 104.0))
+            )
+            async with system.session_factory() as db:
+                db.add(DonationModel(**{**donation.model_dump(), "food_type": FoodType.HALAL}))
+                await db.commit()
+            await system.allocate_donation(donation)
+            allocated += 1
+        # Keep serving routed requests until every worker is done
+        await asyncio.get_running_loop().run_in_executor(None, start_barrier.wait)
+        results.put((allocated, system.route_metrics["routed"], system.route_metrics["timeouts"]))
+        await system.shutdown()
+
+    asyncio.run(run())
+
+
+async def seed():
+    from sqlalchemy import insert
+    from db.database import Base, engine, AsyncSessionLocal
+    from db.migrations import run_migrations
+    from db.models import AgencyModel, DonorModel
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
+    donor_id = uuid4()
+    async with AsyncSessionLocal() as db:
+        db.add(DonorModel(id=donor_id, name="load-test"))
+        await db.execute(insert(AgencyModel).values([
+            {"id": uuid4(), "name": "load-test", "priority_flag": random.random() < 0.1,
+             "location": [random.uniform(1.2, 1.5), random.uniform(103.6, 104.0)]}
+            for _ in range(AGENCIES)
+        ]))
+        await db.commit()
+    await engine.dispose()
+    return donor_id
+
+
+async def cleanup(donor_id):
+    from sqlalchemy import delete, select
+    from db.database import engine, AsyncSessionLocal
+    from db.models import AgencyModel, AllocationQueueStateModel, DonationModel, DonorModel
+
+    async with AsyncSessionLocal() as db:
+        donations = select(DonationModel.id).where(DonationModel.donor_id == donor_id)
+        await db.execute(delete(AllocationQueueStateModel).where(AllocationQueueStateModel.donation_id.in_(donations)))
+        await db.execute(delete(DonationModel).where(DonationModel.donor_id == donor_id))
+        await db.execute(delete(DonorModel).where(DonorModel.id == donor_id))
+        await db.execute(delete(AgencyModel).where(AgencyModel.name == "load-test"))
+        await db.commit()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--routed", action="store_true")
+    args = parser.parse_args()
+    os.environ["DB_ECHO"] = "false"
+
+    donor_id = asyncio.run(seed())
+    context = multiprocessing.get_context("spawn")
+    print(f"{AGENCIES} agencies, {SHARDS} shards, {'random' if args.routed else 'owned'} donation ids, {os.cpu_count()} CPUs")
+    try:
+        for workers in [int(count) for count in args.workers.split(",")]:
+            barrier, results = context.Barrier(workers), context.Queue()
+            processes = [context.Process(target=worker, args=(args.duration, args.routed, donor_id, barrier, results)) for _ in range(workers)]
+            for process in processes:
+                process.start()
+            counts = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+            allocated = sum(count for count, _, _ in counts)
+            routed = sum(count for _, count, _ in counts)
+            timeouts = sum(count for _, _, count in counts)
+            print(f"  {workers} worker(s): {allocated / args.duration:8.1f} donations/s  (routed {routed}, timeouts {timeouts})")
+    finally:
+        asyncio.run(cleanup(donor_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Startup recovery time for a backlog of pending donations.
+
+Seeds AGENCIES agencies with requirements and --donations READY donations, then starts an AllocationSystem
+twice. The first start re-ranks every donation; the second finds their saved queue state and restores them in
+place. For each start it reports how long initialize() took (how long /health waits), how long until
+/ready would answer 200, and the recovery counters.
+
+Needs DATABASE_URL pointing at a scratch Postgres database: it creates the tables if missing, seeds agencies,
+a donor and donations, and deletes everything it created at the end. Pending donations already in the
+database are recovered too and show up in the counts.
+
+Run from algo/app: python -m benchmarks.recovery_time [--donations 20000] [--batch-size 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from uuid import uuid4
+
+AGENCIES = 500
+# asyncpg caps a statement at 32767 bind parameters
+INSERT_CHUNK = 2_000
+
+
+async def seed(donations: int):
+    from sqlalchemy import insert
+    from db.database import Base, engine, AsyncSessionLocal
+    from db.migrations import run_migrations
+    from db.models import AgencyModel, DonationModel, DonationStatus, DonorModel, FoodType, RequirementModel
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
+    donor_id = uuid4()
+    agency_ids = [uuid4() for _ in range(AGENCIES)]
+    async with AsyncSessionLocal() as db:
+        db.add(DonorModel(id=donor_id, name="recovery-bench", donations=0.0))
+        await db.execute(insert(AgencyModel).values([
+            {"id": agency_id, "name": "recovery-bench", "priority_flag": random.random() < 0.1,
+             "location": [random.uniform(1.2, 1.5), random.uniform(103.6, 104.0)]}
+            for agency_id in agency_ids
+        ]))
+        await db.execute(insert(RequirementModel).values([
+            {"id": uuid4(), "agency_id": agency_id, "food_type": FoodType.HALAL, "quantity": random.randint(0, 50)}
+            for agency_id in agency_ids
+        ]))
+        for start in range(0, donations, INSERT_CHUNK):
+            await db.execute(insert(DonationModel).values([
+                {"id": uuid4(), "donor_id": donor_id, "food_type": FoodType.HALAL, "quantity": random.randint(1, 50),
+                 "location": [random.uniform(1.2, 1.5), random.uniform(103.6, 104.0)], "status": DonationStatus.READY}
+                for _ in range(min(INSERT_CHUNK, donations - start))
+            ]))
+        await db.commit()
+    return donor_id, agency_ids
+
+
+async def cleanup(donor_id, agency_ids):
+    from sqlalchemy import delete, select
+    from db.database import engine, AsyncSessionLocal
+    from db.models import AgencyModel, AllocationQueueStateModel, DonationModel, DonorModel, RequirementModel
+
+    async with AsyncSessionLocal() as db:
+        donations = select(DonationModel.id).where(DonationModel.donor_id == donor_id)
+        await db.execute(delete(AllocationQueueStateModel).where(AllocationQueueStateModel.donation_id.in_(donations)))
+        await db.execute(delete(DonationModel).where(DonationModel.donor_id == donor_id))
+        await db.execute(delete(DonorModel).where(DonorModel.id == donor_id))
+        await db.execute(delete(RequirementModel).where(RequirementModel.agency_id.in_(agency_ids)))
+        await db.execute(delete(AgencyModel).where(AgencyModel.id.in_(agency_ids)))
+        await db.commit()
+    await engine.dispose()
+
+
+async def start_once(label: str):
+    from AllocationSystem import AllocationSystem
+
+    system = AllocationSystem()
+    start = time.perf_counter()
+    await system.initialize()
+    initialized = time.perf_counter() - start
+    while system.recovery["state"] in ("pending", "running"):
+        await asyncio.sleep(0.01)
+    ready = time.perf_counter() - start
+    recovery = system.recovery
+    await system.shutdown()
+    print(f"  {label:<9} initialize {initialized * 1000:7.1f} ms   ready after {ready:6.2f} s   "
+          f"state {recovery['state']}, recovered {recovery['recovered']} ({recovery['restored']} restored in place)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--donations", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=1_000)
+    args = parser.parse_args()
+    os.environ.update(DB_ECHO="false", RECOVERY_BATCH_SIZE=str(args.batch_size))
+
+    async def run():
+        donor_id, agency_ids = await seed(args.donations)
+        print(f"{args.donations} pending donations, {AGENCIES} agencies, batches of {args.batch_size}")
+        try:
+            await start_once("re-rank")
+            await start_once("restore")
+        finally:
+            await cleanup(donor_id, agency_ids)
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Memory per open GET /donations/me/events stream, and fan-out time of one status change to all of them.
+
+Opens STREAMS idle event streams for one donor against the real app, driven in-process over ASGI so only
+server-side memory is counted, and reports Python heap (tracemalloc) and process RSS growth per stream.
+Then publishes one status change for the donor and times its delivery to every stream.
+
+Needs DATABASE_URL pointing at a scratch Postgres database: it creates the tables if missing, adds one
+donor, and deletes it at the end. Authentication is bypassed with a dependency override.
+
+Run from algo/app: python -m benchmarks.sse_memory [--streams 10000]
+"""
+import argparse
+import asyncio
+import gc
+import os
+import time
+import tracemalloc
+from uuid import uuid4
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class Stream():
+    """Minimal ASGI client for one streaming request, kept open until disconnect() is called."""
+
+    def __init__(self, app):
+        self.app = app
+        self.disconnected = asyncio.get_running_loop().create_future()
+        self.chunks = 0
+        self.events = 0
+        self.opened = asyncio.Event()
+        self.task = None
+
+    async def open(self):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": "/api/donations/me/events", "raw_path": b"/api/donations/me/events", "root_path": "",
+            "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80),
+        }
+        self.task = asyncio.create_task(self.app(scope, self.receive, self.send))
+        await self.opened.wait()
+
+    async def receive(self):
+        return await self.disconnected
+
+    async def send(self, message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"stream refused with {message['status']}")
+        if message["type"] == "http.response.body" and message.get("body"):
+            self.chunks += 1
+            self.events += message["body"].count(b"event: status")
+            self.opened.set()
+
+    def disconnect(self):
+        self.disconnected.set_result({"type": "http.disconnect"})
+
+
+async def run(count: int):
+    os.environ["DB_ECHO"] = "false"
+    from sqlalchemy import delete
+    from db.database import Base, engine, AsyncSessionLocal
+    from db.models import DonorModel
+    from schemas.Donation import Donation
+    from schemas.DonationStatus import DonationStatus
+    from utils.jwt_auth import get_current_user
+    import main
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    donor_name = f"sse-bench-{uuid4().hex[:8]}"
+    donor_id = uuid4()
+    async with AsyncSessionLocal() as db:
+        db.add(DonorModel(id=donor_id, name=donor_name))
+        await db.commit()
+    main.app.dependency_overrides[get_current_user] = lambda: {"role": "Donor", "company_name": donor_name}
+
+    try:
+        async with main.lifespan(main.app):
+            system = main.app.state.allocation_system
+            streams = []
+            gc.collect()
+            tracemalloc.start()
+            heap_before, rss_before = tracemalloc.get_traced_memory()[0], rss_bytes()
+            for _ in range(count):
+                stream = Stream(main.app)
+                await stream.open()
+                streams.append(stream)
+            gc.collect()
+            heap_after, rss_after = tracemalloc.get_traced_memory()[0], rss_bytes()
+            tracemalloc.stop()
+            print(f"{count} open streams: {(heap_after - heap_before) / count:,.0f} B heap and "
+                  f"{(rss_after - rss_before) / count:,.0f} B RSS per stream (RSS includes tracemalloc overhead)")
+
+            started = time.perf_counter()
+            await system.announce_statuses([Donation(donor_id=donor_id, food_type="halal", quantity=1, location=(1.3, 103.8), status=DonationStatus.ALLOCATED)])
+            while sum(stream.events for stream in streams) < count:
+                await asyncio.sleep(0.01)
+            print(f"one status change delivered to {count} streams in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+            for stream in streams:
+                stream.disconnect()
+            await asyncio.gather(*(stream.task for stream in streams))
+            print(f"after disconnect: {system.donation_events.stats()['streams']} streams subscribed")
+    finally:
+        main.app.dependency_overrides.clear()
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(DonorModel).where(DonorModel.id == donor_id))
+            await db.commit()
+        await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", type=int, default=10_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.streams))
+
+
+if __name__ == "__main__":
+    main()
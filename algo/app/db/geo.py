@@ -0,0 +1,75 @@
+"""
+Nearest-neighbour and radius search in Postgres over the geo columns added by migration 0004.
+
+The column is geography(Point) with PostGIS, earth with cube/earthdistance, or the built-in point (lon, lat)
+otherwise; every backend has a GiST index on it, so ORDER BY geo <-> point LIMIT k is an index KNN scan.
+Built-in points measure distance in degrees, so their results are over-fetched and re-ordered by geodesic
+distance, as the in-memory SpatialIndex orders them.
+"""
+import math
+from typing import Any, Dict, List, Optional, Sequence
+from geopy.distance import geodesic
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from utils.spatial_index import KM_PER_DEGREE, haversine
+
+# Column type prefix -> backend
+GEO_BACKENDS = {"geography": "postgis", "earth": "earthdistance", "point": "point"}
+
+GEO_POINTS = {
+    "postgis": "ST_SetSRID(ST_MakePoint(CAST(:lon AS float8), CAST(:lat AS float8)), 4326)::geography",
+    "earthdistance": "ll_to_earth(CAST(:lat AS float8), CAST(:lon AS float8))",
+    "point": "point(CAST(:lon AS float8), CAST(:lat AS float8))",
+}
+
+GEO_WITHIN = {
+    "postgis": "ST_DWithin(geo, {point}, CAST(:radius_m AS float8))",
+    "earthdistance": "geo <@ earth_box({point}, CAST(:radius_m AS float8)) AND earth_distance(geo, {point}) <= CAST(:radius_m AS float8)",
+    # Bounding box only; rows outside the circle are dropped after the haversine re-check
+    "point": "geo <@ box(point(CAST(:west AS float8), CAST(:south AS float8)), point(CAST(:east AS float8), CAST(:north AS float8)))",
+}
+
+# Candidates fetched per requested row with built-in points, before re-ordering by geodesic distance
+POINT_OVERFETCH = 4
+
+
+async def detect_geo_backend(db: AsyncSession) -> Optional[str]:
+    """Backend of the geo columns, or None when migration 0004 has not run."""
+    result = await db.execute(text(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = 'volunteers'::regclass AND attname = 'geo' AND NOT attisdropped"
+    ))
+    geo_type = result.scalar_one_or_none()
+    if geo_type is None:
+        return None
+    return next((backend for prefix, backend in GEO_BACKENDS.items() if geo_type.startswith(prefix)), None)
+
+
+class GeoSearch():
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.point = GEO_POINTS[backend]
+
+    async def nearest(self, db: AsyncSession, model, location: Sequence[float], limit: int,
+                      radius_km: Optional[float] = None, filters: Sequence[Any] = ()) -> List[Any]:
+        """Up to limit rows of model nearest to a (lat, lon) location, closest first, optionally within radius_km."""
+        params: Dict[str, float] = {"lat": location[0], "lon": location[1]}
+        query = select(model).filter(text("geo IS NOT NULL"), *filters)
+        if radius_km is not None:
+            query = query.filter(text(GEO_WITHIN[self.backend].format(point=self.point)))
+            if self.backend == "point":
+                lat_span = radius_km / KM_PER_DEGREE
+                lon_span = min(180.0, lat_span / max(math.cos(math.radians(min(89.9, abs(location[0]) + lat_span))), 1e-6))
+                params.update(south=location[0] - lat_span, north=location[0] + lat_span, west=location[1] - lon_span, east=location[1] + lon_span)
+            else:
+                params["radius_m"] = radius_km * 1000
+        fetch = limit * POINT_OVERFETCH if self.backend == "point" else limit
+        query = query.order_by(text(f"geo <-> {self.point}")).limit(fetch)
+        rows = (await db.execute(query, params)).scalars().all()
+        if self.backend != "point":
+            return list(rows)
+        if radius_km is not None:
+            rows = [row for row in rows if haversine(location, row.location) <= radius_km]
+        return sorted(rows, key=lambda row: geodesic(tuple(location), tuple(row.location)).km)[:limit]
@@ -0,0 +1,119 @@
+"""
+Schema changes applied on top of init_db's create_all, for databases that already hold data.
+
+Each migration runs once, in order, inside one transaction, and is recorded in schema_migrations. Workers
+starting together serialise on an advisory lock so only one of them applies anything.
+Statements must be idempotent (IF NOT EXISTS) because init_db may already have created the objects.
+
+Run from algo/app: python -m db.migrations
+"""
+import asyncio
+from typing import List, Tuple
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from db.database import engine
+
+# Arbitrary key for pg_advisory_xact_lock, shared by every worker running migrations
+MIGRATION_LOCK_KEY = 804_117_001
+
+MIGRATIONS: List[Tuple[str, List[str]]] = [
+    ("0001_allocation_queue_state", [
+        """
+        CREATE TABLE IF NOT EXISTS allocation_queue_state (
+            donation_id UUID PRIMARY KEY,
+            "window" UUID[] NOT NULL,
+            offered UUID[] NOT NULL DEFAULT '{}',
+            "cursor" INTEGER NOT NULL DEFAULT 0,
+            exhausted BOOLEAN NOT NULL DEFAULT FALSE,
+            deadline TIMESTAMP WITHOUT TIME ZONE NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_allocation_queue_state_deadline ON allocation_queue_state (deadline)",
+    ]),
+    ("0002_donation_listing_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_donations_donor_id_id ON donations (donor_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_donations_agency_id_id ON donations (agency_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_donations_status_id ON donations (status, id)",
+        "CREATE INDEX IF NOT EXISTS ix_donations_food_type_id ON donations (food_type, id)",
+    ]),
+    ("0003_lookup_and_open_indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_agencies_name ON agencies (name)",
+        "CREATE INDEX IF NOT EXISTS ix_donors_name ON donors (name)",
+        "CREATE INDEX IF NOT EXISTS ix_donations_volunteer_id_id ON donations (volunteer_id, id)",
+        "CREATE INDEX IF NOT EXISTS ix_donations_open ON donations (id) WHERE status IN ('READY', 'ALLOCATED')",
+    ]),
+    # Native geo column next to every JSON location, filled by a trigger so writers keep using location.
+    # geography(Point) with PostGIS, earth with cube/earthdistance, else the built-in point (lon, lat).
+    ("0004_geo_columns", [
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'postgis') THEN
+                CREATE EXTENSION IF NOT EXISTS postgis;
+            ELSIF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'earthdistance') THEN
+                CREATE EXTENSION IF NOT EXISTS cube;
+                CREATE EXTENSION IF NOT EXISTS earthdistance;
+            END IF;
+        EXCEPTION WHEN insufficient_privilege THEN
+            RAISE NOTICE 'Not allowed to create geo extensions, using the built-in point type';
+        END
+        $$
+        """,
+        """
+        DO $$
+        DECLARE
+            geo_type TEXT := 'point';
+            geo_expr TEXT := 'point((%1$s->>1)::float8, (%1$s->>0)::float8)';
+            t TEXT;
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'postgis') THEN
+                geo_type := 'geography(Point, 4326)';
+                geo_expr := 'ST_SetSRID(ST_MakePoint((%1$s->>1)::float8, (%1$s->>0)::float8), 4326)::geography';
+            ELSIF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'earthdistance') THEN
+                geo_type := 'earth';
+                geo_expr := 'll_to_earth((%1$s->>0)::float8, (%1$s->>1)::float8)';
+            END IF;
+            EXECUTE format(
+                'CREATE OR REPLACE FUNCTION sync_location_geo() RETURNS trigger LANGUAGE plpgsql AS $f$ BEGIN NEW.geo := %s; RETURN NEW; END $f$',
+                format(geo_expr, 'NEW.location')
+            );
+            FOREACH t IN ARRAY ARRAY['agencies', 'donors', 'donations', 'volunteers'] LOOP
+                EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS geo %s', t, geo_type);
+                EXECUTE format('UPDATE %I SET geo = %s', t, format(geo_expr, 'location'));
+                EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING gist (geo)', 'ix_' || t || '_geo', t);
+                EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_sync_geo', t);
+                EXECUTE format(
+                    'CREATE TRIGGER %I BEFORE INSERT OR UPDATE OF location ON %I FOR EACH ROW EXECUTE FUNCTION sync_location_geo()',
+                    t || '_sync_geo', t
+                );
+            END LOOP;
+        END
+        $$
+        """,
+    ]),
+]
+
+
+async def run_migrations(db_engine: AsyncEngine = engine) -> List[str]:
+    """Apply pending migrations and return the names of those applied."""
+    applied = []
+    async with db_engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR PRIMARY KEY, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+        ))
+        result = await conn.execute(text("SELECT name FROM schema_migrations"))
+        done = set(result.scalars().all())
+        for name, statements in MIGRATIONS:
+            if name in done:
+                continue
+            for statement in statements:
+                await conn.execute(text(statement))
+            await conn.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+            applied.append(name)
+            print(f"Applied migration {name}")
+    return applied
+
+
+if __name__ == "__main__":
+    asyncio.run(run_migrations())
@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Enum as SqlEnum, JSON, ForeignKey, Boolean, Float, DateTime, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Enum as SqlEnum, JSON, ForeignKey, Boolean, Float, DateTime, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import UUID, ARRAY
+from sqlalchemy.sql import func, text
 from sqlalchemy.ext.declarative import declarative_base
 from enum import Enum
 import uuid
@@ -23,6 +23,10 @@ class DonationStatus(str, Enum):
     ACCEPTED = 'Accepted'
     COLLECTED = 'Collected'
 
+# Locations are JSON [lat, lon]. Migration 0004 adds a native geo column to agencies, donors, donations and
+# volunteers, kept in sync by a trigger and searched by db/geo.py; it is not mapped because its type depends
+# on the extensions installed.
+
 # Entity models
 
 
@@ -31,7 +35,8 @@ class AgencyModel(Base):
 
     id = Column(UUID(as_uuid=True), primary_key=True,
                 index=True, default=uuid.uuid4)
-    name = Column(String, nullable=False)
+    # /me endpoints look agencies up by the name in the caller's token
+    name = Column(String, nullable=False, index=True)
     priority_flag = Column(Boolean, default=False)
     location = Column(JSON, nullable=False, default=lambda: [0.0, 0.0])
 
@@ -53,8 +58,21 @@ class DonationModel(Base):
     status = Column(SqlEnum(DonationStatus), default=DonationStatus.READY)
     agency_id = Column(UUID(as_uuid=True), ForeignKey(
         "agencies.id"), nullable=True)
+    volunteer_id = Column(UUID(as_uuid=True), ForeignKey(
+        "volunteers.id"), nullable=True)
     expiry_time = Column(DateTime(timezone=True), server_default=func.now())
 
+    # Filtered listings page in id order, so each filter column is indexed together with id
+    __table_args__ = (
+        Index("ix_donations_donor_id_id", "donor_id", "id"),
+        Index("ix_donations_agency_id_id", "agency_id", "id"),
+        Index("ix_donations_status_id", "status", "id"),
+        Index("ix_donations_food_type_id", "food_type", "id"),
+        Index("ix_donations_volunteer_id_id", "volunteer_id", "id"),
+        # Only a small share of donations is still open; recovery and pending counts read just those
+        Index("ix_donations_open", "id", postgresql_where=text("status IN ('READY', 'ALLOCATED')")),
+    )
+
     def __repr__(self):
         return f"<Donation(id={self.id}, donor_id={self.donor_id}, status={self.status})>"
 
@@ -63,7 +81,7 @@ class DonorModel(Base):
     __tablename__ = "donors"
 
     id = Column(UUID(as_uuid=True), primary_key=True, index=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     location = Column(JSON, nullable=False, default=lambda: [0.0, 0.0])
     # Assuming this represents total donation weight
     donations = Column(Float, nullable=True)
@@ -97,3 +115,19 @@ class VolunteerModel(Base):
 
     def __repr__(self):
         return f"<Volunteer(id={self.id}, name={self.name}, delivery={self.delivery})>"
+
+
+class AllocationQueueStateModel(Base):
+    __tablename__ = "allocation_queue_state"
+
+    # No foreign key: rows are written behind, and a donation deleted meanwhile must not fail the whole batch
+    donation_id = Column(UUID(as_uuid=True), primary_key=True)
+    # Agency ids of the ranked window currently being offered, and of earlier windows already offered
+    window = Column(ARRAY(UUID(as_uuid=True)), nullable=False)
+    offered = Column(ARRAY(UUID(as_uuid=True)), nullable=False, default=list)
+    cursor = Column(Integer, nullable=False, default=0)
+    exhausted = Column(Boolean, nullable=False, default=False)
+    deadline = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<AllocationQueueState(donation_id={self.donation_id}, cursor={self.cursor}, deadline={self.deadline})>"
@@ -3,11 +3,14 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 from db.database import Base, engine
 from db.models import AgencyModel, DonationModel, DonorModel
+from db.migrations import run_migrations
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
+        await conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
         await conn.run_sync(Base.metadata.create_all)
+    await run_migrations(engine)
     
     async with AsyncSession(engine) as session:
         async with session.begin():
@@ -1,37 +1,42 @@
 import os
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from db.database import get_db
+from db.database import engine
+from db.migrations import run_migrations
 from db.models import AgencyModel
 from schemas.Agency import Agency
 from routers.agency_router import router as agency_router
 from routers.donation_router import router as donation_router
 from routers.donor_router import router as donor_router
 from routers.requirement_router import router as requirement_router
-from uuid import uuid4
+from routers.volunteer_router import router as volunteer_router
+from typing import Optional
+from uuid import UUID, uuid4
 from AllocationSystem import get_allocation_system
+from utils.identity import identity_for_token
 
 
 load_dotenv()
 
+# Browsers can not set headers on a WebSocket; a client may instead offer this subprotocol followed by its token
+WS_TOKEN_SUBPROTOCOL = "bearer"
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    async for db in get_db():
-        allocation_system = await get_allocation_system(db)
-        app.state.allocation_system = allocation_system
-        app.state.db = db
-        break  # We only need one database session for initialization
+    await run_migrations(engine)
+    app.state.allocation_system = await get_allocation_system()
     yield
     # Shutdown
-    if hasattr(app.state, 'db'):
-        await app.state.db.close()
+    await app.state.allocation_system.shutdown()
+    await engine.dispose()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -42,6 +47,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routers
@@ -49,18 +55,51 @@ app.include_router(agency_router, prefix="/api", tags=["agencies"])
 app.include_router(donation_router, prefix="/api", tags=["donations"])
 app.include_router(donor_router, prefix="/api", tags=["donors"])
 app.include_router(requirement_router, prefix="/api", tags=["requirements"])
+app.include_router(volunteer_router, prefix="/api", tags=["volunteers"])
 
 
 @app.websocket("/ws/{agency_id}")
-async def websocket_endpoint(websocket: WebSocket, agency_id: str):
-    await allocation_system.connect(websocket, agency_id)
-    try:
-        while True:
-            data = await websocket.receive_json()
-            print(f"Received message from agency {agency_id}: {data}")
-    except WebSocketDisconnect:
-        allocation_system.disconnect(agency_id)
-        print(f"Agency {agency_id} disconnected.")
+async def websocket_endpoint(websocket: WebSocket, agency_id: UUID, last_event_id: Optional[str] = None, token: Optional[str] = None):
+    """
+    Pushes allocation offers to an agency as they happen, replacing polling of GET /donations/me.
+
+    Authenticate with ?token=<access token>, or offer the subprotocols "bearer" and <access token>, in that
+    order, to keep the token out of the URL; the socket is then accepted with "bearer". The token must be a
+    Beneficiary's whose agency is agency_id, otherwise the socket is closed with 1008.
+
+    Events are JSON objects with an "id"; pings ({"type": "ping"}) arrive when idle and the client should
+    send something (e.g. "pong") at least every two heartbeats. After a disconnect, reconnect with
+    ?last_event_id=<id of the last event received> to get the events missed meanwhile.
+    """
+    subprotocol = None
+    if token is None:
+        protocols = websocket.scope.get("subprotocols", [])
+        if len(protocols) == 2 and protocols[0] == WS_TOKEN_SUBPROTOCOL:
+            subprotocol, token = protocols
+    if last_event_id is not None and not last_event_id.isdigit():
+        await websocket.close(code=1008)
+        return
+    identity = await identity_for_token(token)
+    if identity is None or identity.role != "Beneficiary" or identity.entity_id != agency_id:
+        await websocket.close(code=1008)
+        return
+    await app.state.allocation_system.connections.connect(websocket, agency_id, last_event_id, subprotocol)
+    print(f"Agency {agency_id} disconnected.")
+
+
+@app.get("/allocation/stats")
+async def allocation_stats():
+    return app.state.allocation_system.stats()
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 with recovery progress until pending donations have been recovered."""
+    allocation_system = app.state.allocation_system
+    return JSONResponse(
+        status_code=200 if allocation_system.ready else 503,
+        content={"ready": allocation_system.ready, "recovery": allocation_system.recovery}
+    )
 
 
 @app.get("/health")
@@ -1,12 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from db.database import get_db
 from db.models import AgencyModel
 from schemas.Agency import Agency, AgencyRequirementsUpdate, AgencyPriorityFlagUpdate, AgencyLocationUpdate
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from uuid import UUID
 from utils.jwt_auth import get_current_user
+from utils.identity import Identity, get_current_identity, identity_cache
+from utils.listing import ListParams, list_params, read_page, ndjson_export
+from AllocationSystem import AllocationSystem, get_allocation_system
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -31,6 +34,7 @@ class AgencyLocationUpdate(BaseModel):
 @router.post("/agencies", response_model=Agency)
 async def create_agency(
         db: AsyncSession = Depends(get_db),
+        allocation_system: AllocationSystem = Depends(get_allocation_system),
         current_user=Depends(get_current_user)):
 
     try:
@@ -54,8 +58,11 @@ async def create_agency(
 
         # db_agency = AgencyModel(**agency.model_dump())
         db.add(agency)
+        await db.flush()
+        await allocation_system.publish_agency(db, agency.id, Agency.model_validate(agency))
         await db.commit()
         await db.refresh(agency)
+        identity_cache.invalidate(current_user["role"], current_user["company_name"])
 
         return Agency.model_validate(agency)
 
@@ -72,30 +79,37 @@ async def create_agency(
 
 
 @router.get("/agencies", response_model=List[Agency])
-async def read_agencies(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(AgencyModel).offset(skip).limit(limit))
-    agencies = result.scalars().all()
+async def read_agencies(
+    response: Response,
+    priority_flag: Optional[bool] = None,
+    params: ListParams = Depends(list_params),
+    db: AsyncSession = Depends(get_db)
+):
+    query = select(AgencyModel)
+    if priority_flag is not None:
+        query = query.filter(AgencyModel.priority_flag == priority_flag)
+    if params.format == "ndjson":
+        return ndjson_export(query, AgencyModel, params)
+    agencies = await read_page(db, query, AgencyModel.id, params, response)
     return [Agency.model_validate(agency) for agency in agencies]
 
 
 @router.get("/agencies/me", response_model=Agency)
 async def read_agency_as_me(
         db: AsyncSession = Depends(get_db),
-        current_user=Depends(get_current_user)):
+        identity: Identity = Depends(get_current_identity)):
 
-    if current_user["role"] != "Beneficiary":
+    if identity.role != "Beneficiary":
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authorized to read an agency."
         )
 
-    result = await db.execute(select(AgencyModel).filter(AgencyModel.name == current_user["company_name"]))
-    agencies = result.scalars().all()
-
-    if not agencies:
+    agency = await db.get(AgencyModel, identity.entity_id) if identity.entity_id else None
+    if agency is None:
+        identity_cache.invalidate(identity.role, identity.company_name)
         raise HTTPException(status_code=404, detail="Agency not found")
 
-    agency = agencies[0]
     return Agency.model_validate(agency)
 
 
@@ -119,12 +133,14 @@ async def update_agency(agency_id: UUID, agency: Agency, db: AsyncSession = Depe
 
 
 @router.delete("/agencies/{agency_id}", response_model=Agency)
-async def delete_agency(agency_id: UUID, db: AsyncSession = Depends(get_db)):
+async def delete_agency(agency_id: UUID, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(AgencyModel).filter(AgencyModel.id == agency_id))
     agency = result.scalar_one_or_none()
     if agency is None:
         raise HTTPException(status_code=404, detail="Agency not found")
     await db.delete(agency)
+    await allocation_system.publish_agency(db, agency_id, None)
+    await allocation_system.publish_identity_change(db, agency_id)
     await db.commit()
     return Agency.model_validate(agency)
 
@@ -142,24 +158,26 @@ async def update_agency_requirements(agency_id: UUID, requirements_update: Agenc
 
 
 @router.patch("/agencies/{agency_id}/priority-flag", response_model=Agency)
-async def set_agency_priority_flag(agency_id: UUID, priority_update: AgencyPriorityFlagUpdate, db: AsyncSession = Depends(get_db)):
+async def set_agency_priority_flag(agency_id: UUID, priority_update: AgencyPriorityFlagUpdate, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(AgencyModel).filter(AgencyModel.id == agency_id))
     agency = result.scalar_one_or_none()
     if agency is None:
         raise HTTPException(status_code=404, detail="Agency not found")
     agency.priority_flag = priority_update.priority_flag
+    await allocation_system.publish_agency(db, agency.id, Agency.model_validate(agency))
     await db.commit()
     await db.refresh(agency)
     return Agency.model_validate(agency)
 
 
 @router.patch("/agencies/{agency_id}/location", response_model=Agency)
-async def update_agency_location(agency_id: UUID, location_update: AgencyLocationUpdate, db: AsyncSession = Depends(get_db)):
+async def update_agency_location(agency_id: UUID, location_update: AgencyLocationUpdate, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(AgencyModel).filter(AgencyModel.id == agency_id))
     agency = result.scalar_one_or_none()
     if agency is None:
         raise HTTPException(status_code=404, detail="Agency not found")
     agency.location = location_update.location
+    await allocation_system.publish_agency(db, agency.id, Agency.model_validate(agency))
     await db.commit()
     await db.refresh(agency)
 
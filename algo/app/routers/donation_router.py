@@ -1,22 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+import json
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from db.database import get_db
-from db.models import DonationModel, AgencyModel, RequirementModel, DonorModel
+from db.models import DonationModel, DonorModel
 from schemas.Donation import Donation, DonationCreated
-from schemas.Agency import Agency
-from schemas.Requirement import Requirement
 from schemas.DonationStatus import DonationStatus
-from AllocationSystem import AllocationSystem
-from routers.agency_router import read_agencies
-from typing import List, Tuple
-from AllocationSystem import get_allocation_system
+from schemas.FoodType import FoodType
+from AllocationSystem import AllocationSystem, get_allocation_system
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 from uuid import UUID
-from utils.jwt_auth import get_current_user
+from utils.identity import Identity, get_current_identity, identity_cache
+from utils.listing import ListParams, list_params, read_page, ndjson_export
 
 router = APIRouter()
 
+MAX_BULK_DONATIONS = 1000
+# Idle event streams get a comment line this often, so proxies keep them open and dead clients are noticed
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
 
 class AgencyUpdate(BaseModel):
     agency_id: UUID
@@ -42,8 +49,8 @@ async def handle_donation_response(
     donation_id: UUID,
     action: str,
     db: AsyncSession = Depends(get_db),
-    allocation_system: AsyncSession = Depends(get_allocation_system),
-    current_user=Depends(get_current_user)
+    allocation_system: AllocationSystem = Depends(get_allocation_system),
+    identity: Identity = Depends(get_current_identity)
 ):
     try:
         if action not in ['accept', 'reject']:
@@ -52,21 +59,15 @@ async def handle_donation_response(
                 detail="Invalid action. Must be 'accept' or 'reject'."
             )
 
-        if current_user["role"] != "Beneficiary":
+        if identity.role != "Beneficiary":
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Unauthorized user. Agency role required."
             )
 
         # check if the agency exists
-        result = await db.execute(
-            select(AgencyModel).filter(
-                AgencyModel.name == current_user["company_name"]
-            )
-        )
-        agency: AgencyModel = result.scalars().first()
-
-        if agency is None:
+        agency_id = identity.entity_id
+        if agency_id is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Agency not found"
@@ -74,12 +75,12 @@ async def handle_donation_response(
 
         # Process the action
         if action == 'accept':
-            success = await allocation_system.accept_donation(donation_id, agency.id)
+            success = await allocation_system.accept_donation(donation_id, agency_id)
         else:  # action == 'reject'
-            success = await allocation_system.reject_donation(donation_id, agency.id)
+            success = await allocation_system.reject_donation(donation_id, agency_id)
 
         message = (
-            f"""Failed to {action} the donation (ID: {donation_id}) for agency (ID: {agency.id}).
+            f"""Failed to {action} the donation (ID: {donation_id}) for agency (ID: {agency_id}).
             This could be because the donation has already been processed, the agency is not first in the allocation queue,
             or there was an unexpected issue. Please check the current status of the donation and try again if necessary."""
         )
@@ -92,7 +93,7 @@ async def handle_donation_response(
 
         return DonationResponse(
             donation_id=donation_id,
-            agency_id=agency.id,
+            agency_id=agency_id,
             action=action,
             success=success
         )
@@ -109,50 +110,31 @@ async def handle_donation_response(
         )
 
 
-async def get_allocation_system(request):
-    return request.app.state.allocation_system
-
-# Temporary function for non-routed reads
-
-
-async def fetch_agencies(db: AsyncSession, skip: int = 0, limit: int = 100):
-    result = await db.execute(select(AgencyModel).offset(skip).limit(limit))
-    agencies = result.scalars().all()
-    return [Agency.model_validate(agency) for agency in agencies]
-
-# Temporary function for non-routed reads
-
-
-async def fetch_requirements(db: AsyncSession, skip: int = 0, limit: int = 100):
-    result = await db.execute(select(RequirementModel).offset(skip).limit(limit))
-    requirements = result.scalars().all()
-    return [Requirement.model_validate(agency) for agency in requirements]
+def to_donation_model(donation: Donation) -> DonationModel:
+    """Build the row for a donation; raises ValueError on an unknown food type or status."""
+    return DonationModel(**{
+        **donation.model_dump(),
+        "food_type": FoodType(donation.food_type),
+        "status": DonationStatus(donation.status),
+    })
 
 
 @router.post("/donations/me", response_model=Donation)
 async def create_donation_as_me(
     donation_created: DonationCreated,
     db: AsyncSession = Depends(get_db),
-    allocation_system: AsyncSession = Depends(get_allocation_system),
-    current_user=Depends(get_current_user)
+    allocation_system: AllocationSystem = Depends(get_allocation_system),
+    identity: Identity = Depends(get_current_identity)
 ):
-    result = await db.execute(
-        select(DonorModel).filter(
-            DonorModel.name == current_user["company_name"]
-        )
-    )
-    donors = result.scalars().all()
-
-    if not donors:
+    if identity.role != "Donor" or identity.entity_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Donor not found"
         )
 
-    donor = donors[0]
-
     donation = Donation(
-        donor_id=donor.id,
+        id=allocation_system.new_donation_id(),
+        donor_id=identity.entity_id,
         food_type=donation_created.food_type,
         quantity=donation_created.quantity,
         location=donation_created.location,
@@ -160,100 +142,145 @@ async def create_donation_as_me(
         expiry_time=donation_created.expiry_time
     )
 
-    # db_donation = DonationModel(**donation.model_dump())
-    db.add(donation)
-    await db.commit()
-    await db.refresh(donation)
+    try:
+        return await insert_and_allocate(donation, db, allocation_system)
+    except HTTPException as e:
+        # A rejected insert may mean the cached donor id belongs to a donor deleted since
+        if e.status_code != status.HTTP_400_BAD_REQUEST or await db.get(DonorModel, identity.entity_id) is not None:
+            raise
+        identity_cache.invalidate(identity.role, identity.company_name)
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Donor not found")
 
-    agencies = await fetch_agencies(db)
-    await allocation_system.allocate_donation(donation, agencies)
 
-    return Donation.model_validate(donation)
+@ router.post("/donations", response_model=Donation)
+async def create_donation(donation: Donation, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
+    return await insert_and_allocate(donation, db, allocation_system)
 
 
-@ router.post("/donations", response_model=Donation)
-async def create_donation(donation: Donation, request: Request, db: AsyncSession = Depends(get_db)
-                          ):
-    allocation_system = await get_allocation_system(request)
-    # db_donation = DonationModel(**donation.model_dump())
-    db.add(donation)
-    await db.commit()
-    await db.refresh(donation)
+async def insert_and_allocate(donation: Donation, db: AsyncSession, allocation_system: AllocationSystem) -> Donation:
+    """Insert one donation and rank it against the in-memory agency registry."""
+    try:
+        db.add(to_donation_model(donation))
+        await db.commit()
+    except (IntegrityError, ValueError) as e:
+        await db.rollback()
+        print(f"Donation insert failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid donation: check the donor id, food type and status."
+        )
 
-    agencies = await fetch_agencies(db)
-    # requirements = await fetch_requirements(db)
-    await allocation_system.allocate_donation(donation, agencies)
+    await allocation_system.allocate_donation(donation)
+
+    return donation
 
-    return Donation.model_validate(donation)
+
+@ router.post("/donations/bulk", response_model=List[Donation])
+async def create_donations_bulk(donations: List[Donation], db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
+    """
+    Create and allocate many donations at once: one multi-row INSERT, one batched ranking pass
+    against the agency registry and one UPDATE for the allocated statuses.
+    """
+    if not donations:
+        return []
+    if len(donations) > MAX_BULK_DONATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BULK_DONATIONS} donations can be created per request."
+        )
+
+    try:
+        rows = [
+            {
+                **donation.model_dump(),
+                "food_type": FoodType(donation.food_type),
+                "status": DonationStatus(donation.status),
+            }
+            for donation in donations
+        ]
+        await db.execute(insert(DonationModel).values(rows))
+        await db.commit()
+    except (IntegrityError, ValueError) as e:
+        await db.rollback()
+        print(f"Bulk donation insert failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid donations: check donor ids, food types and statuses."
+        )
+
+    allocated = await allocation_system.allocate_donations(donations)
+
+    return [Donation.model_validate(donation) for donation in allocated]
 
 
 @ router.get("/donations", response_model=List[Donation])
-async def read_donations(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(DonationModel).offset(skip).limit(limit))
-    donations = result.scalars().all()
+async def read_donations(
+    response: Response,
+    donation_status: Optional[DonationStatus] = Query(None, alias="status"),
+    food_type: Optional[FoodType] = None,
+    donor_id: Optional[UUID] = None,
+    agency_id: Optional[UUID] = None,
+    volunteer_id: Optional[UUID] = None,
+    params: ListParams = Depends(list_params),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Donations in id order, optionally filtered. Page with limit and after=<X-Next-Cursor of the previous
+    page>, or pass format=ndjson to stream every matching donation, e.g. for reporting.
+    """
+    query = select(DonationModel)
+    for column, value in ((DonationModel.status, donation_status), (DonationModel.food_type, food_type), (DonationModel.donor_id, donor_id),
+                          (DonationModel.agency_id, agency_id), (DonationModel.volunteer_id, volunteer_id)):
+        if value is not None:
+            query = query.filter(column == value)
+    if params.format == "ndjson":
+        return ndjson_export(query, DonationModel, params)
+    donations = await read_page(db, query, DonationModel.id, params, response)
     return [Donation.model_validate(donation) for donation in donations]
 
 
 @ router.get("/donations/me", response_model=List[Donation])
 async def read_donations_as_me(
     db: AsyncSession = Depends(get_db),
-    current_user=Depends(get_current_user)
+    identity: Identity = Depends(get_current_identity)
 ):
     try:
-        if current_user["role"] == "Beneficiary":
+        if identity.role == "Beneficiary":
 
             # check if the agency exists
-            result = await db.execute(
-                select(AgencyModel).filter(
-                    AgencyModel.name == current_user["company_name"]
-                )
-            )
-            agencies: List[AgencyModel] = result.scalars().all()
-
-            if not agencies:
+            if identity.entity_id is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Agency not found"
                 )
 
-            agency = agencies[0]
-
             # retrieve all donations for the agency
             result = await db.execute(
                 select(DonationModel).filter(
-                    DonationModel.agency_id == agency.id)
+                    DonationModel.agency_id == identity.entity_id)
             )
             donations = result.scalars().all()
 
             return [Donation.model_validate(donation) for donation in donations]
 
-        elif current_user["role"] == "Donor":
+        elif identity.role == "Donor":
 
             # check if the donor exists
-            result = await db.execute(
-                select(DonorModel).filter(
-                    DonorModel.name == current_user["company_name"]
-                )
-            )
-            donors: List[DonorModel] = result.scalars().all()
-
-            if not donors:
+            if identity.entity_id is None:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail="Donor not found"
                 )
 
-            donor = donors[0]
-
             # retrieve all donations for the donor
             result = await db.execute(
                 select(DonationModel).filter(
-                    DonationModel.donor_id == donor.id)
+                    DonationModel.donor_id == identity.entity_id)
             )
             donations = result.scalars().all()
 
             return [Donation.model_validate(donation) for donation in donations]
-        elif current_user["role"] == "Volunteer":
+        elif identity.role == "Volunteer":
             pass
         else:
             raise HTTPException(
@@ -272,6 +299,43 @@ async def read_donations_as_me(
         )
 
 
+@ router.get("/donations/me/events")
+async def stream_donation_events_as_me(
+    allocation_system: AllocationSystem = Depends(get_allocation_system),
+    identity: Identity = Depends(get_current_identity)
+):
+    """
+    Server-Sent Events stream of status changes of the caller's donations: those a donor gave, or those
+    allocated to or accepted by an agency. An agency gets an ALLOCATED event naming it each time a donation
+    is offered to it, including when the previous agency rejects or lets the offer expire. Each event is
+    `event: status` with the donation id, donor id, agency id and new status as JSON data. A client that falls behind receives only the latest status of
+    each donation. Fetch GET /donations/me once when (re)connecting, then follow the stream.
+    """
+    if identity.role not in ("Beneficiary", "Donor"):
+        raise HTTPException(status_code=400, detail="Role not found")
+    owner_id = identity.entity_id
+    if owner_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Agency not found" if identity.role == "Beneficiary" else "Donor not found"
+        )
+
+    async def events():
+        subscription = allocation_system.donation_events.subscribe(owner_id)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                pending = await subscription.get(SSE_HEARTBEAT_SECONDS)
+                if not pending:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield "".join(f"event: status\ndata: {json.dumps(event)}\n\n" for event in pending)
+        finally:
+            allocation_system.donation_events.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @ router.get("/donations/{donation_id}", response_model=Donation)
 async def read_donation(donation_id: UUID, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(DonationModel).filter(DonationModel.id == donation_id))
@@ -282,17 +346,20 @@ async def read_donation(donation_id: UUID, db: AsyncSession = Depends(get_db)):
 
 
 @ router.put("/donations/{donation_id}", response_model=Donation)
-async def update_donation(donation_id: UUID, donation: Donation, db: AsyncSession = Depends(get_db)):
+async def update_donation(donation_id: UUID, donation: Donation, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(DonationModel).filter(DonationModel.id == donation_id))
     db_donation = result.scalar_one_or_none()
     if db_donation is None:
         raise HTTPException(status_code=404, detail="Donation not found")
+    previous_status = db_donation.status
 
     for key, value in donation.dict(exclude_unset=True).items():
         setattr(db_donation, key, value)
 
     await db.commit()
     await db.refresh(db_donation)
+    if db_donation.status != previous_status:
+        await allocation_system.announce_statuses([db_donation])
     return Donation.model_validate(db_donation)
 
 
@@ -308,7 +375,7 @@ async def delete_donation(donation_id: UUID, db: AsyncSession = Depends(get_db))
 
 
 @ router.patch("/donations/{donation_id}/status", response_model=Donation)
-async def update_donation_status(donation_id: UUID, update_data: DonationStatusUpdate, db: AsyncSession = Depends(get_db)):
+async def update_donation_status(donation_id: UUID, update_data: DonationStatusUpdate, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(DonationModel).filter(DonationModel.id == donation_id))
     donation = result.scalar_one_or_none()
     if donation is None:
@@ -316,6 +383,7 @@ async def update_donation_status(donation_id: UUID, update_data: DonationStatusU
     donation.status = update_data.status
     await db.commit()
     await db.refresh(donation)
+    await allocation_system.announce_statuses([donation])
     return Donation.model_validate(donation)
 
 
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from db.database import get_db
@@ -8,6 +8,9 @@ from typing import List, Tuple
 from uuid import UUID
 from pydantic import BaseModel
 from utils.jwt_auth import get_current_user
+from utils.identity import Identity, get_current_identity, identity_cache
+from utils.listing import ListParams, list_params, read_page, ndjson_export
+from AllocationSystem import AllocationSystem, get_allocation_system
 
 router = APIRouter()
 
@@ -47,35 +50,35 @@ async def create_donor(
     db.add(donor)
     await db.commit()
     await db.refresh(donor)
+    identity_cache.invalidate(current_user["role"], current_user["company_name"])
     return Donor.model_validate(donor)
 
 
 @router.get("/donors", response_model=List[Donor])
-async def read_donors(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(DonorModel).offset(skip).limit(limit))
-    donors = result.scalars().all()
+async def read_donors(response: Response, params: ListParams = Depends(list_params), db: AsyncSession = Depends(get_db)):
+    query = select(DonorModel)
+    if params.format == "ndjson":
+        return ndjson_export(query, DonorModel, params)
+    donors = await read_page(db, query, DonorModel.id, params, response)
     return [Donor.model_validate(donor) for donor in donors]
 
 
 @router.get("/donors/me", response_model=Donor)
 async def read_donor_as_me(
         db: AsyncSession = Depends(get_db),
-        current_user=Depends(get_current_user)):
+        identity: Identity = Depends(get_current_identity)):
 
-    if current_user["role"] != "Donor":
+    if identity.role != "Donor":
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authorized to read a donor."
         )
 
-    result = await db.execute(select(DonorModel).filter(DonorModel.name == current_user["company_name"]))
-    donors = result.scalars().all()
-
-    if not donors:
+    donor = await db.get(DonorModel, identity.entity_id) if identity.entity_id else None
+    if donor is None:
+        identity_cache.invalidate(identity.role, identity.company_name)
         raise HTTPException(status_code=404, detail="Donor not found")
 
-    donor = donors[0]
-
     return Donor.from_orm(donor)
 
 
@@ -103,7 +106,7 @@ async def read_donor(donor_id: UUID, db: AsyncSession = Depends(get_db)):
 
 
 @router.put("/donors/{donor_id}", response_model=Donor)
-async def update_donor(donor_id: UUID, donor: Donor, db: AsyncSession = Depends(get_db)):
+async def update_donor(donor_id: UUID, donor: Donor, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(DonorModel).filter(DonorModel.id == donor_id))
     db_donor = result.scalar_one_or_none()
     if db_donor is None:
@@ -112,18 +115,20 @@ async def update_donor(donor_id: UUID, donor: Donor, db: AsyncSession = Depends(
     for key, value in donor.dict(exclude_unset=True).items():
         setattr(db_donor, key, value)
 
+    await allocation_system.publish_identity_change(db, db_donor.id)
     await db.commit()
     await db.refresh(db_donor)
     return Donor.model_validate(db_donor)
 
 
 @router.delete("/donors/{donor_id}", response_model=Donor)
-async def delete_donor(donor_id: str, db: AsyncSession = Depends(get_db)):
+async def delete_donor(donor_id: str, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(DonorModel).filter(DonorModel.id == donor_id))
     donor = result.scalar_one_or_none()
     if donor is None:
         raise HTTPException(status_code=404, detail="Donor not found")
     await db.delete(donor)
+    await allocation_system.publish_identity_change(db, donor.id)
     await db.commit()
     return Donor.model_validate(donor)
 
@@ -132,9 +137,9 @@ async def delete_donor(donor_id: str, db: AsyncSession = Depends(get_db)):
 async def update_donor_location_me(
         req: DonorLocationUpdate,
         db: AsyncSession = Depends(get_db),
-        current_user=Depends(get_current_user)):
+        identity: Identity = Depends(get_current_identity)):
 
-    if current_user["role"] != "Donor":
+    if identity.role != "Donor":
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Not authorized to update a donor location."
@@ -142,9 +147,9 @@ async def update_donor_location_me(
 
     location: Tuple[float, float] = tuple(req.location)
 
-    result = await db.execute(select(DonorModel).filter(DonorModel.name == current_user["company_name"]))
-    donor = result.scalar_one_or_none()
+    donor = await db.get(DonorModel, identity.entity_id) if identity.entity_id else None
     if donor is None:
+        identity_cache.invalidate(identity.role, identity.company_name)
         raise HTTPException(status_code=404, detail="Donor not found")
     donor.location = location
 
@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.dialects.postgresql import insert
 from db.database import get_db
 from db.models import RequirementModel
 from schemas.Requirement import Requirement
-from typing import List
+from schemas.FoodType import FoodType
+from AllocationSystem import AllocationSystem, get_allocation_system
+from utils.listing import ListParams, list_params, read_page, ndjson_export
+from typing import List, Optional
 from uuid import UUID
 from pydantic import BaseModel
 
@@ -15,11 +18,15 @@ class RequirementUpdate(BaseModel):
     quantity: int
 
 @router.post("/requirements", response_model=Requirement)
-async def create_requirement(requirement: Requirement, db: AsyncSession = Depends(get_db)):
+async def create_requirement(requirement: Requirement, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
+    try:
+        food_type = FoodType(requirement.food_type)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Unknown food type {requirement.food_type}")
     stmt = insert(RequirementModel).values(
         id=requirement.id,
         agency_id=requirement.agency_id,
-        food_type=requirement.food_type,
+        food_type=food_type,
         quantity=requirement.quantity
     )
     stmt = stmt.on_conflict_do_update(
@@ -27,12 +34,13 @@ async def create_requirement(requirement: Requirement, db: AsyncSession = Depend
         set_=dict(quantity=stmt.excluded.quantity)
     )
     await db.execute(stmt)
+    await allocation_system.publish_requirement(db, requirement.agency_id, food_type, requirement.quantity)
     await db.commit()
     
     # Fetch the upserted requirement
     result = await db.execute(
         select(RequirementModel)
-        .filter(RequirementModel.agency_id == requirement.agency_id, RequirementModel.food_type == requirement.food_type)
+        .filter(RequirementModel.agency_id == requirement.agency_id, RequirementModel.food_type == food_type)
     )
     db_requirement = result.scalar_one_or_none()
     if db_requirement is None:
@@ -40,9 +48,21 @@ async def create_requirement(requirement: Requirement, db: AsyncSession = Depend
     return Requirement.model_validate(db_requirement)
 
 @router.get("/requirements", response_model=List[Requirement])
-async def read_requirements(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(RequirementModel).offset(skip).limit(limit))
-    requirements = result.scalars().all()
+async def read_requirements(
+    response: Response,
+    agency_id: Optional[UUID] = None,
+    food_type: Optional[FoodType] = None,
+    params: ListParams = Depends(list_params),
+    db: AsyncSession = Depends(get_db)
+):
+    query = select(RequirementModel)
+    if agency_id is not None:
+        query = query.filter(RequirementModel.agency_id == agency_id)
+    if food_type is not None:
+        query = query.filter(RequirementModel.food_type == food_type)
+    if params.format == "ndjson":
+        return ndjson_export(query, RequirementModel, params)
+    requirements = await read_page(db, query, RequirementModel.id, params, response)
     return [Requirement.model_validate(requirement) for requirement in requirements]
 
 @router.get("/requirements/{requirement_id}", response_model=Requirement)
@@ -54,25 +74,27 @@ async def read_requirement(requirement_id: UUID, db: AsyncSession = Depends(get_
     return Requirement.model_validate(requirement)
 
 @router.put("/requirements/{requirement_id}", response_model=Requirement)
-async def update_requirement(requirement_id: UUID, requirement: RequirementUpdate, db: AsyncSession = Depends(get_db)):
+async def update_requirement(requirement_id: UUID, requirement: RequirementUpdate, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(RequirementModel).filter(RequirementModel.id == requirement_id))
     db_requirement = result.scalar_one_or_none()
     if db_requirement is None:
         raise HTTPException(status_code=404, detail="Requirement not found")
     
     db_requirement.quantity = requirement.quantity
-    
+    await allocation_system.publish_requirement(db, db_requirement.agency_id, db_requirement.food_type, requirement.quantity)
+
     await db.commit()
     await db.refresh(db_requirement)
     return Requirement.model_validate(db_requirement)
 
 @router.delete("/requirements/{requirement_id}", response_model=Requirement)
-async def delete_requirement(requirement_id: UUID, db: AsyncSession = Depends(get_db)):
+async def delete_requirement(requirement_id: UUID, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(RequirementModel).filter(RequirementModel.id == requirement_id))
     requirement = result.scalar_one_or_none()
     if requirement is None:
         raise HTTPException(status_code=404, detail="Requirement not found")
     await db.delete(requirement)
+    await allocation_system.publish_requirement(db, requirement.agency_id, requirement.food_type, None)
     await db.commit()
     return Requirement.model_validate(requirement)
 
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from db.database import get_db
@@ -8,6 +8,8 @@ from schemas.Donation import Donation
 from typing import List, Tuple
 from uuid import UUID
 from utils.jwt_auth import get_current_user
+from utils.listing import ListParams, list_params, read_page, ndjson_export
+from AllocationSystem import AllocationSystem, get_allocation_system
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -21,6 +23,7 @@ class VolunteerDeliveryUpdate(BaseModel):
 @router.post("/volunteers", response_model=Volunteer)
 async def create_volunteer(
         db: AsyncSession = Depends(get_db),
+        allocation_system: AllocationSystem = Depends(get_allocation_system),
         current_user=Depends(get_current_user)):
 
     if current_user["role"] != "Volunteer":
@@ -44,14 +47,19 @@ async def create_volunteer(
 
     db_volunteer = VolunteerModel(**volunteer.model_dump())
     db.add(db_volunteer)
+    await db.flush()
+    # Every worker's volunteer snapshot picks the change up once it commits
+    await allocation_system.publish_volunteer(db, db_volunteer.id, Volunteer.model_validate(db_volunteer))
     await db.commit()
     await db.refresh(db_volunteer)
     return Volunteer.model_validate(db_volunteer)
 
 @router.get("/volunteers", response_model=List[Volunteer])
-async def read_volunteers(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(VolunteerModel).offset(skip).limit(limit))
-    volunteers = result.scalars().all()
+async def read_volunteers(response: Response, params: ListParams = Depends(list_params), db: AsyncSession = Depends(get_db)):
+    query = select(VolunteerModel)
+    if params.format == "ndjson":
+        return ndjson_export(query, VolunteerModel, params)
+    volunteers = await read_page(db, query, VolunteerModel.id, params, response)
     return [Volunteer.model_validate(volunteer) for volunteer in volunteers]
 
 @router.get("/volunteers/{volunteer_id}", response_model=Volunteer)
@@ -63,7 +71,7 @@ async def read_volunteer(volunteer_id: UUID, db: AsyncSession = Depends(get_db))
     return Volunteer.model_validate(volunteer)
 
 @router.put("/volunteers/{volunteer_id}", response_model=Volunteer)
-async def update_volunteer(volunteer_id: UUID, volunteer: Volunteer, db: AsyncSession = Depends(get_db)):
+async def update_volunteer(volunteer_id: UUID, volunteer: Volunteer, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(VolunteerModel).filter(VolunteerModel.id == volunteer_id))
     db_volunteer = result.scalar_one_or_none()
     if db_volunteer is None:
@@ -72,50 +80,59 @@ async def update_volunteer(volunteer_id: UUID, volunteer: Volunteer, db: AsyncSe
     for key, value in volunteer.dict(exclude_unset=True).items():
         setattr(db_volunteer, key, value)
     
+    await db.flush()
+    await allocation_system.publish_volunteer(db, db_volunteer.id, Volunteer.model_validate(db_volunteer))
     await db.commit()
     await db.refresh(db_volunteer)
     return Volunteer.model_validate(db_volunteer)
 
 @router.delete("/volunteers/{volunteer_id}", response_model=Volunteer)
-async def delete_volunteer(volunteer_id: UUID, db: AsyncSession = Depends(get_db)):
+async def delete_volunteer(volunteer_id: UUID, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(VolunteerModel).filter(VolunteerModel.id == volunteer_id))
     volunteer = result.scalar_one_or_none()
     if volunteer is None:
         raise HTTPException(status_code=404, detail="Volunteer not found")
     await db.delete(volunteer)
+    await allocation_system.publish_volunteer(db, volunteer_id, None)
     await db.commit()
     return Volunteer.model_validate(volunteer)
 
 
 @router.patch("/volunteers/{volunteer_id}/location", response_model=Volunteer)
-async def update_volunteer_location(volunteer_id: UUID, location_update: VolunteerLocationUpdate, db: AsyncSession = Depends(get_db)):
+async def update_volunteer_location(volunteer_id: UUID, location_update: VolunteerLocationUpdate, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(VolunteerModel).filter(VolunteerModel.id == volunteer_id))
     volunteer = result.scalar_one_or_none()
     if volunteer is None:
         raise HTTPException(status_code=404, detail="Volunteer not found")
     volunteer.location = location_update.location
+    await db.flush()
+    await allocation_system.publish_volunteer(db, volunteer.id, Volunteer.model_validate(volunteer))
     await db.commit()
     await db.refresh(volunteer)
     return Volunteer.model_validate(volunteer)
 
 @router.patch("/volunteers/{volunteer_id}/capacity", response_model=Volunteer)
-async def update_volunteer_capacity(volunteer_id: UUID, capacity_update: VolunteerCapacityUpdate, db: AsyncSession = Depends(get_db)):
+async def update_volunteer_capacity(volunteer_id: UUID, capacity_update: VolunteerCapacityUpdate, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(VolunteerModel).filter(VolunteerModel.id == volunteer_id))
     volunteer = result.scalar_one_or_none()
     if volunteer is None:
         raise HTTPException(status_code=404, detail="Volunteer not found")
     volunteer.capacity = capacity_update.capacity
+    await db.flush()
+    await allocation_system.publish_volunteer(db, volunteer.id, Volunteer.model_validate(volunteer))
     await db.commit()
     await db.refresh(volunteer)
     return Volunteer.model_validate(volunteer)
 
 @router.patch("/volunteers/{volunteer_id}/delivery", response_model=Volunteer)
-async def update_volunteer_delivery(volunteer_id: UUID, delivery_update: VolunteerDeliveryUpdate, db: AsyncSession = Depends(get_db)):
+async def update_volunteer_delivery(volunteer_id: UUID, delivery_update: VolunteerDeliveryUpdate, db: AsyncSession = Depends(get_db), allocation_system: AllocationSystem = Depends(get_allocation_system)):
     result = await db.execute(select(VolunteerModel).filter(VolunteerModel.id == volunteer_id))
     volunteer = result.scalar_one_or_none()
     if volunteer is None:
         raise HTTPException(status_code=404, detail="Volunteer not found")
     volunteer.delivery = delivery_update.delivery
+    await db.flush()
+    await allocation_system.publish_volunteer(db, volunteer.id, Volunteer.model_validate(volunteer))
     await db.commit()
     await db.refresh(volunteer)
     return Volunteer.model_validate(volunteer)
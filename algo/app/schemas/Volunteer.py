@@ -11,3 +11,7 @@ class Volunteer(BaseModel):
     delivery: int = 0
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class VolunteerLocationUpdate(BaseModel):
+    location: Tuple[float, float]
@@ -0,0 +1,53 @@
+import numpy as np
+from typing import Optional, Sequence, Tuple
+from uuid import UUID
+
+EMPTY_ROWS = np.empty(0, dtype=np.int32)
+
+
+class AllocationQueue():
+    """
+    Allocation queue for one donation, held as a short window of ranked agency rows and a cursor.
+
+    Rows index the RankingEngine agency table, so advancing is a cursor increment and a pending donation
+    stores O(window) integers instead of every agency id. When the cursor runs off the window the owner
+    ranks the next window, excluding the rows already offered.
+    """
+
+    __slots__ = ("location", "food_type", "quantity", "window", "cursor", "offered", "exhausted", "donor_id")
+
+    def __init__(self, location: Tuple[float, float], food_type: str, quantity: int, window: np.ndarray, exhausted: bool,
+                 donor_id: Optional[UUID] = None):
+        self.location = location
+        self.food_type = food_type
+        self.quantity = quantity
+        self.window = window.astype(np.int32)
+        self.cursor = 0
+        self.offered = EMPTY_ROWS
+        self.exhausted = exhausted
+        # Kept so status events for the agency now offered the donation also reach its donor
+        self.donor_id = donor_id
+
+    def head(self) -> Optional[int]:
+        if self.cursor < len(self.window):
+            return int(self.window[self.cursor])
+        return None
+
+    def advance(self):
+        self.cursor += 1
+
+    def needs_extension(self) -> bool:
+        return self.cursor >= len(self.window) and not self.exhausted
+
+    def seen(self) -> np.ndarray:
+        """Rows already offered, or queued in the current window."""
+        return np.concatenate([self.offered, self.window])
+
+    def extend(self, window: Sequence[int], exhausted: bool):
+        self.offered = self.seen()
+        self.window = np.asarray(window, dtype=np.int32)
+        self.cursor = 0
+        self.exhausted = exhausted
+
+    def nbytes(self) -> int:
+        return self.window.nbytes + self.offered.nbytes
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncpg
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+Message = Dict[str, Any]
+Handler = Callable[[Message], None]
+Resync = Callable[[], Awaitable[None]]
+
+PENDING_KEY = "change_bus_pending"
+
+
+class LocalChangeBus():
+    """
+    Delivers change messages to the handlers of this process once the publishing transaction commits.
+
+    Messages published in a session that rolls back are dropped. Messages are JSON round-tripped before
+    delivery so handlers see the same types whether a change was made here or in another worker.
+    Enough on its own for a single worker and for tests.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, List[Handler]] = {}
+        self.resyncs: Dict[str, List[Resync]] = {}
+        self._metrics = {"published": 0, "delivered": 0, "handler_errors": 0, "resyncs": 0}
+
+    def subscribe(self, channel: str, handler: Handler, resync: Optional[Resync] = None):
+        """Register a handler for a channel; resync rebuilds the subscriber's state if messages may have been missed."""
+        self.handlers.setdefault(channel, []).append(handler)
+        if resync is not None:
+            self.resyncs.setdefault(channel, []).append(resync)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, db: AsyncSession, channel: str, message: Message):
+        """Publish message as part of db's current transaction."""
+        payload = json.dumps(message, default=str)
+        pending = db.info.get(PENDING_KEY)
+        if pending is None:
+            pending = db.info[PENDING_KEY] = []
+            event.listen(db.sync_session, "after_commit", self._after_commit)
+            event.listen(db.sync_session, "after_rollback", self._after_rollback)
+        pending.append((channel, payload))
+        self._metrics["published"] += 1
+
+    async def send(self, channel: str, message: Message):
+        """Publish message right away, outside any transaction; used for commands between workers."""
+        self._metrics["published"] += 1
+        self.deliver(channel, json.loads(json.dumps(message, default=str)))
+
+    def _after_commit(self, session):
+        pending = session.info.get(PENDING_KEY, [])
+        messages = list(pending)
+        pending.clear()
+        for channel, payload in messages:
+            self.deliver(channel, json.loads(payload))
+
+    def _after_rollback(self, session):
+        session.info.get(PENDING_KEY, []).clear()
+
+    def deliver(self, channel: str, message: Message):
+        for handler in self.handlers.get(channel, []):
+            try:
+                handler(message)
+                self._metrics["delivered"] += 1
+            except Exception as e:
+                self._metrics["handler_errors"] += 1
+                print(f"Error handling change on {channel}: {str(e)}")
+
+    async def resync(self):
+        for channel, resyncs in self.resyncs.items():
+            for resync in resyncs:
+                await resync()
+                self._metrics["resyncs"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "local", "channels": sorted(self.handlers), **self._metrics}
+
+
+class PostgresChangeBus(LocalChangeBus):
+    """
+    Change bus shared by every worker through Postgres LISTEN/NOTIFY.
+
+    publish issues pg_notify inside the caller's transaction, so other workers only hear about committed
+    changes and in commit order. The publishing worker also applies the change locally right after commit;
+    handlers must therefore be idempotent. If the listening connection drops, notifications sent meanwhile
+    are lost, so every subscriber resyncs from the database after reconnecting.
+    """
+
+    def __init__(self, dsn: str, reconnect_delay: float = 1.0):
+        super().__init__()
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self._connection: Optional[asyncpg.Connection] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._send_lock = asyncio.Lock()
+        self._metrics["reconnects"] = 0
+
+    async def start(self):
+        self._closing = False
+        await self._listen()
+
+    async def _listen(self):
+        self._connection = await asyncpg.connect(self.dsn)
+        self._connection.add_termination_listener(self._on_terminated)
+        for channel in self.handlers:
+            await self._connection.add_listener(channel, self._on_notify)
+
+    async def stop(self):
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+    async def publish(self, db: AsyncSession, channel: str, message: Message):
+        await db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": json.dumps(message, default=str)})
+        await super().publish(db, channel, message)
+
+    async def send(self, channel: str, message: Message):
+        # The listening connection also sends, one query at a time
+        async with self._send_lock:
+            await self._connection.execute("SELECT pg_notify($1, $2)", channel, json.dumps(message, default=str))
+        self._metrics["published"] += 1
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.deliver(channel, json.loads(payload))
+
+    def _on_terminated(self, connection):
+        if not self._closing and self._reconnect_task is None:
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closing:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                await self._listen()
+                self._metrics["reconnects"] += 1
+                await self.resync()
+                break
+            except Exception as e:
+                print(f"Change bus reconnect failed: {str(e)}")
+        self._reconnect_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        connected = self._connection is not None and not self._connection.is_closed()
+        return {**super().stats(), "backend": "postgres", "connected": connected}
+
+
+def asyncpg_dsn(database_url: str) -> str:
+    """Plain libpq DSN for asyncpg.connect from a SQLAlchemy URL."""
+    return make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def create_change_bus(database_url: str) -> LocalChangeBus:
+    """PostgresChangeBus when the database is Postgres, unless CHANGE_BUS=local (single worker, tests)."""
+    if os.getenv("CHANGE_BUS", "postgres") == "postgres" and make_url(database_url).get_backend_name() == "postgresql":
+        return PostgresChangeBus(asyncpg_dsn(database_url))
+    return LocalChangeBus()
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
+from uuid import UUID
+from fastapi import WebSocket, WebSocketDisconnect
+
+Event = Dict[str, Any]
+
+# Close code for a client that could not keep up; it should reconnect and resume from its last event id
+CLOSE_SLOW_CONSUMER = 1013
+CLOSE_HEARTBEAT_TIMEOUT = 1001
+
+
+def new_event_id() -> str:
+    """Ids increase over time across workers; sent as strings because they exceed JavaScript's safe integers."""
+    return str(time.time_ns())
+
+
+class AgencyConnection():
+    __slots__ = ("websocket", "queue", "closing")
+
+    def __init__(self, websocket: WebSocket, send_buffer: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(send_buffer)
+        self.closing = False
+
+
+class ConnectionManager():
+    """
+    Pushes allocation events to the WebSocket connections of each agency.
+
+    Every connection has a bounded send queue drained by its own task, so one slow socket never holds up
+    the others: when its queue is full the connection is closed with 1013 instead of buffering without
+    bound. The last `history` events per agency are kept so a client reconnecting with last_event_id gets
+    what it missed. Idle connections receive a ping every `heartbeat` seconds; a client that sends nothing
+    (a pong or anything else) for two heartbeats is disconnected.
+    """
+
+    def __init__(self, send_buffer: int = 64, history: int = 100, heartbeat: float = 20.0):
+        self.send_buffer = send_buffer
+        self.history_size = history
+        self.heartbeat = heartbeat
+        self.connections: Dict[UUID, Set[AgencyConnection]] = {}
+        self.history: Dict[UUID, Deque[Event]] = {}
+        self._metrics = {"accepted": 0, "sent": 0, "replayed": 0, "dropped_slow": 0, "heartbeat_timeouts": 0}
+
+    async def connect(self, websocket: WebSocket, agency_id: UUID, last_event_id: Optional[str] = None, subprotocol: Optional[str] = None):
+        """Serve one agency socket until it disconnects."""
+        await websocket.accept(subprotocol=subprotocol)
+        connection = AgencyConnection(websocket, self.send_buffer)
+        self.connections.setdefault(agency_id, set()).add(connection)
+        self._metrics["accepted"] += 1
+        # Registered before replaying, with no await in between, so no event falls between the two
+        if last_event_id is not None:
+            for event in self.history.get(agency_id, ()):
+                if int(event["id"]) > int(last_event_id):
+                    self._enqueue(connection, event)
+                    self._metrics["replayed"] += 1
+        sender = asyncio.create_task(self._send_loop(connection))
+        try:
+            await self._receive_loop(connection)
+        finally:
+            sender.cancel()
+            connections = self.connections.get(agency_id)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self.connections[agency_id]
+
+    def dispatch(self, event: Event):
+        """Record an event and queue it on every socket of its agency."""
+        agency_id = UUID(event["agency_id"])
+        history = self.history.get(agency_id)
+        if history is None:
+            history = self.history[agency_id] = deque(maxlen=self.history_size)
+        history.append(event)
+        for connection in self.connections.get(agency_id, ()):
+            self._enqueue(connection, event)
+
+    def _enqueue(self, connection: AgencyConnection, event: Event):
+        if connection.closing:
+            return
+        try:
+            connection.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            connection.closing = True
+            self._metrics["dropped_slow"] += 1
+            asyncio.create_task(self._close(connection, CLOSE_SLOW_CONSUMER))
+
+    async def _close(self, connection: AgencyConnection, code: int):
+        try:
+            await connection.websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _send_loop(self, connection: AgencyConnection):
+        while True:
+            try:
+                event = await asyncio.wait_for(connection.queue.get(), self.heartbeat)
+            except asyncio.TimeoutError:
+                event = {"type": "ping"}
+            try:
+                await connection.websocket.send_json(event)
+            except Exception:
+                return
+            self._metrics["sent"] += 1
+
+    async def _receive_loop(self, connection: AgencyConnection):
+        while not connection.closing:
+            try:
+                await asyncio.wait_for(connection.websocket.receive_text(), 2 * self.heartbeat)
+            except asyncio.TimeoutError:
+                self._metrics["heartbeat_timeouts"] += 1
+                connection.closing = True
+                await self._close(connection, CLOSE_HEARTBEAT_TIMEOUT)
+                return
+            except (WebSocketDisconnect, RuntimeError):
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "agencies_connected": len(self.connections),
+            "connections": sum(len(connections) for connections in self.connections.values()),
+            "queued": sum(connection.queue.qsize() for connections in self.connections.values() for connection in connections),
+            **self._metrics,
+        }
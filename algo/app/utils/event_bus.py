@@ -0,0 +1,88 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+Event = Dict[str, Any]
+
+
+class Subscription():
+    """
+    One stream's view of the bus: the latest undelivered event per donation.
+
+    While the client is slow, a newer status for a donation replaces the older one still waiting, so the
+    backlog never exceeds one event per donation. An idle subscription holds no buffer and no future.
+    """
+    __slots__ = ("keys", "pending", "_waiter")
+
+    def __init__(self, keys: List[str]):
+        self.keys = keys
+        self.pending: Optional[Dict[str, Event]] = None
+        self._waiter: Optional[asyncio.Future] = None
+
+    def push(self, event: Event):
+        if self.pending is None:
+            self.pending = {}
+        # Re-inserted so the donation moves to the back, after transitions of other donations that came earlier
+        self.pending.pop(event["donation_id"], None)
+        self.pending[event["donation_id"]] = event
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def get(self, timeout: float) -> List[Event]:
+        """Pending events, waiting up to timeout for one; an empty list means the timeout passed."""
+        if not self.pending:
+            self._waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiter = None
+        events = list(self.pending.values()) if self.pending else []
+        self.pending = None
+        return events
+
+
+class DonationEventBus():
+    """
+    In-process fan-out of donation status changes to the streams watching them.
+
+    Events are published under the donation's donor and agency ids, and a subscription listens on the ids
+    of its caller. Publishing never blocks: it only touches the subscriptions' pending events.
+    """
+
+    def __init__(self):
+        self.subscribers: Dict[str, Set[Subscription]] = {}
+        self._metrics = {"published": 0, "delivered": 0, "coalesced": 0}
+
+    def subscribe(self, *keys) -> Subscription:
+        subscription = Subscription([str(key) for key in keys])
+        for key in subscription.keys:
+            self.subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        for key in subscription.keys:
+            subscribers = self.subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[key]
+
+    def publish(self, event: Event):
+        self._metrics["published"] += 1
+        delivered = set()
+        for key in (event.get("donor_id"), event.get("agency_id")):
+            for subscription in self.subscribers.get(key, ()) if key is not None else ():
+                if subscription in delivered:
+                    continue
+                delivered.add(subscription)
+                if subscription.pending and event["donation_id"] in subscription.pending:
+                    self._metrics["coalesced"] += 1
+                subscription.push(event)
+                self._metrics["delivered"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams": len({subscription for subscribers in self.subscribers.values() for subscription in subscribers}),
+            **self._metrics,
+        }
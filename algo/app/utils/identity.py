@@ -0,0 +1,51 @@
+import jwt
+from typing import Dict, NamedTuple, Optional
+from uuid import UUID
+from fastapi import Depends
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from db.database import AsyncSessionLocal, get_db
+from db.models import AgencyModel, DonorModel
+from utils.identity_cache import identity_cache
+from utils.jwt_auth import get_current_user, verify_token
+
+# The row a token's company_name stands for, by role
+ROLE_MODELS = {"Beneficiary": AgencyModel, "Donor": DonorModel}
+
+
+class Identity(NamedTuple):
+    role: str
+    company_name: str
+    # Agency id for a Beneficiary, donor id for a Donor; None when no such row exists or the role has none
+    entity_id: Optional[UUID]
+
+
+async def get_current_identity(current_user=Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> Identity:
+    """Map the token's company to its agency or donor id, querying only on a cache miss."""
+    return await resolve_identity(current_user, db)
+
+
+async def identity_for_token(token: Optional[str]) -> Optional[Identity]:
+    """Identity of a raw access token, for WebSocket handlers that can not use the HTTP dependencies; None if invalid."""
+    if not token:
+        return None
+    try:
+        current_user = verify_token(token)
+    except jwt.InvalidTokenError:
+        return None
+    async with AsyncSessionLocal() as db:
+        return await resolve_identity(current_user, db)
+
+
+async def resolve_identity(current_user: Dict, db: AsyncSession) -> Identity:
+    role, company_name = current_user["role"], current_user["company_name"]
+    model = ROLE_MODELS.get(role)
+    if model is None:
+        return Identity(role, company_name, None)
+    entity_id = identity_cache.get((role, company_name))
+    if entity_id is None:
+        result = await db.execute(select(model.id).filter(model.name == company_name).limit(1))
+        entity_id = result.scalar_one_or_none()
+        if entity_id is not None:
+            identity_cache.put((role, company_name), entity_id)
+    return Identity(role, company_name, entity_id)
@@ -0,0 +1,75 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+from uuid import UUID
+
+Key = Tuple[str, str]
+
+
+class IdentityCache():
+    """
+    LRU cache of (role, company_name) -> agency or donor id, each entry expiring after ttl seconds.
+
+    Only found ids are cached. Renames and deletions of agencies and donors are published on the change bus,
+    and every worker invalidates the entries of that id; `clear` drops everything after the bus may have
+    missed some.
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[Key, Tuple[UUID, float]]" = OrderedDict()
+        self.keys_by_id: Dict[UUID, Set[Key]] = {}
+        self._metrics = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key: Key) -> Optional[UUID]:
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self._metrics["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self._metrics["hits"] += 1
+        return entry[0]
+
+    def put(self, key: Key, entity_id: UUID):
+        self._remove(key)
+        self.entries[key] = (entity_id, time.monotonic() + self.ttl)
+        self.keys_by_id.setdefault(entity_id, set()).add(key)
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+            self._metrics["evictions"] += 1
+
+    def invalidate(self, role: str, company_name: str):
+        self._remove((role, company_name))
+        self._metrics["invalidations"] += 1
+
+    def invalidate_id(self, entity_id: UUID):
+        for key in list(self.keys_by_id.get(entity_id, ())):
+            self._remove(key)
+        self._metrics["invalidations"] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_id.clear()
+
+    def _remove(self, key: Key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self.keys_by_id.get(entry[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_id[entry[0]]
+
+    def stats(self) -> Dict:
+        return {"size": len(self.entries), "max_size": self.max_size, "ttl": self.ttl, **self._metrics}
+
+
+identity_cache = IdentityCache(
+    max_size=int(os.getenv("IDENTITY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "300"))
+)
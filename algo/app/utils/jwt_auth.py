@@ -1,18 +1,82 @@
 import base64
+import hashlib
 import jwt
 import os
+import time
 
-from typing import Annotated
+from collections import OrderedDict
+from typing import Annotated, Dict, Tuple
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
+from jwt.algorithms import RSAAlgorithm
 
 
 ALGORITHM = "RS256"
 JWT_PUBLIC_KEY = base64.b64decode(os.getenv("JWT_PUBLIC_KEY")).decode('utf-8')
+# Parsed once; decoding with the PEM string would re-parse it on every request
+JWT_VERIFY_KEY = RSAAlgorithm(RSAAlgorithm.SHA256).prepare_key(JWT_PUBLIC_KEY)
+
+# Verified tokens kept, and the longest any is trusted without re-verifying (it never outlives its exp)
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("JWT_CACHE_TTL_SECONDS", "300"))
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
+class TokenCache():
+    """LRU cache of token SHA-256 digest -> (verified payload, time after which it must be verified again)."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[bytes, Tuple[Dict, float]]" = OrderedDict()
+
+    def get(self, key: bytes):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: bytes, payload: Dict):
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if "exp" in payload:
+            expires_at = min(expires_at, payload["exp"])
+        self.entries[key] = (payload, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL_SECONDS)
+
+
+def verify_token(token: str) -> Dict:
+    """
+    Decode and verify a token, skipping the RSA check for one verified before that has not yet expired.
+
+    Raises jwt.ExpiredSignatureError or jwt.InvalidTokenError like jwt.decode.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, JWT_VERIFY_KEY, algorithms=[ALGORITHM])
+        # Refresh tokens are only accepted by the auth service's /refresh and /logout
+        if payload.get("typ") == "refresh":
+            raise jwt.InvalidTokenError("Refresh tokens can not be used to authenticate requests")
+        token_cache.put(key, payload)
+    # Handlers get their own copy, so none can alter what later requests see
+    return dict(payload)
+
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     """
     Retrieve the current user from the JWT token.
@@ -24,10 +88,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     )
 
     try:
-        payload = jwt.decode(token, JWT_PUBLIC_KEY,
-                             algorithms=[ALGORITHM])
-        print(payload)
-        return payload
+        return verify_token(token)
 
     except jwt.ExpiredSignatureError:
         raise HTTPException(
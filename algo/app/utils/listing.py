@@ -0,0 +1,78 @@
+import json
+import os
+from datetime import datetime
+from typing import Any, List, Literal, Optional
+from uuid import UUID
+from fastapi import Query, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+from db.database import AsyncSessionLocal
+
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip from the server-side cursor of an NDJSON export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class ListParams(BaseModel):
+    after: Optional[UUID]
+    skip: int
+    limit: int
+    format: Literal["json", "ndjson"]
+
+
+def list_params(
+    after: Optional[UUID] = Query(None, description=f"Return rows after this id; pass the previous page's {NEXT_CURSOR_HEADER} header"),
+    skip: int = Query(0, ge=0, deprecated=True, description="OFFSET paging, slow on deep pages; use after instead"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    format: Literal["json", "ndjson"] = Query("json", description="ndjson streams every matching row, ignoring limit"),
+) -> ListParams:
+    return ListParams(after=after, skip=skip, limit=limit, format=format)
+
+
+def _keyset(query: Select, id_column, after: Optional[UUID]) -> Select:
+    if after is not None:
+        query = query.filter(id_column > after)
+    return query.order_by(id_column)
+
+
+async def read_page(db: AsyncSession, query: Select, id_column, params: ListParams, response: Response) -> List[Any]:
+    """
+    One page of query in id order, resuming after params.after. When the page is full, the id to resume
+    from is returned in the X-Next-Cursor header.
+    """
+    query = _keyset(query, id_column, params.after)
+    if params.skip:
+        query = query.offset(params.skip)
+    result = await db.execute(query.limit(params.limit))
+    rows = result.scalars().all()
+    if len(rows) == params.limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(getattr(rows[-1], id_column.key))
+    return rows
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def ndjson_export(query: Select, model, params: ListParams) -> StreamingResponse:
+    """
+    Stream every row of query as one JSON object per line, in id order from params.after.
+
+    Rows are read through a server-side cursor EXPORT_BATCH_SIZE at a time and serialised straight from
+    the columns, without ORM objects or Pydantic validation. The export runs in its own session because
+    request-scoped sessions are closed before a streamed body is sent.
+    """
+    query = _keyset(query.with_only_columns(*model.__table__.columns), model.__table__.c.id, params.after)
+
+    async def lines():
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+            async for rows in result.mappings().partitions():
+                yield "".join(json.dumps(dict(row), default=_json_default) + "\n" for row in rows)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,213 @@
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+from geopy.distance import geodesic
+from schemas.Agency import Agency
+
+# Mean earth radius in km, closest spherical fit to the WGS-84 ellipsoid used by geodesic.
+EARTH_RADIUS_KM = 6371.0088
+# Larger than any distance on earth in km, so a priority agency always sorts before a closer non-priority one.
+PRIORITY_WEIGHT = 1e6
+# Upper bound on donation x agency distance cells computed at once by rank_batch.
+BATCH_CELLS = 4_000_000
+
+
+def food_type_key(food_type) -> str:
+    """Normalise a FoodType enum member or raw string to its stored value."""
+    return getattr(food_type, "value", food_type)
+
+
+def haversine_km(lat: np.ndarray, lon: np.ndarray, point_lat: float, point_lon: float) -> np.ndarray:
+    """Great-circle distance in km from one point to arrays of points, all in radians."""
+    dlat = lat - point_lat
+    dlon = lon - point_lon
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat) * np.cos(point_lat) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class RankingEngine():
+    """
+    Column store of agencies used to rank every agency against a donation in one batched pass.
+
+    Each agency owns a stable row: coordinates, priority flag and requirement quantities per food type
+    live in NumPy arrays indexed by that row, so ranking is a handful of vector operations instead of a
+    geodesic call per agency. Rows of removed agencies are tombstoned rather than reused.
+    """
+
+    def __init__(self, refine_top_k: int = 0, capacity: int = 1024):
+        self.refine_top_k = refine_top_k
+        self.ids: List[UUID] = []
+        self.row_of: Dict[UUID, int] = {}
+        self.food_columns: Dict[str, int] = {}
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self._location = np.zeros((capacity, 2))
+        self._priority = np.zeros(capacity, dtype=np.int8)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._needs = np.zeros((capacity, 0), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.row_of)
+
+    def _grow(self, size: int):
+        capacity = len(self._lat)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2)
+        pad = new_capacity - capacity
+        self._lat = np.concatenate([self._lat, np.zeros(pad)])
+        self._lon = np.concatenate([self._lon, np.zeros(pad)])
+        self._location = np.concatenate([self._location, np.zeros((pad, 2))])
+        self._priority = np.concatenate([self._priority, np.zeros(pad, dtype=np.int8)])
+        self._alive = np.concatenate([self._alive, np.zeros(pad, dtype=bool)])
+        self._needs = np.concatenate([self._needs, np.zeros((pad, self._needs.shape[1]), dtype=np.int64)])
+
+    def _food_column(self, food_type) -> int:
+        key = food_type_key(food_type)
+        column = self.food_columns.get(key)
+        if column is None:
+            column = len(self.food_columns)
+            self.food_columns[key] = column
+            self._needs = np.concatenate([self._needs, np.zeros((len(self._needs), 1), dtype=np.int64)], axis=1)
+        return column
+
+    def upsert_agency(self, agency: Agency, requirements: Optional[Dict] = None) -> int:
+        """Insert or refresh an agency row and return its index."""
+        row = self.row_of.get(agency.id)
+        if row is None:
+            row = len(self.ids)
+            self._grow(row + 1)
+            self.ids.append(agency.id)
+            self.row_of[agency.id] = row
+        self.set_location(agency.id, agency.location)
+        self._priority[row] = 1 if agency.priority_flag else 0
+        self._alive[row] = True
+        if requirements is not None:
+            self.set_requirements(agency.id, requirements)
+        return row
+
+    def remove_agency(self, agency_id: UUID):
+        row = self.row_of.pop(agency_id, None)
+        if row is not None:
+            self._alive[row] = False
+
+    def set_location(self, agency_id: UUID, location: Sequence[float]):
+        row = self.row_of[agency_id]
+        self._location[row] = location
+        self._lat[row] = np.radians(location[0])
+        self._lon[row] = np.radians(location[1])
+
+    def set_priority(self, agency_id: UUID, priority_flag: bool):
+        self._priority[self.row_of[agency_id]] = 1 if priority_flag else 0
+
+    def set_requirements(self, agency_id: UUID, requirements: Dict):
+        """Replace every requirement quantity of an agency."""
+        row = self.row_of.get(agency_id)
+        if row is not None:
+            self._needs[row, :] = 0
+            for food_type, quantity in requirements.items():
+                column = self._food_column(food_type)
+                self._needs[row, column] = quantity
+
+    def set_requirement(self, agency_id: UUID, food_type, quantity: int):
+        row = self.row_of.get(agency_id)
+        if row is not None:
+            column = self._food_column(food_type)
+            self._needs[row, column] = quantity
+
+    def is_alive(self, row: int) -> bool:
+        return bool(self._alive[row])
+
+    def rows_for(self, agency_ids: Iterable[UUID]) -> np.ndarray:
+        return np.fromiter((self.row_of[agency_id] for agency_id in agency_ids if agency_id in self.row_of), dtype=np.int64)
+
+    def live_rows(self) -> np.ndarray:
+        return np.flatnonzero(self._alive[:len(self.ids)])
+
+    def agency_ids(self, rows: Iterable[int]) -> List[UUID]:
+        return [self.ids[row] for row in rows]
+
+    def sort_keys(self, location: Sequence[float], food_type, quantity: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Compute (priority, distance km, needs score) for the given rows against a donation."""
+        distance = haversine_km(self._lat[rows], self._lon[rows], np.radians(location[0]), np.radians(location[1]))
+        column = self.food_columns.get(food_type_key(food_type))
+        if column is None:
+            needs = np.zeros(len(rows), dtype=np.int64)
+        else:
+            needs = np.minimum(self._needs[rows, column], quantity)
+        return self._priority[rows], distance, needs
+
+    def rank(self, location: Sequence[float], food_type, quantity: int, rows: Optional[np.ndarray] = None, k: Optional[int] = None) -> np.ndarray:
+        """
+        Return rows ordered by (-priority_flag, distance, -needs_score), the allocation order.
+
+        With k set, only the first k rows are returned and only rows that can reach the top k are sorted.
+        Distances use haversine; when refine_top_k is set the leading rows are re-sorted on exact geodesic distance.
+        """
+        if rows is None:
+            rows = self.live_rows()
+        priority, distance, needs = self.sort_keys(location, food_type, quantity, rows)
+        if k is not None and k < len(rows):
+            # Priority and distance fold into one key, distances never reach PRIORITY_WEIGHT km.
+            # Everything tied with the k-th key is kept so needs_score can still break the tie.
+            primary = distance - priority * PRIORITY_WEIGHT
+            threshold = np.partition(primary, k - 1)[k - 1]
+            selected = np.flatnonzero(primary <= threshold)
+            rows, priority, distance, needs = rows[selected], priority[selected], distance[selected], needs[selected]
+        return self._order(location, rows, priority, distance, needs, k)
+
+    def rank_batch(self, locations: Sequence[Sequence[float]], food_types: Sequence, quantities: Sequence[int], rows: Optional[np.ndarray] = None,
+                   k: Optional[int] = None, max_distance_km: Optional[float] = None) -> List[np.ndarray]:
+        """
+        Rank the same rows for many donations at once; element i matches rank() for donation i.
+
+        Distances for a block of donations are computed as one matrix, and with k set the top-k threshold of
+        every donation comes from a single partition along the agency axis. max_distance_km drops far agencies.
+        """
+        if rows is None:
+            rows = self.live_rows()
+        locations = np.radians(np.asarray(locations, dtype=float).reshape(-1, 2))
+        lat, lon, priority = self._lat[rows], self._lon[rows], self._priority[rows]
+        needs_by_food = {}
+        ranked = []
+        block = max(1, BATCH_CELLS // max(1, len(rows)))
+        for start in range(0, len(locations), block):
+            points = locations[start:start + block]
+            distance = haversine_km(lat[None, :], lon[None, :], points[:, :1], points[:, 1:])
+            primary = distance - priority * PRIORITY_WEIGHT
+            if max_distance_km is not None:
+                primary[distance > max_distance_km] = np.inf
+            thresholds = np.full(len(points), np.inf)
+            if k is not None and k < len(rows):
+                thresholds = np.partition(primary, k - 1, axis=1)[:, k - 1]
+            for offset in range(len(points)):
+                i = start + offset
+                key = food_type_key(food_types[i])
+                if key not in needs_by_food:
+                    column = self.food_columns.get(key)
+                    needs_by_food[key] = np.zeros(len(rows), dtype=np.int64) if column is None else self._needs[rows, column]
+                selected = np.flatnonzero((primary[offset] <= thresholds[offset]) & np.isfinite(primary[offset]))
+                ranked.append(self._order(
+                    np.degrees(points[offset]),
+                    rows[selected],
+                    priority[selected],
+                    distance[offset, selected],
+                    np.minimum(needs_by_food[key][selected], quantities[i]),
+                    k
+                ))
+        return ranked
+
+    def _order(self, location: Sequence[float], rows: np.ndarray, priority: np.ndarray, distance: np.ndarray, needs: np.ndarray, k: Optional[int]) -> np.ndarray:
+        order = np.lexsort((-needs, distance, -priority.astype(np.int64)))[:k]
+        ranked = rows[order]
+        if self.refine_top_k:
+            ranked = self._refine(ranked, priority[order], needs[order], location)
+        return ranked
+
+    def _refine(self, ranked: np.ndarray, priority: np.ndarray, needs: np.ndarray, location: Sequence[float]) -> np.ndarray:
+        k = min(self.refine_top_k, len(ranked))
+        exact = np.array([geodesic(tuple(self._location[row]), tuple(location)).km for row in ranked[:k]])
+        order = np.lexsort((-needs[:k], exact, -priority[:k].astype(np.int64)))
+        ranked = ranked.copy()
+        ranked[:k] = ranked[:k][order]
+        return ranked
@@ -0,0 +1,52 @@
+from typing import Any, Dict, Iterable
+from uuid import UUID
+from schemas.Requirement import Requirement
+from utils.ranking import food_type_key
+
+
+class RequirementCache():
+    """
+    Requirement quantity per agency and food type, kept in memory so ranking never queries requirements.
+
+    Every applied change bumps `version`, and `agency_versions` records the version at which each agency
+    last changed, so callers can tell whether what they ranked on is still current.
+    """
+
+    def __init__(self):
+        self.requirements: Dict[UUID, Dict[str, int]] = {}
+        self.agency_versions: Dict[UUID, int] = {}
+        self.version = 0
+
+    def __len__(self) -> int:
+        return sum(len(needs) for needs in self.requirements.values())
+
+    def get(self, agency_id: UUID) -> Dict[str, int]:
+        return self.requirements.get(agency_id, {})
+
+    def replace(self, requirements: Iterable[Requirement]):
+        """Reset the cache to exactly the given requirements, e.g. a full reload from the database."""
+        self.version += 1
+        self.requirements = {}
+        self.agency_versions = {}
+        for requirement in requirements:
+            self.requirements.setdefault(requirement.agency_id, {})[food_type_key(requirement.food_type)] = requirement.quantity
+            self.agency_versions[requirement.agency_id] = self.version
+
+    def set(self, agency_id: UUID, food_type, quantity: int) -> int:
+        self.version += 1
+        self.requirements.setdefault(agency_id, {})[food_type_key(food_type)] = quantity
+        self.agency_versions[agency_id] = self.version
+        return self.version
+
+    def discard(self, agency_id: UUID, food_type) -> int:
+        self.version += 1
+        needs = self.requirements.get(agency_id)
+        if needs is not None:
+            needs.pop(food_type_key(food_type), None)
+            if not needs:
+                del self.requirements[agency_id]
+        self.agency_versions[agency_id] = self.version
+        return self.version
+
+    def stats(self) -> Dict[str, Any]:
+        return {"version": self.version, "agencies": len(self.requirements), "requirements": len(self)}
@@ -0,0 +1,119 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+
+class AllocationScheduler():
+    """
+    One task driving every allocation deadline.
+
+    Deadlines sit in a min-heap; the task sleeps until the earliest one (or until an earlier deadline is
+    scheduled), then hands every expired donation to `on_expired` in batches. Rescheduling or cancelling
+    a donation leaves its old heap entry behind, which is skipped when popped.
+    """
+
+    def __init__(self, on_expired: Callable[[List[UUID]], Awaitable[None]], batch_size: int = 500, rate_window: float = 60.0):
+        self.on_expired = on_expired
+        self.batch_size = batch_size
+        self.rate_window = rate_window
+        self._heap: List[Tuple[datetime, int, UUID]] = []
+        self._deadlines: Dict[UUID, datetime] = {}
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._advances = deque()
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._total_advances = 0
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def schedule(self, donation_id: UUID, deadline: datetime):
+        earliest = self._heap[0][0] if self._heap else None
+        self._deadlines[donation_id] = deadline
+        heapq.heappush(self._heap, (deadline, next(self._sequence), donation_id))
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._compact()
+        if earliest is None or deadline < earliest:
+            self._wakeup.set()
+
+    def cancel(self, donation_id: UUID):
+        self._deadlines.pop(donation_id, None)
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._deadlines.get(entry[2]) == entry[0]]
+        heapq.heapify(self._heap)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _pop_due(self, now: datetime) -> List[UUID]:
+        due = []
+        while self._heap and len(due) < self.batch_size:
+            deadline, _, donation_id = self._heap[0]
+            if self._deadlines.get(donation_id) != deadline:
+                heapq.heappop(self._heap)
+                continue
+            if deadline > now:
+                break
+            heapq.heappop(self._heap)
+            del self._deadlines[donation_id]
+            due.append(donation_id)
+            self._last_lag = (now - deadline).total_seconds()
+            self._max_lag = max(self._max_lag, self._last_lag)
+        return due
+
+    async def _run(self):
+        while True:
+            due = self._pop_due(datetime.now())
+            if due:
+                try:
+                    await self.on_expired(due)
+                except Exception as e:
+                    print(f"Error advancing expired allocations: {str(e)}")
+                self._record_advances(len(due))
+                continue
+
+            timeout = (self._heap[0][0] - datetime.now()).total_seconds() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _record_advances(self, count: int):
+        now = time.monotonic()
+        self._advances.append((now, count))
+        self._total_advances += count
+        while self._advances and self._advances[0][0] < now - self.rate_window:
+            self._advances.popleft()
+
+    def stats(self) -> Dict[str, float]:
+        now = time.monotonic()
+        recent = sum(count for at, count in self._advances if at >= now - self.rate_window)
+        next_deadline = self._heap[0][0] if self._heap else None
+        return {
+            "pending_timers": len(self._deadlines),
+            "heap_entries": len(self._heap),
+            "lag_seconds": self._last_lag,
+            "max_lag_seconds": self._max_lag,
+            "advances_per_second": recent / self.rate_window,
+            "total_advances": self._total_advances,
+            "next_deadline": next_deadline.isoformat() if next_deadline else None,
+        }
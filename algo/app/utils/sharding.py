@@ -0,0 +1,141 @@
+import asyncio
+import math
+import random
+from typing import Awaitable, Callable, Dict, Optional, Set
+from uuid import UUID, uuid4
+import asyncpg
+
+# First key of the two-key advisory locks used for shard leases; the second key is the shard number
+SHARD_LOCK_CLASS = 804_117
+# First key of the lock each live worker holds to be counted; the second key is random per worker
+MEMBER_LOCK_CLASS = 804_118
+# Sweeps in a row a shard must be found free before a worker already at its target takes it anyway
+ORPHAN_SWEEPS = 3
+
+
+def shard_of(donation_id: UUID, shards: int) -> int:
+    return donation_id.int % shards
+
+
+class ShardLeases():
+    """
+    Ownership of allocation shards, held as Postgres session-level advisory locks.
+
+    Each worker keeps one connection that holds the lock of every shard it owns, so a crashed worker's
+    shards are released with its connection. A worker takes free shards up to `target`; a shard found
+    free on ORPHAN_SWEEPS sweeps in a row has no owner at all and is taken regardless, which is how the
+    shards of a dead worker fail over.
+
+    The same connection holds a member lock, and every sweep sets `target` from the number of member locks
+    held, so the target follows the workers actually alive. A worker above target, typically a survivor
+    that took a dead worker's shards, releases the excess after `on_released` has handed them off; a
+    restarted worker then takes them on its next sweep.
+    """
+
+    def __init__(self, dsn: str, shards: int, on_acquired: Callable[[Set[int]], Awaitable[None]],
+                 on_lost: Callable[[Set[int]], None], on_released: Callable[[Set[int]], Awaitable[None]],
+                 interval: float = 5.0):
+        self.dsn = dsn
+        self.shards = shards
+        # Set from the live worker count on every sweep
+        self.target = shards
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+        self.on_released = on_released
+        self.interval = interval
+        self.owned: Set[int] = set()
+        self._free_sweeps: Dict[int, int] = {}
+        self._connection: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self.members = 0
+
+    def owns(self, donation_id: UUID) -> bool:
+        return shard_of(donation_id, self.shards) in self.owned
+
+    def new_donation_id(self) -> UUID:
+        """A random id in a shard owned here, so the donation is allocated without routing."""
+        if not self.owned:
+            return uuid4()
+        while True:
+            donation_id = uuid4()
+            if self.owns(donation_id):
+                return donation_id
+
+    async def start(self):
+        """Take the first shards before returning, then keep sweeping in the background."""
+        await self._sweep()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+        self.owned = set()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._sweep()
+            except Exception as e:
+                print(f"Shard lease sweep failed: {str(e)}")
+
+    async def _sweep(self):
+        if self._connection is None or self._connection.is_closed():
+            if self.owned:
+                # Locks die with their connection, so another worker may own these shards by now
+                lost, self.owned = self.owned, set()
+                self.on_lost(lost)
+            self._connection = await asyncpg.connect(self.dsn)
+            while not await self._connection.fetchval("SELECT pg_try_advisory_lock($1, $2)", MEMBER_LOCK_CLASS, random.randint(0, 2**31 - 1)):
+                pass
+
+        self.members = await self._connection.fetchval(
+            "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND granted AND classid = $1 AND objsubid = 2"
+            " AND database = (SELECT oid FROM pg_database WHERE datname = current_database())",
+            MEMBER_LOCK_CLASS
+        )
+        self.target = shard_target(self.shards, self.members)
+        if len(self.owned) > self.target:
+            await self._release(set(sorted(self.owned)[self.target:]))
+
+        acquired, free_sweeps = set(), {}
+        for shard in range(self.shards):
+            if shard in self.owned:
+                continue
+            if not await self._connection.fetchval("SELECT pg_try_advisory_lock($1, $2)", SHARD_LOCK_CLASS, shard):
+                continue
+            if len(self.owned) + len(acquired) < self.target or self._free_sweeps.get(shard, 0) + 1 >= ORPHAN_SWEEPS:
+                acquired.add(shard)
+            else:
+                free_sweeps[shard] = self._free_sweeps.get(shard, 0) + 1
+                await self._connection.fetchval("SELECT pg_advisory_unlock($1, $2)", SHARD_LOCK_CLASS, shard)
+        self._free_sweeps = free_sweeps
+        if acquired:
+            self.owned |= acquired
+            print(f"Acquired allocation shards {sorted(acquired)}")
+            await self.on_acquired(acquired)
+
+    async def _release(self, shards: Set[int]):
+        """Stop owning shards, let on_released hand off their state, then unlock them for other workers."""
+        self.owned -= shards
+        try:
+            await self.on_released(shards)
+        finally:
+            for shard in shards:
+                await self._connection.fetchval("SELECT pg_advisory_unlock($1, $2)", SHARD_LOCK_CLASS, shard)
+        print(f"Released allocation shards {sorted(shards)} to rebalance over {self.members} workers")
+
+    def stats(self) -> Dict:
+        return {"shards": self.shards, "target": self.target, "members": self.members, "owned": sorted(self.owned)}
+
+
+def shard_target(shards: int, workers: int) -> int:
+    return math.ceil(shards / max(1, workers))
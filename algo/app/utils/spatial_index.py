@@ -0,0 +1,149 @@
+import math
+from typing import Callable, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+from geopy.distance import geodesic
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+# Haversine and geodesic disagree by at most ~0.5%; candidates within this slack are re-checked exactly.
+GEODESIC_SLACK = 1.01
+
+Cell = Tuple[int, int]
+
+
+def haversine(a: Sequence[float], b: Sequence[float]) -> float:
+    """Great-circle distance in km between two (lat, long) points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, h)))
+
+
+class SpatialIndex():
+    """
+    Grid index over lat/long, bucketing keys into fixed-size degree cells (a geohash without the string encoding).
+
+    Nearest-neighbour queries search rings of cells outwards from the query point and stop once no unseen
+    cell can hold anything closer; radius queries only visit cells overlapping the bounding box.
+    """
+
+    def __init__(self, cell_degrees: float = 0.25):
+        self.cell_degrees = cell_degrees
+        self.lat_cells = math.ceil(180 / cell_degrees)
+        self.lon_cells = math.ceil(360 / cell_degrees)
+        self.buckets: Dict[Cell, Set[Hashable]] = {}
+        self.locations: Dict[Hashable, Tuple[float, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.locations
+
+    def _cell(self, location: Sequence[float]) -> Cell:
+        lat_index = min(int((location[0] + 90) // self.cell_degrees), self.lat_cells - 1)
+        lon_index = int(((location[1] + 180) % 360) // self.cell_degrees)
+        return lat_index, lon_index
+
+    def insert(self, key: Hashable, location: Sequence[float]):
+        self.remove(key)
+        location = (float(location[0]), float(location[1]))
+        self.locations[key] = location
+        self.buckets.setdefault(self._cell(location), set()).add(key)
+
+    def remove(self, key: Hashable):
+        location = self.locations.pop(key, None)
+        if location is None:
+            return
+        cell = self._cell(location)
+        bucket = self.buckets[cell]
+        bucket.discard(key)
+        if not bucket:
+            del self.buckets[cell]
+
+    def _ring(self, center: Cell, radius: int) -> List[Cell]:
+        lat_index, lon_index = center
+        if radius == 0:
+            return [center]
+        cells = []
+        for d_lat in range(-radius, radius + 1):
+            row = lat_index + d_lat
+            if row < 0 or row >= self.lat_cells:
+                continue
+            step = 1 if abs(d_lat) == radius else 2 * radius
+            for d_lon in range(-radius, radius + 1, step):
+                cells.append((row, (lon_index + d_lon) % self.lon_cells))
+        return cells
+
+    def _ring_lower_bound_km(self, location: Sequence[float], radius: int) -> float:
+        """Lower bound on the distance from location to any cell outside the first `radius` rings."""
+        span = math.radians(min(180.0, radius * self.cell_degrees))
+        max_lat = math.radians(min(90.0, abs(location[0]) + (radius + 1) * self.cell_degrees))
+        along_meridian = EARTH_RADIUS_KM * span
+        across_meridians = 2 * EARTH_RADIUS_KM * math.asin(math.cos(max_lat) * math.sin(span / 2))
+        return min(along_meridian, across_meridians)
+
+    def nearest(self, location: Sequence[float], predicate: Optional[Callable[[Hashable], bool]] = None) -> Optional[Hashable]:
+        """Return the key nearest to location (by geodesic distance) among keys passing predicate."""
+        center = self._cell(location)
+        max_radius = max(self.lat_cells, self.lon_cells // 2)
+        candidates: List[Tuple[float, Hashable]] = []
+        best = math.inf
+        visited: Set[Cell] = set()
+
+        def visit(cell: Cell):
+            nonlocal best
+            visited.add(cell)
+            for key in self.buckets[cell]:
+                if predicate is not None and not predicate(key):
+                    continue
+                distance = haversine(location, self.locations[key])
+                candidates.append((distance, key))
+                best = min(best, distance)
+
+        radius = 0
+        while radius <= max_radius and len(visited) < len(self.buckets):
+            ring = self._ring(center, radius)
+            if len(ring) > len(self.buckets) - len(visited):
+                # Fewer occupied cells are left than the ring holds: visiting them all is cheaper and exact
+                for cell in [cell for cell in self.buckets if cell not in visited]:
+                    visit(cell)
+                break
+            for cell in ring:
+                if cell in self.buckets:
+                    visit(cell)
+            if best * GEODESIC_SLACK <= self._ring_lower_bound_km(location, radius):
+                break
+            radius += 1
+        shortlist = [key for distance, key in candidates if distance <= best * GEODESIC_SLACK]
+        if not shortlist:
+            return None
+        return min(shortlist, key=lambda key: geodesic(tuple(location), self.locations[key]).km)
+
+    def within_radius(self, location: Sequence[float], radius_km: float) -> Dict[Hashable, float]:
+        """Return {key: haversine km} for every key within radius_km of location."""
+        lat_span = radius_km / KM_PER_DEGREE
+        min_lat, max_lat = location[0] - lat_span, location[0] + lat_span
+        cos_lat = math.cos(math.radians(min(90.0, max(abs(min_lat), abs(max_lat)))))
+        lon_span = 180.0 if min_lat <= -90 or max_lat >= 90 or cos_lat <= 0 else min(180.0, lat_span / cos_lat)
+
+        first_row, _ = self._cell((max(min_lat, -90.0), 0.0))
+        last_row, _ = self._cell((min(max_lat, 90.0), 0.0))
+        lon_steps = min(self.lon_cells, math.ceil(2 * lon_span / self.cell_degrees) + 1)
+        box_size = (last_row - first_row + 1) * lon_steps
+
+        if box_size < len(self.buckets):
+            _, first_col = self._cell((0.0, location[1] - lon_span))
+            cells = [
+                (row, (first_col + step) % self.lon_cells)
+                for row in range(first_row, last_row + 1)
+                for step in range(lon_steps)
+            ]
+        else:
+            cells = [cell for cell in self.buckets if first_row <= cell[0] <= last_row]
+
+        found = {}
+        for cell in cells:
+            for key in self.buckets.get(cell, ()):
+                distance = haversine(location, self.locations[key])
+                if distance <= radius_km:
+                    found[key] = distance
+        return found
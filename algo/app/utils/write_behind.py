@@ -0,0 +1,194 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+from sqlalchemy import exc
+
+Changes = Dict[str, Any]
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """Whether a failed write may succeed unchanged once the database is reachable again."""
+    if isinstance(e, (OSError, asyncio.TimeoutError, exc.OperationalError, exc.InterfaceError, exc.TimeoutError)):
+        return True
+    return isinstance(e, exc.DBAPIError) and e.connection_invalidated
+
+
+class WriteBehindBuffer():
+    """
+    Coalesces row updates by key and writes them in batches.
+
+    Changes to the same key merge, latest value winning, until a flush: either `max_batch` keys are pending
+    or `max_delay` seconds passed since the first unflushed change. A key may carry the values its row is
+    expected to hold; `flush_batch` receives them with the batch and should only write rows that still match,
+    so a change made elsewhere in the meantime is not overwritten. `flush_batch` may return keys it could not
+    write and gave up on; those are counted as dropped.
+
+    A failed batch is merged back under any newer changes and retried, waiting twice as long after each
+    consecutive failure, up to `max_backoff` seconds. Failures for which `is_transient` holds, such as a lost
+    connection, are retried for as long as they last; other failures drop a key after `max_attempts`. `close`
+    flushes everything before returning.
+    """
+
+    def __init__(
+        self,
+        flush_batch: Callable[[Dict[Hashable, Changes], Dict[Hashable, Changes]], Awaitable[Optional[Iterable[Hashable]]]],
+        max_batch: int = 500,
+        max_delay: float = 0.2,
+        max_attempts: int = 5,
+        max_backoff: float = 30.0,
+        is_transient: Callable[[BaseException], bool] = is_transient_error
+    ):
+        self.flush_batch = flush_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.is_transient = is_transient
+        # Flushes failed in a row; retries back off until one succeeds
+        self._failures = 0
+        self.pending: Dict[Hashable, Changes] = {}
+        # Values each pending row is expected to hold before its changes apply, as given by its first put
+        self.expected: Dict[Hashable, Changes] = {}
+        self._attempts: Dict[Hashable, int] = {}
+        self._inflight: Dict[Hashable, Changes] = {}
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._full_flush: Optional[asyncio.Task] = None
+        self._metrics = {
+            "flushes": 0,
+            "failed_flushes": 0,
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def changes_for(self, key: Hashable) -> Changes:
+        """Changes accepted for key but possibly not yet visible in the database."""
+        return {**self._inflight.get(key, {}), **self.pending.get(key, {})}
+
+    async def put(self, key: Hashable, changes: Changes, expected: Optional[Changes] = None):
+        if key not in self.pending and expected is not None:
+            self.expected[key] = expected
+        self.pending.setdefault(key, {}).update(changes)
+        # While backing off the retry timer is already set, and a full buffer waits for it too
+        if len(self.pending) >= self.max_batch and not self._failures:
+            # Flushed in the background so a failing write never raises into whoever queued the change
+            if self._full_flush is None or self._full_flush.done():
+                self._full_flush = asyncio.create_task(self._flush_logged())
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later(self.max_delay))
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        self._timer = None
+        await self._flush_logged()
+
+    async def _flush_logged(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            delay = min(self.max_backoff, self.max_delay * 2 ** min(self._failures, 20))
+            print(f"Write-behind flush failed {self._failures} times in a row, retrying in {delay:.1f}s: {str(e)}")
+            if self.pending and self._timer is None:
+                self._timer = asyncio.create_task(self._flush_later(delay))
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, {}
+            expected, self.expected = self.expected, {}
+            self._inflight = batch
+            start = time.perf_counter()
+            try:
+                given_up = await self.flush_batch(batch, expected)
+            except BaseException as e:
+                # Also on cancellation: writes are guarded by their expected values, so rewriting a partly
+                # applied batch is safe. Only failures that retrying cannot fix count towards max_attempts.
+                if isinstance(e, Exception):
+                    self._failures += 1
+                self._metrics["failed_flushes"] += 1
+                dropped = []
+                for key, changes in batch.items():
+                    if isinstance(e, Exception) and not self.is_transient(e):
+                        self._attempts[key] = self._attempts.get(key, 0) + 1
+                        if self._attempts[key] >= self.max_attempts:
+                            dropped.append(key)
+                            continue
+                    self.pending[key] = {**changes, **self.pending.get(key, {})}
+                    if key in expected:
+                        self.expected[key] = expected[key]
+                for key in dropped:
+                    # Changes queued since are kept, guarded by the expectation they were queued with
+                    del self._attempts[key]
+                if dropped:
+                    self._metrics["rows_dropped"] += len(dropped)
+                    print(f"Error: write-behind dropped {len(dropped)} rows after {self.max_attempts} attempts: {str(e)}")
+                raise
+            finally:
+                self._inflight = {}
+            self._failures = 0
+            for key in batch:
+                self._attempts.pop(key, None)
+            self._record_flush(len(batch), given_up, start)
+
+    async def write_through(self, batch: Dict[Hashable, Changes], expected: Dict[Hashable, Changes]):
+        """
+        Write changes now, in one flush_batch call, instead of waiting for the next flush.
+
+        Keys that already have changes pending are queued behind them, so the row ends up with the latest
+        value. If the write fails, its changes are queued too and retried like any other.
+        """
+        async with self._lock:
+            queued = [key for key in batch if key in self.pending]
+            direct = {key: changes for key, changes in batch.items() if key not in self.pending}
+            if direct:
+                start = time.perf_counter()
+                try:
+                    given_up = await self.flush_batch(direct, {key: expected[key] for key in direct if key in expected})
+                except Exception as e:
+                    self._metrics["failed_flushes"] += 1
+                    print(f"Writing {len(direct)} rows through failed, queueing them: {str(e)}")
+                    queued += list(direct)
+                else:
+                    self._record_flush(len(direct), given_up, start)
+        for key in queued:
+            await self.put(key, batch[key], expected.get(key))
+
+    def _record_flush(self, size: int, given_up: Optional[Iterable[Hashable]], start: float):
+        given_up = list(given_up or ())
+        if given_up:
+            self._metrics["rows_dropped"] += len(given_up)
+            print(f"Error: write-behind dropped {len(given_up)} rows that could not be written")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._metrics["flushes"] += 1
+        self._metrics["rows_written"] += size - len(given_up)
+        self._metrics["last_batch_size"] = size
+        self._metrics["max_batch_size"] = max(self._metrics["max_batch_size"], size)
+        self._metrics["last_flush_ms"] = elapsed_ms
+        self._metrics["max_flush_ms"] = max(self._metrics["max_flush_ms"], elapsed_ms)
+        self._metrics["total_flush_ms"] += elapsed_ms
+
+    async def close(self):
+        """Flush every pending change; used on shutdown so accepted writes are never dropped."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._full_flush is not None:
+            await self._full_flush
+            self._full_flush = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        flushes = self._metrics["flushes"]
+        return {
+            **self._metrics,
+            "pending": len(self.pending),
+            "avg_batch_size": self._metrics["rows_written"] / flushes if flushes else 0.0,
+            "avg_flush_ms": self._metrics["total_flush_ms"] / flushes if flushes else 0.0,
+        }
@@ -0,0 +1,111 @@
+"""
+Latency of the login lookup (users by email) in a collection of a million users, with and without the
+email index.
+
+Seeds USERS users with insert_many (sharing one precomputed password hash, since hashing a million
+passwords would dominate the run), creates the startup indexes, then times LOOKUPS find_one calls by a
+random seeded email with the login projection, once through the index and once forced to a collection
+scan with a $natural hint, as before the index existed. Prints latency percentiles and the documents
+each plan examines.
+
+Needs MONGODB_URI and AUTH_DB_NAME pointing at a scratch database; the seeded users, all with emails
+under bench-<tag>-, are deleted at the end.
+
+Run from auth/app: python -m benchmarks.bench_login_lookup [--users 1000000] [--lookups 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from uuid import uuid4
+
+import bcrypt
+
+# Documents per insert_many
+INSERT_BATCH = 10_000
+# Collection scans take long on a million users, so they are timed on fewer lookups
+SCAN_LOOKUPS = 20
+
+
+def percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def seed(db, tag: str, users: int):
+    password = bcrypt.hashpw(b"bench-password", bcrypt.gensalt()).decode('utf-8')
+    roles = ["Donor", "Beneficiary", "Volunteer"]
+    started = time.perf_counter()
+    for start in range(0, users, INSERT_BATCH):
+        await db.users.insert_many([
+            {
+                "_id": str(uuid4()),
+                "email": f"bench-{tag}-{i}@example.com",
+                "password": password,
+                "company_name": f"bench-{tag}-{i}",
+                "name": "Bench",
+                "phone_number": "tel:+65-9123-4567",
+                "role": random.choice(roles),
+                "is_verified": random.random() < 0.5,
+                "is_superuser": False,
+            }
+            for i in range(start, min(start + INSERT_BATCH, users))
+        ], ordered=False)
+    print(f"seeded {users:,} users in {time.perf_counter() - started:.1f} s")
+
+
+async def time_lookups(db, tag: str, users: int, lookups: int, hint=None):
+    from services.userServices import LOGIN_PROJECTION
+
+    latencies = []
+    for _ in range(lookups):
+        email = f"bench-{tag}-{random.randrange(users)}@example.com"
+        cursor = db.users.find({"email": email}, LOGIN_PROJECTION).limit(1)
+        if hint is not None:
+            cursor = cursor.hint(hint)
+        started = time.perf_counter()
+        found = await cursor.to_list(1)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if not found:
+            raise RuntimeError(f"{email} not found")
+    return sorted(latencies)
+
+
+async def docs_examined(db, tag: str, hint=None) -> int:
+    command = {"find": "users", "filter": {"email": f"bench-{tag}-0@example.com"}, "limit": 1}
+    if hint is not None:
+        command["hint"] = hint
+    explain = await db.command({"explain": command, "verbosity": "executionStats"})
+    return explain["executionStats"]["totalDocsExamined"]
+
+
+async def run(users: int, lookups: int):
+    from dependencies import create_mongo_client
+    from services.userServices import ensure_user_indexes
+
+    client = create_mongo_client(os.getenv("MONGODB_URI"))
+    db = client[os.getenv("AUTH_DB_NAME")]
+    tag = uuid4().hex[:8]
+    try:
+        await ensure_user_indexes(db)
+        await seed(db, tag, users)
+        for label, hint, count in [("email index", None, lookups), ("collection scan", {"$natural": 1}, min(lookups, SCAN_LOOKUPS))]:
+            latencies = await time_lookups(db, tag, users, count, hint)
+            print(f"{label:<16} p50 {percentile(latencies, 0.5):8.2f} ms, p95 {percentile(latencies, 0.95):8.2f} ms, "
+                  f"p99 {percentile(latencies, 0.99):8.2f} ms, {await docs_examined(db, tag, hint):,} documents examined ({count} lookups)")
+    finally:
+        result = await db.users.delete_many({"email": {"$regex": f"^bench-{tag}-"}})
+        print(f"deleted {result.deleted_count:,} seeded users")
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=1_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.lookups))
+
+
+if __name__ == "__main__":
+    main()
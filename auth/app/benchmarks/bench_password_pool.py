@@ -0,0 +1,97 @@
+"""
+Latency of password checks through the bcrypt thread pool, without a database or HTTP in the way.
+
+For each concurrency level, runs that many clients calling verify_password back to back for DURATION
+seconds and reports checks/s, p50/p95/p99 latency of successful checks, how many were refused with 503
+(PASSWORD_HASH_QUEUE_LIMIT) and the longest the event loop went without running a 1 ms ticker. With
+--inline, checks call bcrypt.checkpw on the event loop instead, as before the pool existed.
+
+Set PASSWORD_HASH_WORKERS and PASSWORD_HASH_QUEUE_LIMIT in the environment to try other pool sizes.
+
+Run from auth/app: python -m benchmarks.bench_password_pool [--concurrency 1,4,16,64] [--duration 5] [--inline]
+"""
+import argparse
+import asyncio
+import time
+
+import bcrypt
+from fastapi import HTTPException
+
+PASSWORD = "bench-password"
+
+
+def percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def measure(concurrency: int, duration: float, check):
+    """
+    Run concurrency clients calling check() until duration is up.
+    Returns (successful checks/s, sorted latencies of successful checks in ms, checks refused, longest loop stall in ms).
+    """
+    deadline = time.perf_counter() + duration
+    latencies, refused, stall = [], 0, 0.0
+
+    async def ticker():
+        nonlocal stall
+        last = time.perf_counter()
+        while time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall = max(stall, (now - last) * 1000)
+            last = now
+
+    async def client_loop():
+        nonlocal refused
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if not await check():
+                    raise RuntimeError("password check failed")
+            except HTTPException:
+                refused += 1
+                # Back off like a client honouring Retry-After would, rather than spinning on the loop
+                await asyncio.sleep(0.01)
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(ticker(), *(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, sorted(latencies), refused, stall
+
+
+async def run(concurrency_levels, duration: float, inline: bool):
+    from services import passwordServices
+
+    hashed = await passwordServices.hash_password(PASSWORD)
+    if inline:
+        async def check():
+            return bcrypt.checkpw(PASSWORD.encode('utf-8'), hashed.encode('utf-8'))
+        print("bcrypt on the event loop")
+    else:
+        async def check():
+            return await passwordServices.verify_password(PASSWORD, hashed)
+        print(f"bcrypt on {passwordServices.PASSWORD_HASH_WORKERS} pool threads, "
+              f"queue limit {passwordServices.PASSWORD_HASH_QUEUE_LIMIT}")
+    try:
+        for concurrency in concurrency_levels:
+            rate, latencies, refused, stall = await measure(concurrency, duration, check)
+            print(f"concurrency {concurrency:>4}: {rate:>7,.1f} checks/s, p50 {percentile(latencies, 0.5):.1f} / "
+                  f"p95 {percentile(latencies, 0.95):.1f} / p99 {percentile(latencies, 0.99):.1f} ms, "
+                  f"{refused} refused with 503, longest loop stall {stall:.1f} ms")
+    finally:
+        passwordServices.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run([int(level) for level in args.concurrency.split(",")], args.duration, args.inline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Throughput of POST /api/users/login and GET /api/users/me on a running auth service.
+
+Registers USERS accounts through the API, then for each endpoint runs CONCURRENCY clients back to back
+for DURATION seconds and reports requests/s and latency percentiles of successful requests, plus how
+many were shed with 503 by the password hashing pool (PASSWORD_HASH_QUEUE_LIMIT). Run it once against a
+build with the synchronous pymongo client and once against the current one, with the same uvicorn
+worker count, to compare: --save writes a run's figures to a JSON file, and --baseline reads such a file
+and prints each figure next to the one it saved. With a blocking driver, adding concurrency adds latency
+instead of throughput, and a login storm delays /me as well.
+
+Point it at a scratch database: the accounts it registers use emails under loadtest-<tag>-.
+With MONGODB_URI and AUTH_DB_NAME set, they are deleted at the end.
+
+Run from auth/app: python -m benchmarks.load_test_users --url http://localhost:8000 [--concurrency 1,16,64] [--duration 10]
+    [--save results.json] [--baseline before.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from uuid import uuid4
+
+import httpx
+
+USERS = 50
+PASSWORD = "loadtest-password"
+
+
+async def register_users(client: httpx.AsyncClient, tag: str):
+    emails = [f"loadtest-{tag}-{i}@example.com" for i in range(USERS)]
+    for i, email in enumerate(emails):
+        response = await client.post("/api/users/", json={
+            "email": email,
+            "password": PASSWORD,
+            "company_name": f"loadtest-{tag}-{i}",
+            "name": "Load Test",
+            "phone_number": "+6591234567",
+            "role": "Beneficiary",
+        })
+        response.raise_for_status()
+    return emails
+
+
+async def login(client: httpx.AsyncClient, email: str) -> str:
+    response = await client.post("/api/users/login", json={"email": email, "password": PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def percentile(ordered, fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+async def measure(concurrency: int, duration: float, request):
+    """
+    Run concurrency clients calling request(i) until duration is up.
+    Returns (successful requests/s, sorted latencies of successful requests in ms, requests shed with 503).
+    """
+    deadline = time.perf_counter() + duration
+    latencies, shed = [], 0
+
+    async def client_loop(n: int):
+        nonlocal shed
+        i = n
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await request(i)
+            i += concurrency
+            if response.status_code == 503:
+                shed += 1
+                continue
+            if response.status_code != 200:
+                raise RuntimeError(f"request failed with {response.status_code}: {response.text}")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client_loop(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return len(latencies) / elapsed, sorted(latencies), shed
+
+
+async def cleanup(tag: str):
+    if not os.getenv("MONGODB_URI") or not os.getenv("AUTH_DB_NAME"):
+        print(f"MONGODB_URI or AUTH_DB_NAME not set; delete users with emails under loadtest-{tag}- yourself")
+        return
+    from dependencies import create_mongo_client
+
+    client = create_mongo_client(os.getenv("MONGODB_URI"))
+    result = await client[os.getenv("AUTH_DB_NAME")].users.delete_many({"email": {"$regex": f"^loadtest-{tag}-"}})
+    client.close()
+    print(f"deleted {result.deleted_count} load test users")
+
+
+def compared(value: float, before, unit: str, fmt: str) -> str:
+    text = f"{value:{fmt}}"
+    if before is not None:
+        change = f", {(value - before) / before * 100:+.0f}%" if before else ""
+        text += f" (was {before:{fmt.lstrip('<>^0123456789')}}{unit}{change})"
+    return text
+
+
+async def run(url: str, concurrency_levels, duration: float, baseline: dict):
+    tag = uuid4().hex[:8]
+    results = {}
+    limits = httpx.Limits(max_connections=max(concurrency_levels), max_keepalive_connections=max(concurrency_levels))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        emails = await register_users(client, tag)
+        try:
+            tokens = [await login(client, email) for email in emails]
+            endpoints = {
+                "POST /api/users/login": lambda i: client.post("/api/users/login", json={"email": emails[i % USERS], "password": PASSWORD}),
+                "GET /api/users/me": lambda i: client.get("/api/users/me", headers={"Authorization": f"Bearer {tokens[i % USERS]}"}),
+            }
+            for label, request in endpoints.items():
+                for concurrency in concurrency_levels:
+                    rate, latencies, shed = await measure(concurrency, duration, request)
+                    key = f"{label} @{concurrency}"
+                    figures = {"rate": rate, "p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95),
+                               "p99": percentile(latencies, 0.99), "shed": shed}
+                    before = baseline.get(key, {})
+                    print(f"{label:<22} concurrency {concurrency:>4}: "
+                          f"{compared(rate, before.get('rate'), '', '>8,.0f')} requests/s, "
+                          + " / ".join(f"{p} {compared(figures[p], before.get(p), ' ms', '.1f')}" for p in ("p50", "p95", "p99"))
+                          + f" ms, {shed} shed with 503")
+                    results[key] = figures
+        finally:
+            await cleanup(tag)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", default="1,16,64")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--save", help="write this run's figures to a JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier --save to compare against")
+    args = parser.parse_args()
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = asyncio.run(run(args.url, [int(level) for level in args.concurrency.split(",")], args.duration, baseline))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,36 @@
 import os
 
-from pymongo.mongo_client import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from pymongo.server_api import ServerApi
 
-from pymongo.database import Database
-from fastapi import Depends
+from fastapi import Depends, Request
 
+# Connection pool of the shared client, per worker process
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# How long a request waits for a free connection before failing
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
 
-def get_mongo_client() -> MongoClient:
-    mongodb_uri = os.getenv('MONGODB_URI')
-    return MongoClient(mongodb_uri, server_api=ServerApi('1'))
 
+def create_mongo_client(mongodb_uri: str) -> AsyncIOMotorClient:
+    """
+    Build the one client a worker shares across requests; call from the startup hook.
+    """
+    return AsyncIOMotorClient(
+        mongodb_uri,
+        server_api=ServerApi('1'),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    )
 
-def get_database(client: MongoClient = Depends(get_mongo_client)) -> Database:
+
+def get_mongo_client(request: Request) -> AsyncIOMotorClient:
+    return request.app.mongodb_client
+
+
+def get_database(client: AsyncIOMotorClient = Depends(get_mongo_client)) -> AsyncIOMotorDatabase:
     db_name = os.getenv('AUTH_DB_NAME')
     return client[db_name]
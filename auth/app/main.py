@@ -4,9 +4,10 @@ from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-
+from dependencies import create_mongo_client
+from services import passwordServices
+from services.tokenServices import ensure_refresh_token_indexes
+from services.userServices import ensure_user_indexes
 from routes.userRoutes import router as user_router
 from routes.adminRoutes import router as admin_router
 
@@ -25,7 +26,7 @@ app.add_middleware(
 
 
 @app.on_event('startup')
-def startup_db_client():
+async def startup_db_client():
     mongodb_uri = os.getenv('MONGODB_URI')
     db_name = os.getenv('AUTH_DB_NAME')
 
@@ -33,21 +34,30 @@ def startup_db_client():
         raise ValueError(
             "MONGODB_URI and DB_NAME must be set in the environment variables.")
 
-    # Create a new client and connect to the server
-    app.mongodb_client = MongoClient(mongodb_uri, server_api=ServerApi('1'))
+    # Create the client shared by every request and connect to the server
+    app.mongodb_client = create_mongo_client(mongodb_uri)
     app.database = app.mongodb_client[db_name]
 
     # Send a ping to confirm a successful connection
     try:
-        app.mongodb_client.admin.command('ping')
+        await app.mongodb_client.admin.command('ping')
         print("Pinged your deployment. You successfully connected to MongoDB!")
     except Exception as e:
         print(e)
 
+    # Registration relies on the unique email index, so the service does not start without it
+    try:
+        await ensure_user_indexes(app.database)
+        await ensure_refresh_token_indexes(app.database)
+    except Exception as e:
+        print(f"Could not create the auth indexes, refusing to start: {e}")
+        raise
+
 
 @app.on_event("shutdown")
-def shutdown_db_client():
+async def shutdown_db_client():
     app.mongodb_client.close()
+    passwordServices.shutdown()
 
 
 @app.get("/health")
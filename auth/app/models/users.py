@@ -14,6 +14,11 @@ class Role(str, Enum):
     volunteer = "Volunteer"
 
 
+class TokenType(str, Enum):
+    access = "access"
+    refresh = "refresh"
+
+
 class UserBase(BaseModel):
     email: EmailStr = Field(max_length=255)
     is_verified: bool = False
@@ -59,6 +64,11 @@ class User(UserBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 
 class TokenData(BaseModel):
@@ -71,3 +81,14 @@ class TokenData(BaseModel):
     is_superuser: bool = Field(...,
                                description="Whether the user has superuser privileges")
     exp: datetime = Field(..., description="Expiration time of the token")
+    iat: Optional[datetime] = Field(None, description="Time the token was issued")
+    typ: TokenType = Field(TokenType.access, description="Always access")
+
+
+class RefreshTokenData(BaseModel):
+    sub: UUID = Field(..., description="The unique identifier for the user")
+    jti: UUID = Field(default_factory=uuid4, description="The unique identifier of this refresh token")
+    family: UUID = Field(default_factory=uuid4,
+                         description="Shared by every token rotated from the same login")
+    exp: datetime = Field(..., description="Expiration time of the token")
+    typ: TokenType = Field(TokenType.refresh, description="Always refresh")
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from dependencies import get_database
-from models.users import User, Role
+from models.users import User, Role, TokenData
 from services import userServices
 
 router = APIRouter(prefix="/api/admin", tags=['admin'])
@@ -11,13 +11,13 @@ router = APIRouter(prefix="/api/admin", tags=['admin'])
 @router.post("/promote/{user_id}", response_model=User)
 async def promote_user_to_superuser(
     user_id: str,
-    db: Database = Depends(get_database),
-    current_user: User = Depends(userServices.get_current_active_superuser)
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    current_user: TokenData = Depends(userServices.get_current_active_superuser)
 ):
     """
     Admins only. Promote a user to superuser.
     """
-    user = userServices.get_user_by_id(db, user_id)
+    user = await userServices.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -26,24 +26,24 @@ async def promote_user_to_superuser(
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="User is already an admin")
 
-    db.users.update_one({"_id": user_id}, {
-                        "$set": {"is_superuser": True}})
+    await db.users.update_one({"_id": user_id}, {
+                              "$set": {"is_superuser": True}})
+    userServices.invalidate_user(user_id)
 
-    updated_user = userServices.get_user_by_id(db, user_id)
+    updated_user = await userServices.get_user_by_id(db, user_id)
     return updated_user
 
 
 @router.post("/verify-donor/{user_id}", response_model=User)
 async def verify_donor(
     user_id: str,
-    db: Database = Depends(get_database),
-    current_user: User = Depends(userServices.get_current_active_superuser)
+    db: AsyncIOMotorDatabase = Depends(get_database),
+    current_user: TokenData = Depends(userServices.get_current_active_superuser)
 ):
     """
     Admins only. Verify a donor.
     """
-    user = userServices.get_user_by_id(db, user_id)
-    print("ver", user.role)
+    user = await userServices.get_user_by_id(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -52,8 +52,9 @@ async def verify_donor(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="Only donors can be verified")
 
-    db.users.update_one({"_id": user_id}, {
-                        "$set": {"is_verified": True}})
+    await db.users.update_one({"_id": user_id}, {
+                              "$set": {"is_verified": True}})
+    userServices.invalidate_user(user_id)
 
-    updated_user = userServices.get_user_by_id(db, user_id)
+    updated_user = await userServices.get_user_by_id(db, user_id)
     return updated_user
@@ -1,20 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from dependencies import get_database
-from models.users import User, UserRegister, Token, UserLogin
-from services import userServices
+from models.users import User, UserRegister, Token, UserLogin, RefreshRequest
+from services import userServices, tokenServices
 
 router = APIRouter(prefix="/api/users", tags=['users'])
 
 
 @router.post("/", response_model=User, status_code=status.HTTP_201_CREATED)
-async def register_user(user_create: UserRegister, db: Database = Depends(get_database)):
+async def register_user(user_create: UserRegister, db: AsyncIOMotorDatabase = Depends(get_database)):
     """
     Controller to register a new user.
     Calls the create_user service and handles the response.
     """
-    response = userServices.create_user(db, user_create)
+    response = await userServices.create_user(db, user_create)
 
     if not response["success"]:
         raise HTTPException(
@@ -33,11 +33,11 @@ async def register_user(user_create: UserRegister, db: Database = Depends(get_da
 
 
 @router.post("/login")
-async def login(user_login: UserLogin, db: Database = Depends(get_database)):
+async def login(user_login: UserLogin, db: AsyncIOMotorDatabase = Depends(get_database)):
     """
     Authenticate a user by their email and password.
     """
-    user = userServices.authenticate_user(db, user_login)
+    user = await userServices.authenticate_user(db, user_login)
 
     if not user:
         raise HTTPException(
@@ -47,8 +47,30 @@ async def login(user_login: UserLogin, db: Database = Depends(get_database)):
         )
 
     access_token = userServices.create_access_token(user)
+    refresh_token = await tokenServices.issue_refresh_token(db, user)
 
-    return Token(access_token=access_token, token_type="Bearer")
+    return Token(access_token=access_token, token_type="Bearer", refresh_token=refresh_token)
+
+
+@router.post("/refresh")
+async def refresh(refresh_request: RefreshRequest, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Exchange a refresh token for a new access token and a new refresh token, without the password.
+    The refresh token sent can not be used again.
+    """
+    user, refresh_token = await tokenServices.rotate_refresh_token(db, refresh_request.refresh_token)
+
+    access_token = userServices.create_access_token(user)
+
+    return Token(access_token=access_token, token_type="Bearer", refresh_token=refresh_token)
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(refresh_request: RefreshRequest, db: AsyncIOMotorDatabase = Depends(get_database)):
+    """
+    Revoke the refresh token and every refresh token rotated from the same login.
+    """
+    await tokenServices.revoke_refresh_token_family(db, refresh_request.refresh_token)
 
 
 @router.get("/me", response_model=User)
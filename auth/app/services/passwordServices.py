@@ -0,0 +1,70 @@
+import bcrypt
+import os
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, status
+
+
+# bcrypt releases the GIL while hashing, so threads run hashes in parallel
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hashes running or waiting for a thread beyond which new ones are refused with 503
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", "64"))
+PASSWORD_HASH_RETRY_AFTER_SECONDS = 1
+
+executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+in_flight = 0
+# Slots are released on the pool thread that finished the hash, so the count is guarded
+in_flight_lock = threading.Lock()
+
+
+def _release(_future):
+    global in_flight
+    with in_flight_lock:
+        in_flight -= 1
+
+
+async def _run(function, *args):
+    """
+    Run a bcrypt call on the hashing pool, keeping the event loop free.
+    Raises a 503 when PASSWORD_HASH_QUEUE_LIMIT calls are already running or queued.
+
+    A call's slot is held until its hash finishes, not until the awaiting request stops waiting: a cancelled
+    request leaves the thread hashing, and that still counts against the limit.
+    """
+    global in_flight
+    with in_flight_lock:
+        if in_flight >= PASSWORD_HASH_QUEUE_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many password checks in progress, please try again shortly",
+                headers={"Retry-After": str(PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+            )
+        in_flight += 1
+    try:
+        future = executor.submit(function, *args)
+    except BaseException:
+        _release(None)
+        raise
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hash a password with a new salt.
+    """
+    hashed = await _run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt())
+    return hashed.decode('utf-8')
+
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    """
+    Check a password against its stored hash.
+    """
+    return await _run(bcrypt.checkpw, password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def shutdown():
+    executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,93 @@
+import jwt
+
+from typing import Optional, Tuple
+from uuid import UUID
+from fastapi import HTTPException, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models.users import User, TokenType, RefreshTokenData
+from services.userServices import ALGORITHM, JWT_PUBLIC_KEY, create_refresh_token, get_user_by_id
+
+
+async def ensure_refresh_token_indexes(db: AsyncIOMotorDatabase):
+    """
+    Index refresh tokens by family, and let MongoDB delete each one once it has expired.
+    """
+    await db.refresh_tokens.create_index("family")
+    await db.refresh_tokens.create_index("expires_at", expireAfterSeconds=0)
+
+
+async def issue_refresh_token(db: AsyncIOMotorDatabase, user: User, family: Optional[UUID] = None) -> str:
+    """
+    Create a refresh token and record it as unused.
+    """
+    token, token_data = create_refresh_token(user, family)
+    await db.refresh_tokens.insert_one({
+        "_id": str(token_data.jti),
+        "family": str(token_data.family),
+        "user_id": str(user.id),
+        "expires_at": token_data.exp,
+        "used": False,
+    })
+    return token
+
+
+def decode_refresh_token(token: str) -> RefreshTokenData:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    try:
+        payload = jwt.decode(token, JWT_PUBLIC_KEY, algorithms=[ALGORITHM])
+        if payload.get('typ') != TokenType.refresh:
+            raise credentials_exception
+        return RefreshTokenData(**payload)
+
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Refresh token has expired",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except (jwt.InvalidTokenError, ValueError):
+        raise credentials_exception
+
+
+async def rotate_refresh_token(db: AsyncIOMotorDatabase, token: str) -> Tuple[User, str]:
+    """
+    Exchange a refresh token for its user and a new refresh token in the same family.
+
+    Each refresh token can be exchanged once. Presenting one that was already exchanged means it was
+    copied, so its whole family is revoked and the holder must log in again.
+    """
+    token_data = decode_refresh_token(token)
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    record = await db.refresh_tokens.find_one_and_update(
+        {"_id": str(token_data.jti), "used": False}, {"$set": {"used": True}})
+
+    if record is None:
+        if await db.refresh_tokens.find_one({"_id": str(token_data.jti)}, {"_id": 1}):
+            print(f"Refresh token reuse for user {token_data.sub}, revoking family {token_data.family}")
+            await db.refresh_tokens.delete_many({"family": str(token_data.family)})
+        raise credentials_exception
+
+    user = await get_user_by_id(db, str(token_data.sub))
+    if not user:
+        raise credentials_exception
+
+    return user, await issue_refresh_token(db, user, token_data.family)
+
+
+async def revoke_refresh_token_family(db: AsyncIOMotorDatabase, token: str):
+    """
+    Revoke a refresh token and every token rotated from the same login.
+    """
+    token_data = decode_refresh_token(token)
+    await db.refresh_tokens.delete_many({"family": str(token_data.family)})
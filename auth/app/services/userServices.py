@@ -1,17 +1,21 @@
-import bcrypt
 import base64
 import jwt
 import os
+import time
+from collections import OrderedDict
 from uuid import uuid4, UUID
 
-from typing import Dict, Any, Annotated
+from typing import Dict, Any, Annotated, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
 
 from dependencies import get_database
-from models.users import UserRegister, UserLogin, User, Role, TokenData
+from services.passwordServices import hash_password, verify_password
+from models.users import UserRegister, UserLogin, User, Role, TokenData, TokenType, RefreshTokenData
 
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
@@ -19,8 +23,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/users/login")
 
 # ALGORITHM = "HS256"
 ALGORITHM = "RS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
-REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
+# Access tokens are short-lived; clients renew them at /api/users/refresh instead of logging in again
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_MINUTES = int(os.getenv("REFRESH_TOKEN_EXPIRE_MINUTES", str(60 * 24 * 7)))
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_REFRESH_SECRET_KEY = os.getenv("JWT_REFRESH_SECRET_KEY")
 
@@ -28,16 +33,34 @@ JWT_PRIVATE_KEY = base64.b64decode(
     os.getenv("JWT_PRIVATE_KEY")).decode('utf-8')
 JWT_PUBLIC_KEY = base64.b64decode(os.getenv("JWT_PUBLIC_KEY")).decode('utf-8')
 
+# Authorise from the signed claims alone, without reading the user, unless their privileges changed since
+TRUST_TOKEN_CLAIMS = os.getenv("TRUST_TOKEN_CLAIMS", "true").lower() == "true"
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
 
-def create_user(db: Database, user: UserRegister) -> Dict[str, Any]:
+# Fields each lookup reads: profiles never carry the password hash, which only login needs
+PROFILE_PROJECTION = {"password": 0}
+LOGIN_PROJECTION = {"_id": 1, "email": 1, "password": 1, "company_name": 1, "name": 1,
+                    "phone_number": 1, "role": 1, "is_verified": 1, "is_superuser": 1}
+
+
+async def ensure_user_indexes(db: AsyncIOMotorDatabase):
+    """
+    Create the users indexes if missing: unique emails for registration and login, and role and
+    verification status for admin listings.
+    """
+    await db.users.create_index([("email", ASCENDING)], unique=True, name="email_unique")
+    await db.users.create_index([("role", ASCENDING), ("is_verified", ASCENDING)], name="role_is_verified")
+
+
+async def create_user(db: AsyncIOMotorDatabase, user: UserRegister) -> Dict[str, Any]:
     """
     Create a user using DI
     """
-    if db.users.find_one({"email": user.email}):
+    if await db.users.find_one({"email": user.email}, {"_id": 1}):
         return {"success": False, "error": "Email already registered"}
 
-    hashed_password = bcrypt.hashpw(
-        user.password.get_secret_value().encode('utf-8'), bcrypt.gensalt())
+    hashed_password = await hash_password(user.password.get_secret_value())
 
     if user.role != Role.donor:
         is_verified = True
@@ -50,7 +73,7 @@ def create_user(db: Database, user: UserRegister) -> Dict[str, Any]:
     user = {
         "_id": str(uuid4()),
         "email": user.email,
-        "password": hashed_password.decode('utf-8'),
+        "password": hashed_password,
         "company_name": user.company_name,
         "name": user.name,
         "phone_number": user.phone_number,
@@ -60,18 +83,21 @@ def create_user(db: Database, user: UserRegister) -> Dict[str, Any]:
     }
 
     try:
-        result = db.users.insert_one(user)
+        result = await db.users.insert_one(user)
+    except DuplicateKeyError:
+        # Registered concurrently, after the check above
+        return {"success": False, "error": "Email already registered"}
     except Exception as e:
         return {"success": False, "error": f"Failed to create user: {str(e)}"}
 
     return {"success": True, "id": str(result.inserted_id), "message": "User created successfully"}
 
 
-def get_user_by_id(db: Database, id: str) -> User:
+async def get_user_by_id(db: AsyncIOMotorDatabase, id: str) -> User:
     """
     Retrieve a user by ID.
     """
-    user = db.users.find_one({"_id": id})
+    user = await db.users.find_one({"_id": id}, PROFILE_PROJECTION)
 
     if not user:
         return False
@@ -81,16 +107,16 @@ def get_user_by_id(db: Database, id: str) -> User:
     return User(**user)
 
 
-def authenticate_user(db: Database, user_login: UserLogin):
+async def authenticate_user(db: AsyncIOMotorDatabase, user_login: UserLogin):
     """
     Authenticate a user by email and password.
     """
-    user = db.users.find_one({"email": user_login.email})
+    user = await db.users.find_one({"email": user_login.email}, LOGIN_PROJECTION)
 
     if not user:
         return False
 
-    if not bcrypt.checkpw(user_login.password.get_secret_value().encode('utf-8'), user["password"].encode('utf-8')):
+    if not await verify_password(user_login.password.get_secret_value(), user["password"]):
         return False
 
     user["_id"] = UUID(user["_id"])
@@ -98,8 +124,78 @@ def authenticate_user(db: Database, user_login: UserLogin):
     return User(**user)
 
 
+class UserCache():
+    """
+    LRU cache of user id -> User, each entry kept for ttl seconds, and the time each user last changed.
+
+    Changes are only known to this worker; elsewhere they show once cached users and tokens expire.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[User, float]]" = OrderedDict()
+        self.changed_at: Dict[str, float] = {}
+
+    def get(self, user_id: str) -> Optional[User]:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return entry[0]
+
+    def put(self, user: User):
+        if self.max_size <= 0:
+            return
+        self.entries[str(user.id)] = (user, time.monotonic() + self.ttl)
+        self.entries.move_to_end(str(user.id))
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        now = time.time()
+        self.entries.pop(user_id, None)
+        self.changed_at[user_id] = now
+        # Every token issued before a change older than the access token lifetime has expired
+        horizon = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        for stale in [id for id, changed in self.changed_at.items() if changed < horizon]:
+            del self.changed_at[stale]
+
+    def changed_since(self, user_id: str, issued_at: float) -> bool:
+        return self.changed_at.get(user_id, 0) >= issued_at
+
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+
+def invalidate_user(user_id: str):
+    """
+    Call after changing a user, so neither the cached user nor tokens issued before are trusted.
+
+    Only this worker forgets them: other workers keep serving the cached user for up to USER_CACHE_TTL_SECONDS
+    and, with TRUST_TOKEN_CLAIMS, accept tokens issued before the change until they expire.
+    """
+    user_cache.invalidate(user_id)
+
+
+async def load_user(db: AsyncIOMotorDatabase, user_id: str) -> User:
+    """
+    Retrieve a user by ID through the user cache.
+    """
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await get_user_by_id(db, user_id)
+        if user:
+            user_cache.put(user)
+    return user
+
+
 def create_access_token(user: User):
-    expire = datetime.now(timezone.utc) + \
+    now = datetime.now(timezone.utc)
+    expire = now + \
         timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
 
     token_data = TokenData(
@@ -111,6 +207,7 @@ def create_access_token(user: User):
         is_verified=user.is_verified,
         is_superuser=user.is_superuser,
         exp=expire,
+        iat=now,
     )
 
     payload = token_data.dict()
@@ -123,33 +220,32 @@ def create_access_token(user: User):
     return encoded_jwt
 
 
-def create_refresh_token(user: User) -> str:
+def create_refresh_token(user: User, family: Optional[UUID] = None) -> Tuple[str, RefreshTokenData]:
+    """
+    Create a refresh token, in a new family unless rotating one. It only carries ids: the claims of the
+    access tokens it is exchanged for are read from the user at that time.
+    """
     expire = datetime.now(timezone.utc) + \
         timedelta(minutes=REFRESH_TOKEN_EXPIRE_MINUTES)
 
-    token_data = TokenData(
-        sub=user.id,
-        email=user.email,
-        company_name=user.company_name,
-        name=user.name,
-        role=user.role,
-        is_verified=user.is_verified,
-        is_superuser=user.is_superuser,
-        exp=expire,
-    )
+    token_data = RefreshTokenData(sub=user.id, exp=expire)
+    if family is not None:
+        token_data.family = family
+
     payload = token_data.dict()
-    payload['sub'] = str(payload['sub'])
+    for claim in ('sub', 'jti', 'family'):
+        payload[claim] = str(payload[claim])
 
     encoded_jwt = jwt.encode(
         payload,
         JWT_PRIVATE_KEY,
         algorithm=ALGORITHM)
-    return encoded_jwt
+    return encoded_jwt, token_data
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Database = Depends(get_database)) -> User:
+def decode_access_token(token: str) -> Dict[str, Any]:
     """
-    Retrieve the current user from the JWT token.
+    Verify an access token and return its claims.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -161,14 +257,12 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Da
         payload = jwt.decode(token, JWT_PUBLIC_KEY,
                              algorithms=[ALGORITHM])
 
-        user_id = UUID(payload['sub'])
-
-        user = db.users.find_one({"_id": str(user_id)})
-
-        if not user:
+        if payload.get('typ') == TokenType.refresh:
             raise credentials_exception
 
-        return user
+        payload['sub'] = str(UUID(payload['sub']))
+
+        return payload
 
     except jwt.ExpiredSignatureError:
         raise HTTPException(
@@ -176,12 +270,60 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: Da
             detail="Token has expired",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    except jwt.InvalidTokenError:
+    except (jwt.InvalidTokenError, KeyError, ValueError):
         raise credentials_exception
 
 
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncIOMotorDatabase = Depends(get_database)) -> User:
+    """
+    Retrieve the current user from the JWT token, through the user cache.
+    """
+    payload = decode_access_token(token)
+
+    user = await load_user(db, payload['sub'])
+
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    return user
+
+
+async def get_current_claims(token: Annotated[str, Depends(oauth2_scheme)], db: AsyncIOMotorDatabase = Depends(get_database)) -> TokenData:
+    """
+    Retrieve who the current user is and what they may do.
+
+    With TRUST_TOKEN_CLAIMS this is read from the signed token without touching the database, unless the
+    user changed after the token was issued or the token predates the iat claim; then the user is loaded.
+    """
+    payload = decode_access_token(token)
+
+    if TRUST_TOKEN_CLAIMS and 'iat' in payload and not user_cache.changed_since(payload['sub'], payload['iat']):
+        try:
+            return TokenData(**payload)
+        except ValueError:
+            pass
+
+    user = await get_current_user(token, db)
+
+    return TokenData(
+        sub=user.id,
+        email=user.email,
+        company_name=user.company_name,
+        name=user.name,
+        role=user.role,
+        is_verified=user.is_verified,
+        is_superuser=user.is_superuser,
+        exp=payload['exp'],
+        iat=payload.get('iat'),
+    )
+
+
 async def get_current_active_user(
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[TokenData, Depends(get_current_claims)],
 ):
     """
     Ensure the current user is active.
@@ -193,7 +335,7 @@ async def get_current_active_user(
 
 
 async def get_current_active_superuser(
-    current_user: Annotated[User, Depends(get_current_user)],
+    current_user: Annotated[TokenData, Depends(get_current_claims)],
 ):
     """
     Ensure the current user is active.